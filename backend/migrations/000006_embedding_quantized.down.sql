@@ -0,0 +1,2 @@
+ALTER TABLE product_embeddings DROP COLUMN IF EXISTS embedding_q_dtype;
+ALTER TABLE product_embeddings DROP COLUMN IF EXISTS embedding_q;
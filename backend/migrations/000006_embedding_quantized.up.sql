@@ -0,0 +1,3 @@
+-- Компактное представление эмбеддинга (float16 или int8 + scale), заполняется app.quantize_embeddings
+ALTER TABLE product_embeddings ADD COLUMN IF NOT EXISTS embedding_q BYTEA;
+ALTER TABLE product_embeddings ADD COLUMN IF NOT EXISTS embedding_q_dtype VARCHAR(8);
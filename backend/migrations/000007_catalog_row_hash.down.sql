@@ -0,0 +1,3 @@
+DROP INDEX IF EXISTS idx_promos_promo_product;
+ALTER TABLE promos DROP COLUMN IF EXISTS row_hash;
+ALTER TABLE products DROP COLUMN IF EXISTS row_hash;
@@ -0,0 +1,5 @@
+-- Хэш нормализованной строки фида, по нему delta-импорт (data/load_data.py --mode delta) находит изменения
+ALTER TABLE products ADD COLUMN IF NOT EXISTS row_hash CHAR(32);
+ALTER TABLE promos ADD COLUMN IF NOT EXISTS row_hash CHAR(32);
+
+CREATE INDEX IF NOT EXISTS idx_promos_promo_product ON promos(promo_id, product_id);
@@ -0,0 +1,40 @@
+DROP TABLE IF EXISTS recommendation_event_daily;
+
+ALTER TABLE recommendation_events RENAME TO recommendation_events_partitioned;
+
+CREATE TABLE recommendation_events (
+    id SERIAL PRIMARY KEY,
+    user_id INT REFERENCES users(id),
+    session_id VARCHAR(255),
+    event_type VARCHAR(20) NOT NULL,
+    main_product_id INT REFERENCES products(id) NOT NULL,
+    recommended_product_id INT REFERENCES products(id) NOT NULL,
+    recommendation_context VARCHAR(50),
+    recommendation_rank INT,
+    created_at TIMESTAMP DEFAULT NOW(),
+
+    CONSTRAINT event_user_or_session CHECK (user_id IS NOT NULL OR session_id IS NOT NULL)
+);
+
+INSERT INTO recommendation_events
+    (id, user_id, session_id, event_type, main_product_id, recommended_product_id,
+     recommendation_context, recommendation_rank, created_at)
+SELECT id, user_id, session_id, event_type, main_product_id, recommended_product_id,
+       recommendation_context, recommendation_rank, created_at
+FROM recommendation_events_partitioned;
+
+SELECT setval(
+    pg_get_serial_sequence('recommendation_events', 'id'),
+    COALESCE((SELECT MAX(id) FROM recommendation_events), 0) + 1,
+    false
+);
+
+DROP TABLE recommendation_events_partitioned;
+ALTER SEQUENCE IF EXISTS recommendation_events_id_seq1 RENAME TO recommendation_events_id_seq;
+
+CREATE INDEX idx_recommendation_events_user ON recommendation_events(user_id);
+CREATE INDEX idx_recommendation_events_session ON recommendation_events(session_id);
+CREATE INDEX idx_recommendation_events_type ON recommendation_events(event_type);
+CREATE INDEX idx_recommendation_events_main_product ON recommendation_events(main_product_id);
+CREATE INDEX idx_recommendation_events_created_at ON recommendation_events(created_at);
+CREATE INDEX idx_recommendation_events_main_recommended ON recommendation_events(main_product_id, recommended_product_id, event_type);
@@ -0,0 +1,87 @@
+-- recommendation_events: дневные партиции по created_at вместо одной таблицы с шестью индексами.
+-- Партиции создаёт и удаляет по retention сервис рекомендаций (app.services.event_maintenance).
+ALTER TABLE recommendation_events RENAME TO recommendation_events_legacy;
+
+DROP INDEX IF EXISTS idx_recommendation_events_user;
+DROP INDEX IF EXISTS idx_recommendation_events_session;
+DROP INDEX IF EXISTS idx_recommendation_events_type;
+DROP INDEX IF EXISTS idx_recommendation_events_main_product;
+DROP INDEX IF EXISTS idx_recommendation_events_created_at;
+DROP INDEX IF EXISTS idx_recommendation_events_main_recommended;
+
+CREATE TABLE recommendation_events (
+    id BIGSERIAL,
+    user_id INT REFERENCES users(id),
+    session_id VARCHAR(255),
+    event_type VARCHAR(20) NOT NULL,
+    main_product_id INT REFERENCES products(id) NOT NULL,
+    recommended_product_id INT REFERENCES products(id) NOT NULL,
+    recommendation_context VARCHAR(50),
+    recommendation_rank INT,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+
+    CONSTRAINT recommendation_events_user_or_session CHECK (user_id IS NOT NULL OR session_id IS NOT NULL)
+) PARTITION BY RANGE (created_at);
+
+-- Страховка на случай, если партиция на нужный день ещё не создана
+CREATE TABLE recommendation_events_default PARTITION OF recommendation_events DEFAULT;
+
+-- Единственный индекс: BRIN почти ничего не стоит на вставке, rollup читает партицию целиком
+CREATE INDEX idx_recommendation_events_created_at ON recommendation_events USING BRIN (created_at);
+
+DO $$
+DECLARE
+    day DATE;
+BEGIN
+    FOR day IN
+        SELECT generate_series(
+            COALESCE((SELECT MIN(created_at)::date FROM recommendation_events_legacy), CURRENT_DATE),
+            CURRENT_DATE + 7,
+            INTERVAL '1 day'
+        )::date
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF recommendation_events FOR VALUES FROM (%L) TO (%L)',
+            'recommendation_events_p' || to_char(day, 'YYYYMMDD'), day, day + 1
+        );
+    END LOOP;
+END $$;
+
+INSERT INTO recommendation_events
+    (id, user_id, session_id, event_type, main_product_id, recommended_product_id,
+     recommendation_context, recommendation_rank, created_at)
+SELECT id, user_id, session_id, event_type, main_product_id, recommended_product_id,
+       recommendation_context, recommendation_rank, COALESCE(created_at, NOW())
+FROM recommendation_events_legacy;
+
+SELECT setval(
+    pg_get_serial_sequence('recommendation_events', 'id'),
+    COALESCE((SELECT MAX(id) FROM recommendation_events), 0) + 1,
+    false
+);
+
+DROP TABLE recommendation_events_legacy;
+ALTER SEQUENCE IF EXISTS recommendation_events_id_seq1 RENAME TO recommendation_events_id_seq;
+
+-- Дневной rollup для CTR-признаков и аналитики
+CREATE TABLE IF NOT EXISTS recommendation_event_daily (
+    main_product_id INT NOT NULL,
+    recommended_product_id INT NOT NULL,
+    day DATE NOT NULL,
+    impressions INT NOT NULL DEFAULT 0,
+    clicks INT NOT NULL DEFAULT 0,
+    add_to_cart INT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (main_product_id, recommended_product_id, day)
+);
+
+CREATE INDEX IF NOT EXISTS idx_recommendation_event_daily_day ON recommendation_event_daily(day);
+
+INSERT INTO recommendation_event_daily
+    (main_product_id, recommended_product_id, day, impressions, clicks, add_to_cart)
+SELECT main_product_id, recommended_product_id, created_at::date,
+       COUNT(*) FILTER (WHERE event_type = 'impression'),
+       COUNT(*) FILTER (WHERE event_type = 'click'),
+       COUNT(*) FILTER (WHERE event_type = 'add_to_cart')
+FROM recommendation_events
+GROUP BY main_product_id, recommended_product_id, created_at::date;
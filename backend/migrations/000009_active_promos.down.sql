@@ -0,0 +1,4 @@
+DROP FUNCTION IF EXISTS refresh_active_promos();
+DROP TABLE IF EXISTS active_promos_snapshot;
+DROP TABLE IF EXISTS active_promos;
+DROP INDEX IF EXISTS idx_promos_product_dates;
@@ -0,0 +1,46 @@
+-- Поиск активной акции товара по диапазону дат
+CREATE INDEX IF NOT EXISTS idx_promos_product_dates ON promos(product_id, start_date, end_date);
+
+-- Снапшот активных скидок на дату: product_id -> discount_price.
+-- Запросы каталога соединяются с ним по первичному ключу вместо join по диапазону дат.
+CREATE TABLE IF NOT EXISTS active_promos (
+    product_id INT PRIMARY KEY,
+    discount_price DECIMAL(10,2) NOT NULL
+);
+
+-- Дата, на которую собран снапшот (одна строка)
+CREATE TABLE IF NOT EXISTS active_promos_snapshot (
+    id BOOLEAN PRIMARY KEY DEFAULT true CHECK (id),
+    snapshot_date DATE NOT NULL,
+    refreshed_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- Пересборка снапшота; вызывается после импорта скидок и на смене дня.
+-- Читатели до коммита видят предыдущий снапшот.
+CREATE OR REPLACE FUNCTION refresh_active_promos() RETURNS INT AS $$
+DECLARE
+    total INT;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('active_promos'));
+
+    DELETE FROM active_promos;
+
+    INSERT INTO active_promos (product_id, discount_price)
+    SELECT DISTINCT ON (product_id) product_id, discount_price
+    FROM promos
+    WHERE product_id IS NOT NULL
+      AND discount_price IS NOT NULL
+      AND start_date <= CURRENT_DATE
+      AND end_date >= CURRENT_DATE
+    ORDER BY product_id, start_date DESC, id DESC;
+    GET DIAGNOSTICS total = ROW_COUNT;
+
+    INSERT INTO active_promos_snapshot (id, snapshot_date, refreshed_at)
+    VALUES (true, CURRENT_DATE, NOW())
+    ON CONFLICT (id) DO UPDATE SET snapshot_date = EXCLUDED.snapshot_date, refreshed_at = EXCLUDED.refreshed_at;
+
+    RETURN total;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT refresh_active_promos();
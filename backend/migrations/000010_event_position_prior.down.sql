@@ -0,0 +1,3 @@
+ALTER TABLE recommendation_event_daily
+    DROP COLUMN IF EXISTS expected_clicks,
+    DROP COLUMN IF EXISTS expected_add_to_cart;
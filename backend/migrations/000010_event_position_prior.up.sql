@@ -0,0 +1,35 @@
+-- Ожидаемые клики и добавления в корзину пары за день: сумма средних CTR/ATC позиций,
+-- на которых её показали (позиции глубже 50 — одна корзина). Из них сервис считает
+-- CTR с поправкой на позицию (clicks / expected_clicks) для признаков и меток ранкера.
+ALTER TABLE recommendation_event_daily
+    ADD COLUMN IF NOT EXISTS expected_clicks DOUBLE PRECISION NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS expected_add_to_cart DOUBLE PRECISION NOT NULL DEFAULT 0;
+
+-- Дни, для которых сырые события ещё не удалены по retention
+WITH position_prior AS (
+    SELECT created_at::date AS day,
+           LEAST(COALESCE(recommendation_rank, 0), 50) AS rank,
+           COUNT(*) FILTER (WHERE event_type = 'click')::float8
+               / NULLIF(COUNT(*) FILTER (WHERE event_type = 'impression'), 0) AS click_rate,
+           COUNT(*) FILTER (WHERE event_type = 'add_to_cart')::float8
+               / NULLIF(COUNT(*) FILTER (WHERE event_type = 'impression'), 0) AS add_to_cart_rate
+    FROM recommendation_events
+    GROUP BY 1, 2
+),
+expected AS (
+    SELECT e.main_product_id, e.recommended_product_id, e.created_at::date AS day,
+           COALESCE(SUM(p.click_rate), 0) AS expected_clicks,
+           COALESCE(SUM(p.add_to_cart_rate), 0) AS expected_add_to_cart
+    FROM recommendation_events e
+    JOIN position_prior p
+        ON p.day = e.created_at::date AND p.rank = LEAST(COALESCE(e.recommendation_rank, 0), 50)
+    WHERE e.event_type = 'impression'
+    GROUP BY 1, 2, 3
+)
+UPDATE recommendation_event_daily d
+SET expected_clicks = x.expected_clicks,
+    expected_add_to_cart = x.expected_add_to_cart
+FROM expected x
+WHERE d.main_product_id = x.main_product_id
+  AND d.recommended_product_id = x.recommended_product_id
+  AND d.day = x.day;
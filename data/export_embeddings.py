@@ -1,14 +1,24 @@
 #!/usr/bin/env python3
 """
-Экспорт эмбеддингов из PostgreSQL в CSV файл.
-Запуск: python export_embeddings.py
+Экспорт эмбеддингов из PostgreSQL.
+Запуск: python export_embeddings.py [--format npy|csv]
+
+npy (по умолчанию) — три файла рядом:
+  embeddings.npy       float32 матрица n x d
+  embeddings_ids.npy   int32 product_id в порядке строк матрицы
+  embeddings_text.jsonl text_representation, по строке JSON на вектор
+Матрица пишется через memmap блоками, память не растёт с размером каталога.
+Сервис рекомендаций может читать эти файлы напрямую (EMBEDDINGS_FILE).
 
 Для импорта на другой машине: python import_embeddings.py
 """
 
+import argparse
 import csv
+import json
 import psycopg2
 import os
+import numpy as np
 
 DB_CONFIG = {
     "host": "localhost",
@@ -19,6 +29,15 @@ DB_CONFIG = {
 }
 
 OUTPUT_FILE = "data/embeddings.csv"
+OUTPUT_NPY = "data/embeddings.npy"
+
+
+def ids_path(matrix_path: str) -> str:
+    return matrix_path[:-len(".npy")] + "_ids.npy"
+
+
+def text_path(matrix_path: str) -> str:
+    return matrix_path[:-len(".npy")] + "_text.jsonl"
 
 
 def export_embeddings():
@@ -59,5 +78,74 @@ def export_embeddings():
     print(f"File size: {file_size:.2f} MB")
 
 
+def export_embeddings_npy(output_file: str = OUTPUT_NPY, batch_size: int = 5000):
+    print(f"Connecting to PostgreSQL at {DB_CONFIG['host']}:{DB_CONFIG['port']}...")
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    # COUNT и выборка должны видеть один снимок: размер memmap задаётся заранее
+    conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM product_embeddings WHERE embedding IS NOT NULL")
+        total = cursor.fetchone()[0]
+    print(f"Total embeddings to export: {total}")
+
+    if total == 0:
+        conn.close()
+        return
+
+    # Серверный курсор — строки приходят пачками по batch_size
+    cursor = conn.cursor(name="export_embeddings")
+    cursor.itersize = batch_size
+    cursor.execute("""
+        SELECT product_id, embedding, text_representation
+        FROM product_embeddings
+        WHERE embedding IS NOT NULL
+        ORDER BY product_id
+    """)
+
+    matrix = None
+    ids = np.lib.format.open_memmap(ids_path(output_file), mode="w+", dtype=np.int32, shape=(total,))
+    count = 0
+
+    with open(text_path(output_file), "w", encoding="utf-8") as text_file:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+
+            block = np.asarray([row[1] for row in rows], dtype=np.float32)
+            if matrix is None:
+                matrix = np.lib.format.open_memmap(
+                    output_file, mode="w+", dtype=np.float32, shape=(total, block.shape[1])
+                )
+
+            matrix[count:count + len(rows)] = block
+            ids[count:count + len(rows)] = [row[0] for row in rows]
+            text_file.writelines(json.dumps(row[2], ensure_ascii=False) + "\n" for row in rows)
+
+            count += len(rows)
+            print(f"Progress: {count}/{total}")
+
+    matrix.flush()
+    ids.flush()
+    cursor.close()
+    conn.close()
+
+    file_size = sum(os.path.getsize(p) for p in (output_file, ids_path(output_file), text_path(output_file)))
+    print(f"Exported {count} x {matrix.shape[1]} embeddings to {output_file}")
+    print(f"File size: {file_size / 1024 / 1024:.2f} MB")
+
+
 if __name__ == "__main__":
-    export_embeddings()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--format", choices=["npy", "csv"], default="npy")
+    parser.add_argument("--output", help=f"Путь к файлу (по умолчанию {OUTPUT_NPY} / {OUTPUT_FILE})")
+    args = parser.parse_args()
+
+    if args.format == "npy":
+        export_embeddings_npy(args.output or OUTPUT_NPY)
+    else:
+        if args.output:
+            OUTPUT_FILE = args.output
+        export_embeddings()
@@ -1,13 +1,21 @@
 #!/usr/bin/env python3
 """
-Импорт эмбеддингов из CSV файла в PostgreSQL.
-Запуск: python import_embeddings.py
+Импорт эмбеддингов в PostgreSQL.
+Запуск: python import_embeddings.py [--input data/embeddings.npy]
 
-Предварительно нужен файл embeddings.csv (из export_embeddings.py)
+Берёт embeddings.npy (из export_embeddings.py), если он есть, иначе embeddings.csv.
+npy заливается через COPY в бинарном формате: матрица читается через memmap
+блоками и кодируется в wire-формат Postgres векторно, без float() по элементам.
 """
 
+import argparse
 import csv
+import io
+import json
+import os
+import struct
 import psycopg2
+import numpy as np
 
 DB_CONFIG = {
     "host": "localhost",
@@ -18,13 +26,22 @@ DB_CONFIG = {
 }
 
 INPUT_FILE = "data/embeddings.csv"
+INPUT_NPY = "data/embeddings.npy"
 
+FLOAT8_OID = 701
+PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+PGCOPY_TRAILER = struct.pack(">h", -1)
 
-def import_embeddings():
-    print(f"Connecting to PostgreSQL at {DB_CONFIG['host']}:{DB_CONFIG['port']}...")
-    conn = psycopg2.connect(**DB_CONFIG)
-    cursor = conn.cursor()
 
+def ids_path(matrix_path: str) -> str:
+    return matrix_path[:-len(".npy")] + "_ids.npy"
+
+
+def text_path(matrix_path: str) -> str:
+    return matrix_path[:-len(".npy")] + "_text.jsonl"
+
+
+def create_table(cursor):
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS product_embeddings (
             product_id INTEGER PRIMARY KEY,
@@ -33,6 +50,14 @@ def import_embeddings():
             created_at TIMESTAMP DEFAULT NOW()
         )
     """)
+
+
+def import_embeddings():
+    print(f"Connecting to PostgreSQL at {DB_CONFIG['host']}:{DB_CONFIG['port']}...")
+    conn = psycopg2.connect(**DB_CONFIG)
+    cursor = conn.cursor()
+
+    create_table(cursor)
     conn.commit()
 
     cursor.execute("SELECT COUNT(*) FROM product_embeddings")
@@ -70,5 +95,147 @@ def import_embeddings():
     print(f"Done! Imported: {imported}")
 
 
+def binary_copy_rows(ids: np.ndarray, matrix: np.ndarray) -> bytes:
+    """Кодирует блок (product_id INT, embedding FLOAT8[]) в строки бинарного COPY."""
+    n, dim = matrix.shape
+    row_dtype = np.dtype([
+        ("nfields", ">i2"),
+        ("id_len", ">i4"), ("id", ">i4"),
+        ("array_len", ">i4"), ("ndim", ">i4"), ("has_nulls", ">i4"), ("elem_oid", ">i4"),
+        ("dim", ">i4"), ("lower_bound", ">i4"),
+        ("elems", [("len", ">i4"), ("value", ">f8")], (dim,)),
+    ])
+    rows = np.empty(n, dtype=row_dtype)
+    rows["nfields"] = 2
+    rows["id_len"] = 4
+    rows["id"] = ids
+    rows["array_len"] = 20 + 12 * dim
+    rows["ndim"] = 1
+    rows["has_nulls"] = 0
+    rows["elem_oid"] = FLOAT8_OID
+    rows["dim"] = dim
+    rows["lower_bound"] = 1
+    rows["elems"]["len"] = 8
+    rows["elems"]["value"] = matrix
+    return rows.tobytes()
+
+
+class _BinaryCopyStream:
+    """File-like для COPY FROM STDIN (FORMAT binary): отдаёт матрицу блоками."""
+
+    def __init__(self, ids: np.ndarray, matrix: np.ndarray, block_size: int):
+        self._blocks = self._generate(ids, matrix, block_size)
+        self._pending = b""
+        self._pos = 0
+
+    @staticmethod
+    def _generate(ids, matrix, block_size):
+        yield PGCOPY_HEADER
+        for start in range(0, len(ids), block_size):
+            yield binary_copy_rows(ids[start:start + block_size], matrix[start:start + block_size])
+            print(f"Progress: {min(start + block_size, len(ids))}/{len(ids)}")
+        yield PGCOPY_TRAILER
+
+    def read(self, size: int = -1) -> bytes:
+        if self._pos >= len(self._pending):
+            self._pending = next(self._blocks, b"")
+            self._pos = 0
+        if size < 0:
+            size = len(self._pending)
+        out = self._pending[self._pos:self._pos + size]
+        self._pos += len(out)
+        return out
+
+
+class _TextCopyStream:
+    """File-like для COPY (FORMAT csv): product_id + text_representation из jsonl построчно."""
+
+    def __init__(self, ids: np.ndarray, lines):
+        self._rows = zip(ids.tolist(), lines)
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+
+    def read(self, size: int = -1) -> str:
+        for product_id, line in self._rows:
+            self._writer.writerow([product_id, json.loads(line)])
+            if self._buffer.tell() >= max(size, 1 << 16):
+                break
+        data = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return data
+
+
+def import_embeddings_npy(input_file: str = INPUT_NPY, block_size: int = 5000):
+    matrix = np.load(input_file, mmap_mode="r")
+    ids = np.load(ids_path(input_file), mmap_mode="r")
+    if matrix.ndim != 2 or len(ids) != len(matrix):
+        raise ValueError(f"{input_file}: ожидается матрица n x d и {len(matrix)} id, получено {len(ids)}")
+
+    print(f"Connecting to PostgreSQL at {DB_CONFIG['host']}:{DB_CONFIG['port']}...")
+    conn = psycopg2.connect(**DB_CONFIG)
+
+    with conn.cursor() as cursor:
+        create_table(cursor)
+
+        cursor.execute("""
+            SELECT COUNT(*) FROM information_schema.columns
+            WHERE table_name = 'product_embeddings' AND column_name = 'embedding_q'
+        """)
+        has_quantized = cursor.fetchone()[0] > 0
+
+        print(f"Loading {input_file}: {matrix.shape[0]} x {matrix.shape[1]}...")
+        cursor.execute("""
+            CREATE TEMP TABLE embeddings_staging (
+                product_id INTEGER,
+                embedding DOUBLE PRECISION[]
+            ) ON COMMIT DROP
+        """)
+        cursor.copy_expert(
+            "COPY embeddings_staging (product_id, embedding) FROM STDIN WITH (FORMAT binary)",
+            _BinaryCopyStream(ids, matrix, block_size),
+            size=1 << 20,
+        )
+
+        cursor.execute("""
+            CREATE TEMP TABLE embeddings_text_staging (
+                product_id INTEGER,
+                text_representation TEXT
+            ) ON COMMIT DROP
+        """)
+        if os.path.exists(text_path(input_file)):
+            with open(text_path(input_file), "r", encoding="utf-8") as f:
+                cursor.copy_expert(
+                    "COPY embeddings_text_staging FROM STDIN WITH (FORMAT csv)",
+                    _TextCopyStream(ids, f),
+                )
+
+        # Квантованная копия от старого вектора больше не валидна
+        reset_quantized = ", embedding_q = NULL, embedding_q_dtype = NULL" if has_quantized else ""
+        cursor.execute(f"""
+            INSERT INTO product_embeddings (product_id, embedding, text_representation)
+            SELECT e.product_id, e.embedding, t.text_representation
+            FROM embeddings_staging e
+            LEFT JOIN embeddings_text_staging t ON t.product_id = e.product_id
+            ON CONFLICT (product_id) DO UPDATE
+            SET embedding = EXCLUDED.embedding,
+                text_representation = EXCLUDED.text_representation{reset_quantized}
+        """)
+        imported = cursor.rowcount
+    conn.commit()
+    conn.close()
+
+    print(f"Done! Imported: {imported}")
+
+
 if __name__ == "__main__":
-    import_embeddings()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", help=f"npy или csv (по умолчанию {INPUT_NPY}, если есть, иначе {INPUT_FILE})")
+    args = parser.parse_args()
+
+    path = args.input or (INPUT_NPY if os.path.exists(INPUT_NPY) else INPUT_FILE)
+    if path.endswith(".npy"):
+        import_embeddings_npy(path)
+    else:
+        INPUT_FILE = path
+        import_embeddings()
@@ -1,6 +1,12 @@
 import os
+import io
 import csv
 import json
+import hashlib
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from decimal import Decimal
 from datetime import datetime
 import psycopg2
@@ -35,14 +41,51 @@ PRODUCT_COLUMNS = {
     "weight",
 }
 
+# Порядок колонок совпадает с кортежем из _parse_product_row
+PRODUCT_COPY_COLUMNS = [
+    "id",
+    "category_id",
+    "name",
+    "url",
+    "price",
+    "currency",
+    "picture",
+    "vendor",
+    "country",
+    "description",
+    "market_description",
+    "weight",
+    "available",
+    "params",
+    "row_hash",
+]
+
+# Порядок колонок совпадает с кортежем из _parse_promo_row
+PROMO_COPY_COLUMNS = [
+    "promo_id",
+    "product_id",
+    "promo_type",
+    "discount_price",
+    "start_date",
+    "end_date",
+    "description",
+    "url",
+    "row_hash",
+]
+
 
 def get_connection():
     """Создаёт подключение к PostgreSQL."""
     return psycopg2.connect(**DB_CONFIG)
 
 
-def load_categories(conn, filepath: str):
-    """Загружает категории из CSV."""
+def _row_hash(values: tuple) -> str:
+    """md5 нормализованной строки — по нему delta-импорт находит изменённые записи."""
+    return hashlib.md5(json.dumps(values, default=str, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def load_categories(conn, filepath: str, truncate: bool = True):
+    """Загружает категории из CSV. truncate=False — upsert без каскадной очистки товаров."""
     print(f"Загрузка категорий из {filepath}...")
 
     with open(filepath, "r", encoding="utf-8-sig") as f:
@@ -59,7 +102,8 @@ def load_categories(conn, filepath: str):
 
     with conn.cursor() as cur:
         # Очищаем таблицу
-        cur.execute("TRUNCATE categories CASCADE")
+        if truncate:
+            cur.execute("TRUNCATE categories CASCADE")
 
         # Временно отключаем FK constraint
         cur.execute("ALTER TABLE categories DROP CONSTRAINT IF EXISTS categories_parent_id_fkey")
@@ -68,7 +112,10 @@ def load_categories(conn, filepath: str):
         # Вставляем все категории
         execute_values(
             cur,
-            "INSERT INTO categories (id, parent_id, name) VALUES %s ON CONFLICT (id) DO NOTHING",
+            """
+            INSERT INTO categories (id, parent_id, name) VALUES %s
+            ON CONFLICT (id) DO UPDATE SET parent_id = EXCLUDED.parent_id, name = EXCLUDED.name
+            """,
             categories
         )
         conn.commit()
@@ -84,6 +131,43 @@ def load_categories(conn, filepath: str):
     print(f"  Загружено {len(categories)} категорий")
 
 
+def _parse_product_row(row: dict, param_columns: list, valid_categories: set):
+    """
+    Преобразует строку CSV в кортеж для products (последний элемент — row_hash).
+    None — если категории нет в БД.
+    """
+    # Проверяем category_id
+    category_id = int(row["category_id"]) if row["category_id"] else None
+    if category_id and category_id not in valid_categories:
+        return None
+
+    # Собираем параметры в JSON
+    params = {}
+    for col in param_columns:
+        value = row.get(col, "").strip()
+        if value:
+            param_name = col.replace("param_", "")
+            params[param_name] = value
+
+    values = (
+        int(row["offer_id"]),                                      # id
+        category_id,                                               # category_id
+        row["name"][:500] if row["name"] else "Без названия",     # name
+        row.get("url", "")[:500] or None,                         # url
+        Decimal(row["price"]) if row["price"] else Decimal("0"),  # price
+        row.get("currency", "RUB")[:3] or "RUB",                  # currency
+        row.get("picture", "")[:500] or None,                     # picture
+        row.get("vendor", "")[:255] or None,                      # vendor
+        row.get("country_of_origin", "")[:100] or None,           # country
+        row.get("description") or None,                           # description
+        row.get("market_description") or None,                    # market_description
+        Decimal(row["weight"]) if row.get("weight") else None,    # weight
+        row.get("available", "true").lower() == "true",           # available
+        json.dumps(params, ensure_ascii=False) if params else "{}", # params
+    )
+    return values + (_row_hash(values),)
+
+
 def load_products(conn, filepath: str, batch_size: int = 1000):
     """Загружает товары из CSV."""
     print(f"Загрузка товаров из {filepath}...")
@@ -109,37 +193,11 @@ def load_products(conn, filepath: str, batch_size: int = 1000):
         param_columns = [c for c in columns if c.startswith("param_")]
 
         for row in reader:
-            # Проверяем category_id
-            category_id = int(row["category_id"]) if row["category_id"] else None
-            if category_id and category_id not in valid_categories:
+            product = _parse_product_row(row, param_columns, valid_categories)
+            if product is None:
                 skipped += 1
                 continue
 
-            # Собираем параметры в JSON
-            params = {}
-            for col in param_columns:
-                value = row.get(col, "").strip()
-                if value:
-                    param_name = col.replace("param_", "")
-                    params[param_name] = value
-
-            product = (
-                int(row["offer_id"]),                                      # id
-                category_id,                                               # category_id
-                row["name"][:500] if row["name"] else "Без названия",     # name
-                row.get("url", "")[:500] or None,                         # url
-                Decimal(row["price"]) if row["price"] else Decimal("0"),  # price
-                row.get("currency", "RUB")[:3] or "RUB",                  # currency
-                row.get("picture", "")[:500] or None,                     # picture
-                row.get("vendor", "")[:255] or None,                      # vendor
-                row.get("country_of_origin", "")[:100] or None,           # country
-                row.get("description") or None,                           # description
-                row.get("market_description") or None,                    # market_description
-                Decimal(row["weight"]) if row.get("weight") else None,    # weight
-                row.get("available", "true").lower() == "true",           # available
-                json.dumps(params, ensure_ascii=False) if params else "{}", # params
-            )
-
             batch.append(product)
 
             if len(batch) >= batch_size:
@@ -163,7 +221,7 @@ def _insert_products_batch(conn, batch):
             """
             INSERT INTO products (id, category_id, name, url, price, currency, picture,
                                   vendor, country, description, market_description,
-                                  weight, available, params)
+                                  weight, available, params, row_hash)
             VALUES %s
             ON CONFLICT (id) DO UPDATE SET
                 category_id = EXCLUDED.category_id,
@@ -178,13 +236,376 @@ def _insert_products_batch(conn, batch):
                 market_description = EXCLUDED.market_description,
                 weight = EXCLUDED.weight,
                 available = EXCLUDED.available,
-                params = EXCLUDED.params
+                params = EXCLUDED.params,
+                row_hash = EXCLUDED.row_hash,
+                updated_at = NOW()
             """,
             batch
         )
     conn.commit()
 
 
+class _CopyStream:
+    """File-like обёртка для COPY FROM STDIN поверх итератора готовых CSV-фрагментов."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._pending = ""
+        self._pos = 0
+
+    def read(self, size: int = -1) -> str:
+        # Пустая строка для COPY — это EOF: чанк, где все строки отброшены, пропускаем
+        while self._pos >= len(self._pending):
+            self._pending = next(self._chunks, None)
+            self._pos = 0
+            if self._pending is None:
+                self._pending = ""
+                return ""
+        if size < 0:
+            size = len(self._pending)
+        out = self._pending[self._pos:self._pos + size]
+        self._pos += len(out)
+        return out
+
+
+def _last_record_end(buf: bytes) -> int:
+    """
+    Позиция сразу после последнего перевода строки вне кавычек (0 — если такого нет).
+    buf начинается на границе записи; экранированные "" не меняют чётность кавычек.
+    """
+    quotes_before = buf.count(b'"')
+    end = len(buf)
+    while True:
+        nl = buf.rfind(b"\n", 0, end)
+        if nl < 0:
+            return 0
+        quotes_before -= buf.count(b'"', nl, end)
+        if quotes_before % 2 == 0:
+            return nl + 1
+        end = nl
+
+
+def _split_records(filepath: str, chunk_bytes: int) -> tuple[list, list]:
+    """Делит CSV на диапазоны байт ~chunk_bytes, выровненные по границам записей."""
+    with open(filepath, "rb") as f:
+        header = next(csv.reader([f.readline().decode("utf-8-sig")]))
+        pos = f.tell()
+        ranges = []
+        buf = b""
+        while True:
+            block = f.read(chunk_bytes)
+            buf += block
+            if not block:
+                if buf.strip():
+                    ranges.append((pos, pos + len(buf)))
+                break
+            cut = _last_record_end(buf)
+            if cut:
+                ranges.append((pos, pos + cut))
+                pos += cut
+                buf = buf[cut:]
+
+    return header, ranges
+
+
+_parse_state = {}
+
+
+def _init_parse_worker(filepath: str, kind: str, header: list, valid_ids: set):
+    """Инициализация процесса-парсера: справочники передаются один раз, а не с каждым чанком."""
+    _parse_state.update(
+        filepath=filepath,
+        kind=kind,
+        header=header,
+        param_columns=[c for c in header if c.startswith("param_")],
+        valid_ids=valid_ids,
+    )
+
+
+def _parse_chunk(byte_range: tuple) -> tuple[str, int, int]:
+    """Парсит диапазон байт файла. Возвращает (CSV для COPY, принято строк, пропущено строк)."""
+    start, end = byte_range
+    with open(_parse_state["filepath"], "rb") as f:
+        f.seek(start)
+        data = f.read(end - start).decode("utf-8")
+
+    reader = csv.DictReader(io.StringIO(data, newline=""), fieldnames=_parse_state["header"])
+    out = io.StringIO()
+    writer = csv.writer(out)
+    rows = skipped = 0
+
+    for row in reader:
+        if _parse_state["kind"] == "products":
+            parsed = _parse_product_row(row, _parse_state["param_columns"], _parse_state["valid_ids"])
+        else:
+            parsed = _parse_promo_row(row, _parse_state["valid_ids"])
+        if parsed is None:
+            skipped += 1
+            continue
+        writer.writerow(parsed)
+        rows += 1
+
+    return out.getvalue(), rows, skipped
+
+
+def _parsed_chunks(filepath: str, kind: str, valid_ids: set, counters: dict,
+                   workers: int = None, chunk_bytes: int = 4 << 20):
+    """
+    Генератор CSV-фрагментов для COPY. Чанки файла парсятся в пуле процессов,
+    порядок строк сохраняется (важно для «последняя строка побеждает» при дублях).
+    В работе держится не больше 2 * workers чанков — память ограничена.
+    """
+    workers = workers or os.cpu_count() or 1
+    header, ranges = _split_records(filepath, chunk_bytes)
+    initargs = (filepath, kind, header, valid_ids)
+
+    def account(result):
+        data, rows, skipped = result
+        counters["rows"] += rows
+        counters["skipped"] += skipped
+        return data
+
+    if workers == 1:
+        _init_parse_worker(*initargs)
+        for byte_range in ranges:
+            yield account(_parse_chunk(byte_range))
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_parse_worker, initargs=initargs) as pool:
+        pending = deque()
+        for byte_range in ranges:
+            pending.append(pool.submit(_parse_chunk, byte_range))
+            if len(pending) >= 2 * workers:
+                yield account(pending.popleft().result())
+        while pending:
+            yield account(pending.popleft().result())
+
+
+def _copy_products_to_staging(cur, filepath: str, valid_categories: set, workers: int = None) -> dict:
+    """Создаёт UNLOGGED products_staging и заливает в неё CSV через COPY FROM STDIN."""
+    counters = {"rows": 0, "skipped": 0}
+
+    cur.execute("DROP TABLE IF EXISTS products_staging")
+    cur.execute("""
+        CREATE UNLOGGED TABLE products_staging (
+            seq BIGSERIAL,
+            id INT,
+            category_id INT,
+            name VARCHAR(500),
+            url VARCHAR(500),
+            price DECIMAL(10,2),
+            currency VARCHAR(3),
+            picture VARCHAR(500),
+            vendor VARCHAR(255),
+            country VARCHAR(100),
+            description TEXT,
+            market_description TEXT,
+            weight DECIMAL(10,3),
+            available BOOLEAN,
+            params JSONB,
+            row_hash CHAR(32)
+        )
+    """)
+
+    cur.copy_expert(
+        f"COPY products_staging ({', '.join(PRODUCT_COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+        _CopyStream(_parsed_chunks(filepath, "products", valid_categories, counters, workers)),
+    )
+
+    return counters
+
+
+def load_products_copy(conn, filepath: str, workers: int = None):
+    """
+    Загружает товары через COPY в UNLOGGED staging-таблицу и один INSERT ... SELECT.
+    Всё, включая пересборку product_stats, выполняется в одной транзакции.
+    """
+    print(f"Загрузка товаров (COPY) из {filepath}...")
+    started = time.perf_counter()
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT id FROM categories")
+        valid_categories = {row[0] for row in cur.fetchall()}
+
+    with conn.cursor() as cur:
+        cur.execute("TRUNCATE products CASCADE")
+        counters = _copy_products_to_staging(cur, filepath, valid_categories, workers)
+        copied_at = time.perf_counter()
+
+        # При дублях offer_id берём последнюю строку файла, как и батчевый режим
+        cur.execute(f"""
+            INSERT INTO products ({', '.join(PRODUCT_COPY_COLUMNS)})
+            SELECT DISTINCT ON (id) {', '.join(PRODUCT_COPY_COLUMNS)}
+            FROM products_staging
+            ORDER BY id, seq DESC
+            ON CONFLICT (id) DO UPDATE SET
+                {', '.join(f"{c} = EXCLUDED.{c}" for c in PRODUCT_COPY_COLUMNS[1:])}
+        """)
+        merged = cur.rowcount
+
+        cur.execute("""
+            INSERT INTO product_stats (product_id)
+            SELECT id FROM products
+            ON CONFLICT (product_id) DO NOTHING
+        """)
+        cur.execute("DROP TABLE products_staging")
+    conn.commit()
+
+    elapsed = time.perf_counter() - started
+    rate = counters["rows"] / elapsed if elapsed > 0 else 0
+    print(f"  Загружено {merged} товаров, пропущено {counters['skipped']} (несуществующие категории)")
+    print(f"  COPY: {copied_at - started:.1f}s, всего: {elapsed:.1f}s, {rate:,.0f} строк/с")
+
+
+class MassDeactivationError(RuntimeError):
+    """Delta-импорт снял бы с продажи слишком большую долю каталога"""
+
+
+def load_products_delta(
+    conn,
+    filepath: str,
+    workers: int = None,
+    allow_mass_deactivate: bool = False,
+    max_deactivate_share: float = 0.2,
+) -> list[int]:
+    """
+    Delta-импорт товаров: сравнивает row_hash входящих строк с сохранёнными и применяет
+    только вставки, изменения и soft-delete (available = false) для пропавших из фида.
+    Изменённые товары попадают в outbox (переиндексация в Elasticsearch).
+    Возвращает ID изменённых товаров для перегенерации эмбеддингов.
+
+    Пустой или обрезанный фид (или фид, где большинство строк отброшено из-за неизвестных
+    категорий) снял бы с продажи почти весь каталог: если валидных строк нет или пропавших
+    товаров больше max_deactivate_share от доступных, импорт откатывается с
+    MassDeactivationError — без allow_mass_deactivate.
+    """
+    print(f"Delta-импорт товаров из {filepath}...")
+    started = time.perf_counter()
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT id FROM categories")
+        valid_categories = {row[0] for row in cur.fetchall()}
+
+    columns = ", ".join(PRODUCT_COPY_COLUMNS)
+
+    with conn.cursor() as cur:
+        counters = _copy_products_to_staging(cur, filepath, valid_categories, workers)
+
+        cur.execute(f"""
+            CREATE TEMP TABLE products_incoming ON COMMIT DROP AS
+            SELECT DISTINCT ON (id) {columns}
+            FROM products_staging
+            ORDER BY id, seq DESC
+        """)
+        cur.execute("ALTER TABLE products_incoming ADD PRIMARY KEY (id)")
+
+        if not allow_mass_deactivate:
+            cur.execute("""
+                SELECT count(*) FILTER (WHERE NOT EXISTS (SELECT 1 FROM products_incoming i WHERE i.id = p.id)),
+                       count(*)
+                FROM products p
+                WHERE p.available
+            """)
+            missing, available_total = cur.fetchone()
+            if counters["rows"] == 0 or missing > max_deactivate_share * available_total:
+                conn.rollback()
+                raise MassDeactivationError(
+                    f"Фид {filepath}: валидных строк {counters['rows']} (пропущено {counters['skipped']}), "
+                    f"снято бы с продажи {missing} из {available_total} товаров "
+                    f"(порог {max_deactivate_share:.0%}). Импорт отменён; "
+                    f"если это ожидаемо — запустите с --allow-mass-deactivate"
+                )
+
+        cur.execute(f"""
+            UPDATE products p SET
+                {', '.join(f"{c} = i.{c}" for c in PRODUCT_COPY_COLUMNS[1:])},
+                updated_at = NOW()
+            FROM products_incoming i
+            WHERE p.id = i.id
+              AND p.row_hash IS DISTINCT FROM i.row_hash
+            RETURNING p.id
+        """)
+        updated = [row[0] for row in cur.fetchall()]
+
+        cur.execute(f"""
+            INSERT INTO products ({columns})
+            SELECT {columns}
+            FROM products_incoming i
+            WHERE NOT EXISTS (SELECT 1 FROM products p WHERE p.id = i.id)
+            RETURNING id
+        """)
+        inserted = [row[0] for row in cur.fetchall()]
+
+        # row_hash сбрасываем, чтобы вернувшийся в фид товар гарантированно обновился
+        cur.execute("""
+            UPDATE products p SET available = false, row_hash = NULL, updated_at = NOW()
+            WHERE p.available
+              AND NOT EXISTS (SELECT 1 FROM products_incoming i WHERE i.id = p.id)
+            RETURNING p.id
+        """)
+        deactivated = [row[0] for row in cur.fetchall()]
+
+        cur.execute("""
+            INSERT INTO product_stats (product_id)
+            SELECT unnest(%s::int[])
+            ON CONFLICT (product_id) DO NOTHING
+        """, (inserted,))
+
+        cur.execute("""
+            INSERT INTO outbox (entity_type, entity_id, action)
+            SELECT 'product', id, action
+            FROM unnest(%s::int[], %s::text[]) AS t(id, action)
+        """, (
+            inserted + updated + deactivated,
+            ["create"] * len(inserted) + ["update"] * (len(updated) + len(deactivated)),
+        ))
+
+        cur.execute("DROP TABLE products_staging")
+    conn.commit()
+
+    elapsed = time.perf_counter() - started
+    print(f"  Строк в фиде: {counters['rows']}, пропущено {counters['skipped']} (несуществующие категории)")
+    print(f"  Новых: {len(inserted)}, изменённых: {len(updated)}, снято с продажи: {len(deactivated)}")
+    print(f"  Время: {elapsed:.1f}s")
+
+    return sorted(inserted + updated)
+
+
+def _parse_promo_row(row: dict, valid_products: set):
+    """
+    Преобразует строку CSV в кортеж для promos (последний элемент — row_hash).
+    None — если товара нет в БД.
+    """
+    product_id = int(row["offer_id"]) if row["offer_id"] else None
+    if product_id and product_id not in valid_products:
+        return None
+
+    start_date = None
+    end_date = None
+    if row.get("start_date"):
+        try:
+            start_date = datetime.strptime(row["start_date"], "%Y-%m-%d").date()
+        except ValueError:
+            pass
+    if row.get("end_date"):
+        try:
+            end_date = datetime.strptime(row["end_date"], "%Y-%m-%d").date()
+        except ValueError:
+            pass
+
+    values = (
+        int(row["promo_id"]) if row["promo_id"] else 0,           # promo_id
+        product_id,                                                # product_id
+        row.get("promo_type", "")[:100] or None,                  # promo_type
+        Decimal(row["discount_price"]) if row.get("discount_price") else None,  # discount_price
+        start_date,                                                # start_date
+        end_date,                                                  # end_date
+        row.get("description", "")[:500] or None,                 # description
+        row.get("url", "")[:500] or None,                         # url
+    )
+    return values + (_row_hash(values),)
+
+
 def load_promos(conn, filepath: str, batch_size: int = 1000):
     """Загружает скидки/акции из CSV."""
     print(f"Загрузка скидок из {filepath}...")
@@ -205,35 +626,11 @@ def load_promos(conn, filepath: str, batch_size: int = 1000):
         reader = csv.DictReader(f)
 
         for row in reader:
-            product_id = int(row["offer_id"]) if row["offer_id"] else None
-            if product_id and product_id not in valid_products:
+            promo = _parse_promo_row(row, valid_products)
+            if promo is None:
                 skipped += 1
                 continue
 
-            start_date = None
-            end_date = None
-            if row.get("start_date"):
-                try:
-                    start_date = datetime.strptime(row["start_date"], "%Y-%m-%d").date()
-                except ValueError:
-                    pass
-            if row.get("end_date"):
-                try:
-                    end_date = datetime.strptime(row["end_date"], "%Y-%m-%d").date()
-                except ValueError:
-                    pass
-
-            promo = (
-                int(row["promo_id"]) if row["promo_id"] else 0,           # promo_id
-                product_id,                                                # product_id
-                row.get("promo_type", "")[:100] or None,                  # promo_type
-                Decimal(row["discount_price"]) if row.get("discount_price") else None,  # discount_price
-                start_date,                                                # start_date
-                end_date,                                                  # end_date
-                row.get("description", "")[:500] or None,                 # description
-                row.get("url", "")[:500] or None,                         # url
-            )
-
             batch.append(promo)
 
             if len(batch) >= batch_size:
@@ -256,7 +653,7 @@ def _insert_promos_batch(conn, batch):
             cur,
             """
             INSERT INTO promos (promo_id, product_id, promo_type, discount_price,
-                               start_date, end_date, description, url)
+                               start_date, end_date, description, url, row_hash)
             VALUES %s
             """,
             batch
@@ -264,7 +661,158 @@ def _insert_promos_batch(conn, batch):
     conn.commit()
 
 
+def load_promos_copy(conn, filepath: str, workers: int = None):
+    """Загружает скидки одним COPY (парсинг в пуле процессов)."""
+    print(f"Загрузка скидок (COPY) из {filepath}...")
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT id FROM products")
+        valid_products = {row[0] for row in cur.fetchall()}
+
+    counters = {"rows": 0, "skipped": 0}
+
+    with conn.cursor() as cur:
+        cur.execute("TRUNCATE promos")
+        cur.copy_expert(
+            f"COPY promos ({', '.join(PROMO_COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+            _CopyStream(_parsed_chunks(filepath, "promos", valid_products, counters, workers)),
+        )
+    conn.commit()
+
+    print(f"  Загружено {counters['rows']} скидок, пропущено {counters['skipped']} (несуществующие товары)")
+
+
+def load_promos_delta(conn, filepath: str, workers: int = None):
+    """
+    Delta-импорт скидок по ключу (promo_id, product_id): вставляет новые,
+    обновляет изменённые по row_hash и удаляет пропавшие из фида.
+    """
+    print(f"Delta-импорт скидок из {filepath}...")
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT id FROM products")
+        valid_products = {row[0] for row in cur.fetchall()}
+
+    counters = {"rows": 0, "skipped": 0}
+    columns = ", ".join(PROMO_COPY_COLUMNS)
+
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TEMP TABLE promos_staging (
+                seq BIGSERIAL,
+                promo_id INT,
+                product_id INT,
+                promo_type VARCHAR(100),
+                discount_price DECIMAL(10,2),
+                start_date DATE,
+                end_date DATE,
+                description VARCHAR(500),
+                url VARCHAR(500),
+                row_hash CHAR(32)
+            ) ON COMMIT DROP
+        """)
+
+        cur.copy_expert(
+            f"COPY promos_staging ({columns}) FROM STDIN WITH (FORMAT csv)",
+            _CopyStream(_parsed_chunks(filepath, "promos", valid_products, counters, workers)),
+        )
+
+        cur.execute(f"""
+            CREATE TEMP TABLE promos_incoming ON COMMIT DROP AS
+            SELECT DISTINCT ON (promo_id, product_id) {columns}
+            FROM promos_staging
+            ORDER BY promo_id, product_id, seq DESC
+        """)
+
+        cur.execute(f"""
+            UPDATE promos p SET
+                {', '.join(f"{c} = i.{c}" for c in PROMO_COPY_COLUMNS[2:])}
+            FROM promos_incoming i
+            WHERE p.promo_id = i.promo_id
+              AND p.product_id IS NOT DISTINCT FROM i.product_id
+              AND p.row_hash IS DISTINCT FROM i.row_hash
+        """)
+        updated = cur.rowcount
+
+        cur.execute(f"""
+            INSERT INTO promos ({columns})
+            SELECT {columns}
+            FROM promos_incoming i
+            WHERE NOT EXISTS (
+                SELECT 1 FROM promos p
+                WHERE p.promo_id = i.promo_id
+                  AND p.product_id IS NOT DISTINCT FROM i.product_id
+            )
+        """)
+        inserted = cur.rowcount
+
+        cur.execute("""
+            DELETE FROM promos p
+            WHERE NOT EXISTS (
+                SELECT 1 FROM promos_incoming i
+                WHERE i.promo_id = p.promo_id
+                  AND i.product_id IS NOT DISTINCT FROM p.product_id
+            )
+        """)
+        deleted = cur.rowcount
+    conn.commit()
+
+    print(f"  Строк в фиде: {counters['rows']}, пропущено {counters['skipped']} (несуществующие товары)")
+    print(f"  Новых: {inserted}, изменённых: {updated}, удалено: {deleted}")
+
+
+def refresh_active_promos(conn):
+    """Пересобирает снапшот активных скидок (active_promos), которым пользуются запросы каталога."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT refresh_active_promos()")
+        total = cur.fetchone()[0]
+    conn.commit()
+    print(f"  Активных скидок в снапшоте: {total}")
+
+
+def write_changed_ids(product_ids: list[int], filepath: str):
+    """Список изменённых товаров для app.generate_embeddings --ids-file."""
+    with open(filepath, "w", encoding="utf-8") as f:
+        f.writelines(f"{pid}\n" for pid in product_ids)
+    print(f"  Изменённые товары ({len(product_ids)}) записаны в {filepath}")
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Загрузка каталога в PostgreSQL")
+    parser.add_argument(
+        "--mode",
+        choices=["batch", "copy", "delta"],
+        default="batch",
+        help=(
+            "batch: execute_values по 1000 строк; copy: COPY в staging + один merge; "
+            "delta: только изменения относительно текущего каталога"
+        ),
+    )
+    parser.add_argument(
+        "--changed-ids",
+        default=os.path.join(DATA_DIR, "changed_product_ids.txt"),
+        help="Куда записать ID изменённых товаров (режим delta; по умолчанию data/data/changed_product_ids.txt)",
+    )
+    parser.add_argument(
+        "--allow-mass-deactivate",
+        action="store_true",
+        help="Режим delta: не проверять, какую долю каталога снимет с продажи фид",
+    )
+    parser.add_argument(
+        "--max-deactivate-share",
+        type=float,
+        default=0.2,
+        help="Режим delta: максимальная доля доступных товаров, пропавших из фида (по умолчанию 0.2)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Процессов для парсинга CSV в режимах copy/delta (по умолчанию — число ядер)",
+    )
+    args = parser.parse_args()
+    delta = args.mode == "delta"
+
     print("=" * 50)
     print("Загрузка данных в PostgreSQL")
     print("=" * 50)
@@ -278,21 +826,40 @@ def main():
         # 1. Категории (сначала, т.к. товары ссылаются на них)
         categories_file = os.path.join(DATA_DIR, "categories.csv")
         if os.path.exists(categories_file):
-            load_categories(conn, categories_file)
+            load_categories(conn, categories_file, truncate=not delta)
         else:
             print(f"Файл {categories_file} не найден, пропускаем")
 
         # 2. Товары
         products_file = os.path.join(DATA_DIR, "offers_expanded.csv")
         if os.path.exists(products_file):
-            load_products(conn, products_file)
+            if args.mode == "copy":
+                load_products_copy(conn, products_file, args.workers)
+            elif delta:
+                try:
+                    changed = load_products_delta(
+                        conn, products_file, args.workers,
+                        allow_mass_deactivate=args.allow_mass_deactivate,
+                        max_deactivate_share=args.max_deactivate_share,
+                    )
+                except MassDeactivationError as e:
+                    raise SystemExit(f"Ошибка: {e}")
+                write_changed_ids(changed, args.changed_ids)
+            else:
+                load_products(conn, products_file)
         else:
             print(f"Файл {products_file} не найден, пропускаем")
 
         # 3. Скидки (после товаров, т.к. ссылаются на них)
         promos_file = os.path.join(DATA_DIR, "promos.csv")
         if os.path.exists(promos_file):
-            load_promos(conn, promos_file)
+            if args.mode == "copy":
+                load_promos_copy(conn, promos_file, args.workers)
+            elif delta:
+                load_promos_delta(conn, promos_file, args.workers)
+            else:
+                load_promos(conn, promos_file)
+            refresh_active_promos(conn)
         else:
             print(f"Файл {promos_file} не найден, пропускаем")
 
@@ -0,0 +1,54 @@
+"""
+Тесты потокового парсинга CSV для COPY (без БД).
+Запуск: python -m pytest data/test_load_data.py
+"""
+import csv
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from load_data import _CopyStream, _parsed_chunks
+
+
+def _write_products(path, category_ids):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["offer_id", "category_id", "name", "price"])
+        for offer_id, category_id in enumerate(category_ids, start=1):
+            writer.writerow([offer_id, category_id, f"Товар {offer_id}", "100.00"])
+
+
+def _read_all(stream, size=64):
+    parts = []
+    while True:
+        part = stream.read(size)
+        if not part:
+            return "".join(parts)
+        parts.append(part)
+
+
+def test_copy_stream_skips_empty_chunks():
+    stream = _CopyStream(["a\n", "", "", "b\n", ""])
+    assert _read_all(stream, size=1) == "a\nb\n"
+    assert stream.read() == ""
+
+
+def test_all_skipped_middle_chunk_is_not_eof(tmp_path):
+    # Первый и последний чанки валидны, средний целиком из неизвестных категорий
+    path = str(tmp_path / "products.csv")
+    _write_products(path, [1] * 20 + [999] * 20 + [1] * 20)
+    counters = {"rows": 0, "skipped": 0}
+
+    chunks = _parsed_chunks(path, "products", {1}, counters, workers=1, chunk_bytes=256)
+    data = _read_all(_CopyStream(chunks))
+
+    ids = [int(row[0]) for row in csv.reader(io.StringIO(data))]
+    assert ids == list(range(1, 21)) + list(range(41, 61))
+    assert counters == {"rows": 40, "skipped": 20}
+
+
+if __name__ == "__main__":
+    import pytest
+    sys.exit(pytest.main([__file__, "-q"]))
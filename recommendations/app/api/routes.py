@@ -1,13 +1,20 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import JSONResponse, PlainTextResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 from typing import Optional
 
-from ..db import get_session, queries
+from ..core.tracing import current_trace, render_metrics
+from ..db import pool_metrics
+from ..db.replica import get_read_session, replica_router
+from ..db.feedback_buffer import feedback_buffer, FeedbackBufferFull
 from ..services.scenarios import scenarios_service
 from ..services.product_recommender import product_recommender
 from ..services.scenario_recommender import scenario_recommender
+from ..services.event_buffer import event_buffer, EventBufferFull
 from ..ml.catboost_ranker import catboost_ranker
+from ..ml.training_datasets import list_datasets, validate_dataset_name
+from ..ml.training_jobs import TrainingJobConflict, training_jobs
 from .schemas import (
     ProductRecommendationsResponse,
     ScenarioResponse,
@@ -23,6 +30,14 @@ from .schemas import (
 router = APIRouter()
 
 
+def _with_timings(result: dict, debug: bool) -> dict:
+    """?debug=true: разбивка времени запроса по этапам и число обращений к БД"""
+    trace = current_trace()
+    if debug and trace is not None:
+        result["timings"] = trace.breakdown()
+    return result
+
+
 @router.get("/health")
 async def health():
     return {"status": "ok"}
@@ -32,7 +47,8 @@ async def health():
 async def get_product_recommendations(
     product_id: int,
     limit: int = Query(default=20, le=50),
-    session: AsyncSession = Depends(get_session),
+    debug: bool = Query(default=False),
+    session: AsyncSession = Depends(get_read_session),
 ):
     """
     Возвращает 20 сопутствующих товаров для конкретного товара.
@@ -47,7 +63,7 @@ async def get_product_recommendations(
     if "error" in result:
         raise HTTPException(status_code=404, detail=result["error"])
 
-    return result
+    return _with_timings(result, debug)
 
 
 
@@ -71,7 +87,8 @@ async def get_scenario_recommendations(
     scenario_id: str,
     cart_product_ids: str = Query(default="", description="Comma-separated product IDs in cart"),
     limit_per_group: int = Query(default=10, le=20),
-    session: AsyncSession = Depends(get_session),
+    debug: bool = Query(default=False),
+    session: AsyncSession = Depends(get_read_session),
 ):
     """
     Рекомендации для сценария с учётом корзины.
@@ -94,13 +111,14 @@ async def get_scenario_recommendations(
     if "error" in result:
         raise HTTPException(status_code=404, detail=result["error"])
 
-    return result
+    return _with_timings(result, debug)
 
 
 @router.get("/recommendations/scenario/auto")
 async def get_auto_scenario_recommendations(
     cart_product_ids: str = Query(default="", description="Comma-separated product IDs in cart"),
-    session: AsyncSession = Depends(get_session),
+    debug: bool = Query(default=False),
+    session: AsyncSession = Depends(get_read_session),
 ):
     """
     Автоматически определяет сценарий по корзине и возвращает рекомендации.
@@ -118,57 +136,77 @@ async def get_auto_scenario_recommendations(
         session=session,
     )
 
-    return result
+    return _with_timings(result, debug)
 
 
 
 @router.post("/feedback", response_model=FeedbackResponse)
-async def post_feedback(
-    request: FeedbackRequest,
-    session: AsyncSession = Depends(get_session),
-):
+async def post_feedback(request: FeedbackRequest):
     """
     Записывает фидбек на рекомендацию.
     Поддерживает оба типа:
     - Тип 1 (product_page): main_product_id + recommended_product_id
     - Тип 2 (scenario): scenario_id + group_name + recommended_product_id
+
+    Счётчики обновляются в памяти и пишутся в БД пачкой (см. FeedbackBuffer).
     """
     if request.feedback not in ("positive", "negative"):
         raise HTTPException(status_code=400, detail="Feedback must be 'positive' or 'negative'")
 
-    if request.context == "scenario" and request.scenario_id and request.group_name:
-        await queries.record_scenario_feedback(
-            session=session,
-            scenario_id=request.scenario_id,
-            group_name=request.group_name,
-            product_id=request.recommended_product_id,
-            feedback_type=request.feedback,
-            user_id=request.user_id,
-        )
-    elif request.main_product_id:
-        await queries.record_pair_feedback(
-            session=session,
-            main_product_id=request.main_product_id,
-            recommended_product_id=request.recommended_product_id,
-            feedback_type=request.feedback,
-            user_id=request.user_id,
-            context=request.context or "product_page",
-        )
-    else:
-        raise HTTPException(
-            status_code=400,
-            detail="Either main_product_id or (scenario_id + group_name) must be provided"
-        )
+    try:
+        if request.context == "scenario" and request.scenario_id and request.group_name:
+            await feedback_buffer.record_scenario(
+                scenario_id=request.scenario_id,
+                group_name=request.group_name,
+                product_id=request.recommended_product_id,
+                feedback_type=request.feedback,
+                user_id=request.user_id,
+            )
+        elif request.main_product_id:
+            await feedback_buffer.record_pair(
+                main_product_id=request.main_product_id,
+                recommended_product_id=request.recommended_product_id,
+                feedback_type=request.feedback,
+                user_id=request.user_id,
+                context=request.context or "product_page",
+            )
+        else:
+            raise HTTPException(
+                status_code=400,
+                detail="Either main_product_id or (scenario_id + group_name) must be provided"
+            )
+    except FeedbackBufferFull:
+        raise HTTPException(status_code=503, detail="Feedback buffer is full, retry later")
 
     return FeedbackResponse(success=True, message="Feedback recorded")
 
 
 
+EVENT_TYPES = ("impression", "click", "add_to_cart")
+
+
+def _event_row(event: RecommendationEventRequest) -> tuple:
+    """Кортеж в порядке queries.RECOMMENDATION_EVENT_COLUMNS"""
+    return (
+        event.user_id,
+        event.session_id,
+        event.event_type,
+        event.main_product_id,
+        event.recommended_product_id,
+        event.recommendation_context,
+        event.recommendation_rank,
+    )
+
+
+async def _enqueue_events(rows: list[tuple]):
+    try:
+        await event_buffer.put(rows)
+    except EventBufferFull:
+        raise HTTPException(status_code=503, detail="Event buffer is full, retry later")
+
+
 @router.post("/events", response_model=RecommendationEventResponse)
-async def log_recommendation_event(
-    request: RecommendationEventRequest,
-    session: AsyncSession = Depends(get_session),
-):
+async def log_recommendation_event(request: RecommendationEventRequest):
     """
     Логирует событие взаимодействия с рекомендацией.
 
@@ -177,8 +215,9 @@ async def log_recommendation_event(
     - click: пользователь кликнул на рекомендацию
     - add_to_cart: пользователь добавил рекомендованный товар в корзину
 
+    Событие попадает в буфер и пишется в БД пачкой (см. EventBuffer).
     """
-    if request.event_type not in ("impression", "click", "add_to_cart"):
+    if request.event_type not in EVENT_TYPES:
         raise HTTPException(
             status_code=400,
             detail="event_type must be 'impression', 'click', or 'add_to_cart'"
@@ -190,73 +229,30 @@ async def log_recommendation_event(
             detail="Either user_id or session_id must be provided"
         )
 
-    await session.execute(
-        text("""
-            INSERT INTO recommendation_events
-                (user_id, session_id, event_type, main_product_id, recommended_product_id,
-                 recommendation_context, recommendation_rank)
-            VALUES (:user_id, :session_id, :event_type, :main_product_id, :recommended_product_id,
-                    :context, :rank)
-        """),
-        {
-            "user_id": request.user_id,
-            "session_id": request.session_id,
-            "event_type": request.event_type,
-            "main_product_id": request.main_product_id,
-            "recommended_product_id": request.recommended_product_id,
-            "context": request.recommendation_context,
-            "rank": request.recommendation_rank,
-        }
-    )
-    await session.commit()
+    await _enqueue_events([_event_row(request)])
 
     return RecommendationEventResponse(success=True, events_logged=1)
 
 
 @router.post("/events/batch", response_model=RecommendationEventResponse)
-async def log_recommendation_events_batch(
-    events: list[RecommendationEventRequest],
-    session: AsyncSession = Depends(get_session),
-):
+async def log_recommendation_events_batch(events: list[RecommendationEventRequest]):
     """
     Батчевое логирование событий
     """
-    if not events:
-        return RecommendationEventResponse(success=True, events_logged=0)
-
-    for event in events:
-        if event.event_type not in ("impression", "click", "add_to_cart"):
-            continue
-        if not event.user_id and not event.session_id:
-            continue
-
-        await session.execute(
-            text("""
-                INSERT INTO recommendation_events
-                    (user_id, session_id, event_type, main_product_id, recommended_product_id,
-                     recommendation_context, recommendation_rank)
-                VALUES (:user_id, :session_id, :event_type, :main_product_id, :recommended_product_id,
-                        :context, :rank)
-            """),
-            {
-                "user_id": event.user_id,
-                "session_id": event.session_id,
-                "event_type": event.event_type,
-                "main_product_id": event.main_product_id,
-                "recommended_product_id": event.recommended_product_id,
-                "context": event.recommendation_context,
-                "rank": event.recommendation_rank,
-            }
-        )
+    rows = [
+        _event_row(event)
+        for event in events
+        if event.event_type in EVENT_TYPES and (event.user_id or event.session_id)
+    ]
+    if rows:
+        await _enqueue_events(rows)
 
-    await session.commit()
-
-    return RecommendationEventResponse(success=True, events_logged=len(events))
+    return RecommendationEventResponse(success=True, events_logged=len(rows))
 
 
 
 @router.get("/stats", response_model=StatsResponse)
-async def get_stats(session: AsyncSession = Depends(get_session)):
+async def get_stats(session: AsyncSession = Depends(get_read_session)):
     """Статистика для аналитики."""
     result = await session.execute(
         text("SELECT COUNT(*) FROM product_embeddings WHERE embedding IS NOT NULL")
@@ -298,10 +294,12 @@ async def train_catboost_model(
     learning_rate: float = Query(default=0.05, ge=0.001, le=0.5),
     depth: int = Query(default=6, ge=3, le=10),
     min_feedback_count: int = Query(default=5, ge=1, le=20),
-    session: AsyncSession = Depends(get_session),
+    dataset: Optional[str] = Query(default=None, max_length=64),
+    update_dataset: bool = Query(default=False),
 ):
     """
-    Обучает CatBoost ранкер на исторических данных.
+    Запускает обучение CatBoost ранкера в отдельном процессе и сразу возвращает задачу.
+    Статус, прогресс и метрики — GET /ml/jobs/{job_id}; одновременно идёт не больше одной задачи.
 
     Требует:
     - Минимум 100 примеров с фидбеком или заказами
@@ -312,27 +310,58 @@ async def train_catboost_model(
     - learning_rate: скорость обучения (0.001-0.5)
     - depth: глубина деревьев (3-10)
     - min_feedback_count: минимум фидбеков для включения пары (1-20)
+    - dataset: имя снапшота выборки; есть — обучение на нём без сборки, нет — собрать и сохранить
+    - update_dataset: перед обучением дописать в снапшот новый фидбек
     """
+    if dataset:
+        try:
+            validate_dataset_name(dataset)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
     try:
-        metadata = await catboost_ranker.train_model(
-            session=session,
-            iterations=iterations,
-            learning_rate=learning_rate,
-            depth=depth,
-            min_feedback_count=min_feedback_count,
-        )
+        job = training_jobs.submit({
+            "iterations": iterations,
+            "learning_rate": learning_rate,
+            "depth": depth,
+            "min_feedback_count": min_feedback_count,
+            "dataset": dataset,
+            "update_dataset": update_dataset,
+        })
+    except TrainingJobConflict as e:
+        raise HTTPException(status_code=409, detail=f"Training job {e.job_id} is already running")
 
-        return {
-            "success": True,
-            "message": "Model trained successfully",
-            "metadata": metadata,
-        }
+    return JSONResponse(status_code=202, content=job)
 
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Training failed: {str(e)}"
-        )
+
+@router.get("/ml/jobs")
+async def list_training_jobs():
+    """Задачи обучения: активная и последние завершённые"""
+    return {"jobs": training_jobs.list()}
+
+
+@router.get("/ml/jobs/{job_id}")
+async def get_training_job(job_id: str):
+    """Статус (queued, running, cancelling, succeeded, failed, cancelled), этап, прогресс 0-1 и метрики"""
+    job = training_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Training job not found")
+    return job
+
+
+@router.post("/ml/jobs/{job_id}/cancel")
+async def cancel_training_job(job_id: str):
+    """Отменяет задачу; модель при этом не сохраняется"""
+    job = training_jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Training job not found")
+    return job
+
+
+@router.get("/ml/datasets")
+async def get_training_datasets():
+    """Сохранённые снапшоты обучающей выборки: схема признаков, параметры, водяные знаки"""
+    return {"datasets": list_datasets()}
 
 
 @router.get("/ml/model-info")
@@ -349,12 +378,73 @@ async def get_model_info():
     return catboost_ranker.get_model_info()
 
 
+@router.get("/ml/models")
+async def get_models():
+    """Активная модель, кандидат с shadow-статистикой, история для отката, версии на диске"""
+    return catboost_ranker.registry.status()
+
+
+@router.post("/ml/models/candidate")
+async def load_candidate_model(version: Optional[str] = Query(default=None, max_length=64)):
+    """Загружает версию (по умолчанию самую свежую) кандидатом: скорит в shadow, ответы не меняет"""
+    try:
+        loaded = await catboost_ranker.registry.load_candidate(version)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {"loaded": loaded.version, **catboost_ranker.registry.status()}
+
+
+@router.delete("/ml/models/candidate")
+async def discard_candidate_model():
+    catboost_ranker.registry.discard_candidate()
+    return catboost_ranker.registry.status()
+
+
+@router.post("/ml/models/promote")
+async def promote_candidate_model():
+    """Делает кандидата активной моделью"""
+    try:
+        await catboost_ranker.registry.promote()
+    except LookupError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return catboost_ranker.registry.status()
+
+
+@router.post("/ml/models/rollback")
+async def rollback_model(version: Optional[str] = Query(default=None, max_length=64)):
+    """Возвращает предыдущую активную модель (или указанную версию)"""
+    try:
+        await catboost_ranker.registry.rollback(version)
+    except LookupError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return catboost_ranker.registry.status()
+
+
+@router.get("/db/metrics")
+async def get_db_metrics():
+    """
+    Состояние пулов соединений (primary — запросы API, background — обучение и фоновые задачи,
+    replica* — то же на реплике): занятость, ожидание соединения, таймауты, попадания
+    в кэш подготовленных выражений; состояние и отставание реплики.
+    """
+    return {**pool_metrics(), "replica_routing": replica_router.status()}
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Гистограммы времени запросов, этапов и обращений к БД в текстовом формате Prometheus"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
 @router.get("/recommendations/{product_id}/with-ml")
 async def get_product_recommendations_with_ml(
     product_id: int,
     limit: int = Query(default=20, le=50),
     use_ml: bool = Query(default=True),
-    session: AsyncSession = Depends(get_session),
+    debug: bool = Query(default=False),
+    session: AsyncSession = Depends(get_read_session),
 ):
     """
     Рекомендации с явным контролем ML-ранжирования.
@@ -371,4 +461,4 @@ async def get_product_recommendations_with_ml(
     if "error" in result:
         raise HTTPException(status_code=404, detail=result["error"])
 
-    return result
+    return _with_timings(result, debug)
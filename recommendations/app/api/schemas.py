@@ -1,6 +1,10 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional
 
+# Границы INT в PostgreSQL: значения вне них валят пакетную запись целиком
+PG_INT_MIN = -2**31
+PG_INT_MAX = 2**31 - 1
+
 
 class ProductResponse(BaseModel):
     id: int
@@ -110,14 +114,14 @@ class ScenarioRecommendationsResponse(BaseModel):
 
 
 class FeedbackRequest(BaseModel):
-    """Запрос на отправку фидбека"""
-    main_product_id: Optional[int] = None  # Для Тип 1
-    recommended_product_id: int
-    feedback: str  # positive / negative
-    context: Optional[str] = "product_page"  # product_page, scenario
-    scenario_id: Optional[str] = None  # Для Тип 2
-    group_name: Optional[str] = None  # Для Тип 2
-    user_id: Optional[int] = None
+    """Запрос на отправку фидбека (длины строк — по колонкам product_pair_feedback / scenario_feedback)"""
+    main_product_id: Optional[int] = Field(default=None, ge=1, le=PG_INT_MAX)  # Для Тип 1
+    recommended_product_id: int = Field(ge=1, le=PG_INT_MAX)
+    feedback: str = Field(max_length=20)  # positive / negative
+    context: Optional[str] = Field(default="product_page", max_length=50)  # product_page, scenario
+    scenario_id: Optional[str] = Field(default=None, max_length=50)  # Для Тип 2
+    group_name: Optional[str] = Field(default=None, max_length=100)  # Для Тип 2
+    user_id: Optional[int] = Field(default=None, ge=PG_INT_MIN, le=PG_INT_MAX)
 
 
 class FeedbackResponse(BaseModel):
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Синтетический каталог для бенчмарков: отдельная база с миграциями backend/migrations
+и данными заданного размера — дерево категорий (с категориями сценариев), товары,
+эмбеддинги, скидки, заказы, co-purchase и фидбек. Данные детерминированы --seed.
+
+Эмбеддинг товара — центр его категории + центр корня + шум, поэтому FAISS-соседи
+похожи на настоящие (кластеры по категориям). Заказы собираются из групп одного
+сценария — co-purchase и фидбек связывают товары так же, как в живых данных.
+
+Запуск: python -m app.benchmark_catalog --db spbtechrun_bench --products 20000 [--recreate]
+Замеры: POSTGRES_DB=spbtechrun_bench python -m app.benchmark_service
+"""
+
+import argparse
+import asyncio
+import time
+from pathlib import Path
+
+import asyncpg
+import numpy as np
+
+from .core.config import settings
+from .services.scenarios import CATEGORY_IDS, SCENARIOS
+
+MIGRATIONS_DIR = Path(__file__).resolve().parents[2] / "backend" / "migrations"
+
+FIRST_GENERATED_CATEGORY_ID = 100000  # не пересекается с id категорий сценариев
+VENDORS = 200
+
+
+async def _connect(database: str) -> asyncpg.Connection:
+    return await asyncpg.connect(
+        host=settings.postgres_host,
+        port=settings.postgres_port,
+        user=settings.postgres_user,
+        password=settings.postgres_password,
+        database=database,
+    )
+
+
+async def _create_database(db: str, recreate: bool):
+    conn = await _connect("postgres")
+    try:
+        exists = await conn.fetchval("SELECT 1 FROM pg_database WHERE datname = $1", db)
+        if exists and not recreate:
+            raise SystemExit(f"База {db} уже существует; --recreate пересоздаст её")
+        if exists:
+            await conn.execute(f'DROP DATABASE "{db}" WITH (FORCE)')
+        await conn.execute(f'CREATE DATABASE "{db}"')
+    finally:
+        await conn.close()
+
+
+async def _apply_migrations(conn: asyncpg.Connection, migrations_dir: Path):
+    files = sorted(migrations_dir.glob("*.up.sql"))
+    if not files:
+        raise SystemExit(f"Нет миграций в {migrations_dir}")
+    for path in files:
+        await conn.execute(path.read_text())
+    print(f"  Миграций применено: {len(files)}")
+
+
+def _category_tree(rng: np.random.Generator, roots: int, categories: int, depth: int) -> tuple[list, np.ndarray]:
+    """
+    (строки categories, id листьев). Промежуточные уровни — по несколько узлов на родителя,
+    листья — сгенерированные категории и категории сценариев, распределённые по корням.
+    """
+    rows = [(i, None, f"Раздел {i}") for i in range(1, roots + 1)]
+    level = list(range(1, roots + 1))
+    next_id = roots + 1
+    for _ in range(max(depth - 2, 0)):
+        children = []
+        for parent in level:
+            for _ in range(int(rng.integers(2, 5))):
+                rows.append((next_id, parent, f"Подраздел {next_id}"))
+                children.append(next_id)
+                next_id += 1
+        level = children
+
+    scenario_leaves = sorted({cid for ids in CATEGORY_IDS.values() for cid in ids})
+    generated = list(range(FIRST_GENERATED_CATEGORY_ID, FIRST_GENERATED_CATEGORY_ID + max(categories - len(scenario_leaves), 0)))
+    leaves = scenario_leaves + generated
+    parents = rng.choice(level, size=len(leaves))
+    rows += [(cid, int(parent), f"Категория {cid}") for cid, parent in zip(leaves, parents)]
+    return rows, np.array(leaves, dtype=np.int64)
+
+
+def _embeddings(rng: np.random.Generator, product_categories: np.ndarray, category_roots: dict, dim: int) -> np.ndarray:
+    categories = np.unique(product_categories)
+    roots = sorted(set(category_roots.values()))
+    category_centres = dict(zip(categories.tolist(), rng.standard_normal((len(categories), dim), dtype=np.float32)))
+    root_centres = dict(zip(roots, rng.standard_normal((len(roots), dim), dtype=np.float32)))
+
+    vectors = rng.standard_normal((len(product_categories), dim), dtype=np.float32) * 0.6
+    for cid in categories.tolist():
+        mask = product_categories == cid
+        vectors[mask] += category_centres[cid] + 0.5 * root_centres[category_roots[cid]]
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def _baskets(rng: np.random.Generator, orders: int, products_by_category: dict, all_products: np.ndarray) -> list[list[int]]:
+    """Заказ — 2-6 групп одного сценария по товару, изредка плюс случайный товар"""
+    scenarios = list(SCENARIOS.values())
+    baskets = []
+    for _ in range(orders):
+        scenario = scenarios[int(rng.integers(len(scenarios)))]
+        groups = [g for g in scenario.groups if any(products_by_category.get(c) is not None for c in g.category_ids)]
+        if not groups:
+            continue
+        chosen = rng.choice(len(groups), size=min(int(rng.integers(2, 7)), len(groups)), replace=False)
+        basket = set()
+        for gi in chosen:
+            pool = np.concatenate([products_by_category[c] for c in groups[gi].category_ids if c in products_by_category])
+            # Популярные товары группы — в начале пула (геометрическое распределение)
+            basket.add(int(pool[min(int(rng.geometric(0.15)) - 1, len(pool) - 1)]))
+        if rng.random() < 0.3:
+            basket.add(int(rng.choice(all_products)))
+        if len(basket) >= 2:
+            baskets.append(sorted(basket))
+    return baskets
+
+
+async def build_catalog(
+    db: str,
+    products: int = 20000,
+    categories: int = 400,
+    roots: int = 8,
+    depth: int = 3,
+    dim: int = 768,
+    orders: int = 20000,
+    feedback: int = 20000,
+    promo_fraction: float = 0.1,
+    seed: int = 42,
+    recreate: bool = False,
+    migrations_dir: Path = MIGRATIONS_DIR,
+):
+    rng = np.random.default_rng(seed)
+    total_start = time.perf_counter()
+
+    print(f"База {db}: {products} товаров, {categories} категорий, dim {dim}, {orders} заказов, seed {seed}")
+    await _create_database(db, recreate)
+    conn = await _connect(db)
+    try:
+        await _apply_migrations(conn, migrations_dir)
+
+        # Категории
+        category_rows, leaves = _category_tree(rng, roots, categories, depth)
+        await conn.execute("ALTER TABLE categories DROP CONSTRAINT IF EXISTS categories_parent_id_fkey")
+        await conn.copy_records_to_table("categories", records=category_rows, columns=["id", "parent_id", "name"])
+        await conn.execute("""
+            ALTER TABLE categories
+            ADD CONSTRAINT categories_parent_id_fkey FOREIGN KEY (parent_id) REFERENCES categories(id)
+        """)
+        parent_of = {cid: parent for cid, parent, _ in category_rows}
+
+        def root_of(cid: int) -> int:
+            while parent_of[cid] is not None:
+                cid = parent_of[cid]
+            return cid
+
+        category_roots = {int(cid): root_of(int(cid)) for cid in leaves}
+        print(f"  Категорий: {len(category_rows)} (листьев {len(leaves)})")
+
+        # Товары: размер категорий по Ципфу, категории сценариев — не меньше 20 товаров
+        ids = np.arange(1, products + 1, dtype=np.int64)
+        weights = 1.0 / np.arange(1, len(leaves) + 1) ** 0.8
+        product_categories = rng.choice(rng.permutation(leaves), size=products, p=weights / weights.sum())
+        scenario_leaves = leaves[leaves < FIRST_GENERATED_CATEGORY_ID]
+        product_categories[:len(scenario_leaves) * 20] = np.repeat(scenario_leaves, 20)[:products]
+        prices = np.round(np.exp(rng.normal(6.5, 1.2, size=products)), 2)
+        vendors = rng.integers(1, VENDORS + 1, size=products)
+        available = rng.random(products) > 0.05
+        await conn.copy_records_to_table(
+            "products",
+            records=[
+                (int(pid), int(cid), f"Товар {pid}", float(price), f"Бренд {vendor}", bool(avail), "{}")
+                for pid, cid, price, vendor, avail in zip(ids, product_categories, prices, vendors, available)
+            ],
+            columns=["id", "category_id", "name", "price", "vendor", "available", "params"],
+        )
+        print(f"  Товаров: {products}")
+
+        start = time.perf_counter()
+        vectors = _embeddings(rng, product_categories, category_roots, dim)
+        await conn.copy_records_to_table(
+            "product_embeddings",
+            records=((int(pid), vector) for pid, vector in zip(ids, vectors.astype(np.float64).tolist())),
+            columns=["product_id", "embedding"],
+        )
+        print(f"  Эмбеддингов: {products} x {dim} ({time.perf_counter() - start:.1f} с)")
+
+        # Скидки на сегодня -> снапшот active_promos
+        promo_ids = rng.choice(ids, size=int(products * promo_fraction), replace=False)
+        discounts = rng.uniform(0.05, 0.4, size=len(promo_ids))
+        price_of = dict(zip(ids.tolist(), prices.tolist()))
+        await conn.copy_records_to_table(
+            "promos",
+            records=[
+                (i + 1, int(pid), "discount", round(price_of[int(pid)] * (1 - d), 2))
+                for i, (pid, d) in enumerate(zip(promo_ids, discounts))
+            ],
+            columns=["promo_id", "product_id", "promo_type", "discount_price"],
+        )
+        await conn.execute("UPDATE promos SET start_date = CURRENT_DATE - 7, end_date = CURRENT_DATE + 30")
+        await conn.execute("SELECT refresh_active_promos()")
+        print(f"  Скидок: {len(promo_ids)}")
+
+        # Заказы и co-purchase
+        available_ids = ids[available]
+        available_categories = product_categories[available]
+        products_by_category = {
+            int(cid): available_ids[available_categories == cid] for cid in np.unique(available_categories)
+        }
+        baskets = _baskets(rng, orders, products_by_category, available_ids)
+        users = max(len(baskets) // 5, 1)
+        await conn.copy_records_to_table(
+            "users",
+            records=[(i, f"bench{i}@example.com", "-") for i in range(1, users + 1)],
+            columns=["id", "email", "password_hash"],
+        )
+        await conn.copy_records_to_table(
+            "orders",
+            records=[
+                (order_id, int(rng.integers(1, users + 1)), "completed", sum(price_of[p] for p in basket))
+                for order_id, basket in enumerate(baskets, start=1)
+            ],
+            columns=["id", "user_id", "status", "total"],
+        )
+        await conn.copy_records_to_table(
+            "order_items",
+            records=[
+                (order_id, pid, 1, price_of[pid])
+                for order_id, basket in enumerate(baskets, start=1)
+                for pid in basket
+            ],
+            columns=["order_id", "product_id", "quantity", "price"],
+        )
+        for sequence, table in (("users_id_seq", "users"), ("orders_id_seq", "orders")):
+            await conn.execute(f"SELECT setval('{sequence}', (SELECT MAX(id) FROM {table}))")
+        # Та же семантика, что у app.update_copurchase: пара (меньший id, больший id), число заказов
+        await conn.execute("""
+            INSERT INTO copurchase_stats (product_id_1, product_id_2, copurchase_count)
+            SELECT a.product_id, b.product_id, COUNT(DISTINCT a.order_id)
+            FROM order_items a
+            JOIN order_items b ON a.order_id = b.order_id AND a.product_id < b.product_id
+            GROUP BY a.product_id, b.product_id
+        """)
+        await conn.execute("""
+            INSERT INTO product_stats (product_id, view_count, cart_add_count, order_count)
+            SELECT p.id,
+                   COALESCE(o.orders, 0) * 20 + (random() * 50)::int,
+                   COALESCE(o.orders, 0) * 2 + (random() * 5)::int,
+                   COALESCE(o.orders, 0)
+            FROM products p
+            LEFT JOIN (SELECT product_id, COUNT(*) AS orders FROM order_items GROUP BY product_id) o
+                ON o.product_id = p.id
+            ON CONFLICT (product_id) DO UPDATE SET
+                view_count = EXCLUDED.view_count,
+                cart_add_count = EXCLUDED.cart_add_count,
+                order_count = EXCLUDED.order_count
+        """)
+        copurchase_pairs = await conn.fetchval("SELECT COUNT(*) FROM copurchase_stats")
+        print(f"  Заказов: {len(baskets)}, пар co-purchase: {copurchase_pairs}")
+
+        # Фидбек: пары из заказов в основном одобряют, случайные — в основном нет
+        pairs = [(a, b) for basket in baskets for a in basket for b in basket if a != b]
+        bought = [pairs[i] for i in rng.choice(len(pairs), size=min(int(feedback * 0.7), len(pairs)), replace=False)]
+        random_pairs = zip(rng.choice(available_ids, size=feedback - len(bought)), rng.choice(available_ids, size=feedback - len(bought)))
+        pair_stats = {}
+        for (main_id, rec_id), positive_rate in [(p, 0.8) for p in bought] + [(p, 0.2) for p in random_pairs]:
+            if main_id == rec_id:
+                continue
+            total = int(rng.integers(1, 10))
+            positive = int(rng.binomial(total, positive_rate))
+            pair_stats[(int(main_id), int(rec_id))] = (positive, total - positive)
+        await conn.copy_records_to_table(
+            "pair_feedback_stats",
+            records=[(m, r, pos, neg) for (m, r), (pos, neg) in pair_stats.items()],
+            columns=["main_product_id", "recommended_product_id", "positive_count", "negative_count"],
+        )
+
+        scenario_rows = []
+        for scenario in SCENARIOS.values():
+            for group in scenario.groups:
+                pool = [p for c in group.category_ids for p in products_by_category.get(c, [])[:30]]
+                for pid in pool:
+                    total = int(rng.integers(0, 12))
+                    if total:
+                        positive = int(rng.binomial(total, rng.uniform(0.3, 0.9)))
+                        scenario_rows.append((scenario.id, group.name, int(pid), positive, total - positive))
+        await conn.copy_records_to_table(
+            "scenario_feedback_stats",
+            records=scenario_rows,
+            columns=["scenario_id", "group_name", "product_id", "positive_count", "negative_count"],
+        )
+        print(f"  Фидбек: {len(pair_stats)} пар, {len(scenario_rows)} товаров в сценариях")
+
+        await conn.execute("ANALYZE")
+    finally:
+        await conn.close()
+
+    print(f"Готово за {time.perf_counter() - total_start:.1f} с")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", default="spbtechrun_bench", help="Имя создаваемой базы")
+    parser.add_argument("--recreate", action="store_true", help="Удалить базу, если она уже есть")
+    parser.add_argument("--products", type=int, default=20000)
+    parser.add_argument("--categories", type=int, default=400, help="Листовых категорий (вместе с категориями сценариев)")
+    parser.add_argument("--roots", type=int, default=8)
+    parser.add_argument("--depth", type=int, default=3, help="Уровней дерева категорий")
+    parser.add_argument("--dim", type=int, default=768, help="Размерность эмбеддингов")
+    parser.add_argument("--orders", type=int, default=20000)
+    parser.add_argument("--feedback", type=int, default=20000, help="Пар с фидбеком")
+    parser.add_argument("--promo-fraction", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--migrations", type=Path, default=MIGRATIONS_DIR)
+    args = parser.parse_args()
+    asyncio.run(build_catalog(
+        db=args.db,
+        products=args.products,
+        categories=args.categories,
+        roots=args.roots,
+        depth=args.depth,
+        dim=args.dim,
+        orders=args.orders,
+        feedback=args.feedback,
+        promo_fraction=args.promo_fraction,
+        seed=args.seed,
+        recreate=args.recreate,
+        migrations_dir=args.migrations,
+    ))
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Сравнение чтения эмбеддингов для ранкера: SQLAlchemy text() + dict + список float
+против быстрого пути asyncpg (app.db.fastpath) на выборках 100 и 500 строк.
+Запуск: python -m app.benchmark_fastpath [--iterations 50] [--sizes 100 500]
+"""
+
+import argparse
+import asyncio
+import time
+
+import numpy as np
+from sqlalchemy import text
+
+from .core.config import settings
+from .db import queries
+from .db.database import async_session, init_db
+from .db.fastpath import fast_reader
+from .ml.feature_extractor import feature_extractor
+
+
+async def _timed(coro_factory, iterations: int) -> np.ndarray:
+    await coro_factory()  # прогрев: подготовка выражения, соединение в пуле
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await coro_factory()
+        timings.append((time.perf_counter() - start) * 1000)
+    return np.array(timings)
+
+
+def _row(label: str, timings: np.ndarray) -> str:
+    return (
+        f"  {label:<12} mean {timings.mean():7.2f} ms   p50 {np.percentile(timings, 50):7.2f} ms   "
+        f"p95 {np.percentile(timings, 95):7.2f} ms"
+    )
+
+
+async def benchmark_fastpath(iterations: int = 50, sizes: list[int] = None):
+    sizes = sizes or [100, 500]
+    await init_db()
+    settings.db_fast_path = True
+    await fast_reader.start()
+
+    async with async_session() as session:
+        all_ids = [row[0] for row in (await session.execute(
+            text("SELECT product_id FROM product_embeddings ORDER BY product_id LIMIT :limit"),
+            {"limit": max(sizes)}
+        )).fetchall()]
+
+        print(f"Итераций на замер: {iterations}, товаров с эмбеддингами в выборке: {len(all_ids)}")
+
+        for size in sizes:
+            ids = all_ids[:size]
+
+            async def via_sqlalchemy():
+                embeddings_map = await queries.get_embeddings_map(session, ids)
+                return feature_extractor.embeddings_to_matrix([embeddings_map.get(pid) for pid in ids])
+
+            async def via_fastpath():
+                return await fast_reader.embedding_matrix(ids)
+
+            slow_matrix, slow_found = await via_sqlalchemy()
+            fast_matrix, fast_found = await via_fastpath()
+            same = np.array_equal(slow_found, fast_found) and np.allclose(slow_matrix, fast_matrix)
+
+            slow = await _timed(via_sqlalchemy, iterations)
+            fast = await _timed(via_fastpath, iterations)
+
+            print()
+            print(f"Эмбеддинги, {len(ids)} строк x {fast_matrix.shape[1]} (результаты совпадают: {same})")
+            print(_row("sqlalchemy", slow))
+            print(_row("asyncpg", fast))
+            print(f"  ускорение по медиане: x{np.percentile(slow, 50) / np.percentile(fast, 50):.1f}")
+
+    await fast_reader.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 500])
+    args = parser.parse_args()
+    asyncio.run(benchmark_fastpath(args.iterations, args.sizes))
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарки горячих примитивов скоринга без базы — на синтетических данных в памяти:
+cosine_similarity, FeatureExtractor.extract_features по паре против extract_batch,
+ProductRecommender._calculate_score, ScenarioRecommender._calculate_group_score,
+поиск FAISS при разных k и CatBoost predict на 20/100/500 строках.
+
+Как в pytest-benchmark: прогрев, калибровка числа вызовов в раунде (раунд не короче
+--min-round-time), затем --rounds раундов; в отчёте min/mean/median/stddev на вызов и ops/s.
+--output пишет JSON, --baseline сравнивает медианы с прошлым прогоном (код выхода 1
+при замедлении больше --max-regression).
+
+Запуск: python -m app.benchmark_micro [--only cosine features faiss] [--rounds 100]
+        [--model models/catboost_ranker_<version>.cbm] [--output micro.json] [--baseline previous.json]
+"""
+
+import argparse
+import asyncio
+import inspect
+import json
+import platform
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Optional
+
+import faiss
+import numpy as np
+import pandas as pd
+from catboost import CatBoostRanker
+
+from .core.embeddings import cosine_similarity
+from .ml.feature_extractor import feature_extractor
+from .ml.product_features import ProductFeatureStore
+from .services.product_recommender import ProductRecommender
+from .services.scenario_recommender import ScenarioRecommender
+
+GROUPS = ("cosine", "score", "group_score", "features", "faiss", "predict")
+
+
+async def _measure(fn: Callable, rounds: int, min_round_time: float) -> dict:
+    """Статистика одного вызова fn (синхронной или корутинной функции), микросекунды"""
+    async def call():
+        result = fn()
+        if inspect.isawaitable(result):
+            await result
+
+    await call()  # прогрев
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            await call()
+        if time.perf_counter() - start >= min_round_time or loops >= 1 << 20:
+            break
+        loops *= 2
+
+    timings = np.empty(rounds)
+    for i in range(rounds):
+        start = time.perf_counter()
+        for _ in range(loops):
+            await call()
+        timings[i] = (time.perf_counter() - start) / loops * 1e6
+
+    return {
+        "rounds": rounds,
+        "loops": loops,
+        "min_us": round(float(timings.min()), 3),
+        "mean_us": round(float(timings.mean()), 3),
+        "median_us": round(float(np.median(timings)), 3),
+        "stddev_us": round(float(timings.std()), 3),
+        "ops": round(1e6 / float(np.median(timings)), 1),
+    }
+
+
+def _row(name: str, stats: dict) -> str:
+    return (
+        f"  {name:<34} min {stats['min_us']:10.2f} us   median {stats['median_us']:10.2f} us   "
+        f"stddev {stats['stddev_us']:9.2f} us   {stats['ops']:12.1f} ops/s"
+    )
+
+
+class _Fixtures:
+    """Синтетический каталог: товары, эмбеддинги, столбцы product_feature_store, фидбек"""
+
+    def __init__(self, products: int, dim: int, seed: int):
+        rng = np.random.default_rng(seed)
+        self.rng = rng
+        self.dim = dim
+        categories = rng.integers(1, 200, size=products)
+        parents = {int(c): 1000 + int(c) % 10 for c in np.unique(categories)}
+        parents.update({1000 + i: None for i in range(10)})
+
+        self.vectors = rng.standard_normal((products, dim), dtype=np.float32)
+        self.vectors /= np.linalg.norm(self.vectors, axis=1, keepdims=True)
+        # Эмбеддинги из БД приходят списками float — как в _calculate_score и extract_features
+        self.embedding_lists = self.vectors[:1000].astype(np.float64).tolist()
+
+        prices = np.round(np.exp(rng.normal(6.5, 1.2, size=products)), 2)
+        discounted = rng.random(products) < 0.1
+        self.products = [
+            {
+                "id": i + 1,
+                "name": f"Товар {i + 1}",
+                "category_id": int(categories[i]),
+                "category_name": f"Категория {categories[i]}",
+                "vendor": f"Бренд {i % 150}",
+                "price": float(prices[i]),
+                "discount_price": round(float(prices[i]) * 0.8, 2) if discounted[i] else None,
+                "picture": "pic.jpg",
+                "view_count": int(rng.integers(0, 500)),
+                "cart_add_count": int(rng.integers(0, 50)),
+                "order_count": int(rng.integers(0, 20)),
+            }
+            for i in range(products)
+        ]
+        rows = [
+            (p["id"], p["category_id"], p["vendor"], p["price"], p["picture"], p["name"], p["discount_price"],
+             p["view_count"], p["cart_add_count"], p["order_count"], None)
+            for p in self.products
+        ]
+        self.store = ProductFeatureStore()
+        self.store.ids, self.store.columns = ProductFeatureStore.build_columns(rows, parents)
+        self.store.loaded = True
+
+    def candidates(self, n: int) -> list[dict]:
+        return self.products[1:1 + n]
+
+
+async def benchmark_micro(
+    groups: list[str],
+    rounds: int = 100,
+    min_round_time: float = 0.001,
+    dim: int = 768,
+    index_size: int = 20000,
+    candidates: list[int] = None,
+    ks: list[int] = None,
+    predict_rows: list[int] = None,
+    model_path: Optional[Path] = None,
+    model_iterations: int = 500,
+    seed: int = 42,
+) -> dict:
+    candidates = candidates or [20, 100]
+    ks = ks or [10, 100, 500]
+    predict_rows = predict_rows or [20, 100, 500]
+    fx = _Fixtures(max(index_size, max(candidates) + 1, max(predict_rows) + 1), dim, seed)
+    product_recommender = ProductRecommender()
+    scenario_recommender = ScenarioRecommender()
+    results = []
+
+    async def bench(name: str, fn: Callable, **params):
+        stats = await _measure(fn, rounds, min_round_time)
+        results.append({"name": name, "params": params, **stats})
+        print(_row(name, stats))
+
+    print(f"Раундов: {rounds}, dim {dim}, товаров в фикстуре {len(fx.products)}")
+
+    if "cosine" in groups:
+        a, b = fx.vectors[0], fx.vectors[1]
+        await bench(f"cosine_similarity[{dim}]", lambda: cosine_similarity(a, b), dim=dim)
+
+    if "score" in groups:
+        main_embedding, candidate_embedding = fx.embedding_lists[0], fx.embedding_lists[1]
+        stats = {"positive": 3, "negative": 1}
+        await bench(
+            "calculate_score",
+            lambda: product_recommender._calculate_score(
+                main_embedding, candidate_embedding, stats, stats, discount_price=800.0, price=1000.0
+            ),
+        )
+
+    if "group_score" in groups:
+        product = fx.products[1]
+        stats = {"positive": 3, "negative": 1}
+        for cart_size in (1, 5, 20):
+            cart_embeddings = [fx.vectors[i] for i in range(2, 2 + cart_size)]
+            await bench(
+                f"calculate_group_score[cart={cart_size}]",
+                lambda: scenario_recommender._calculate_group_score(product, fx.embedding_lists[1], cart_embeddings, stats),
+                cart_size=cart_size,
+            )
+
+    if "features" in groups:
+        main_product = fx.products[0]
+        feedback = {"positive": 2, "negative": 1}
+        for n in candidates:
+            pool = fx.candidates(n)
+            candidate_ids = [p["id"] for p in pool]
+
+            async def per_pair():
+                for i, candidate in enumerate(pool):
+                    await feature_extractor.extract_features(
+                        main_product=main_product,
+                        candidate_product=candidate,
+                        main_embedding=fx.embedding_lists[0],
+                        candidate_embedding=fx.embedding_lists[1 + i % 999],
+                        pair_feedback=feedback,
+                        scenario_feedback={"positive": 0, "negative": 0},
+                        copurchase_count=1,
+                    )
+
+            static = fx.store.gather([main_product["id"]] + candidate_ids)
+            embeddings = fx.vectors[1:1 + n]
+            valid = np.ones(n, dtype=bool)
+            zeros = np.zeros(n)
+
+            def batch():
+                return feature_extractor.extract_batch(
+                    main_product=main_product,
+                    main_static={name: column[:1] for name, column in static.items()},
+                    candidate_static={name: column[1:] for name, column in static.items()},
+                    main_embedding=fx.vectors[0],
+                    candidate_embeddings=embeddings,
+                    candidate_valid=valid,
+                    pair_positive=zeros + 2,
+                    pair_negative=zeros + 1,
+                    copurchase_counts=zeros + 1,
+                )
+
+            await bench(f"extract_features_per_pair[n={n}]", per_pair, candidates=n)
+            await bench(f"extract_batch[n={n}]", batch, candidates=n)
+
+    if "faiss" in groups:
+        index = faiss.IndexFlatIP(dim)
+        index.add(fx.vectors[:index_size])
+        query = fx.vectors[:1]
+        for k in ks:
+            await bench(f"faiss_search[n={index_size},k={k}]", lambda: index.search(query, k), index_size=index_size, k=k)
+
+    if "predict" in groups:
+        model = CatBoostRanker()
+        names = feature_extractor.feature_names
+        if model_path:
+            model.load_model(str(model_path))
+            names = list(model.feature_names_ or names)
+        else:
+            # Модель той же формы, что у train_model (YetiRank, depth 6), на случайной выборке
+            X = fx.rng.random((2000, len(names)))
+            y = fx.rng.integers(0, 4, size=2000)
+            model = CatBoostRanker(
+                iterations=model_iterations, depth=6, loss_function="YetiRank", random_seed=seed, verbose=0
+            )
+            model.fit(pd.DataFrame(X, columns=names), y, group_id=np.repeat(np.arange(100), 20))
+        for n in predict_rows:
+            matrix = fx.rng.random((n, len(names)))
+            # Как в rank_candidates: DataFrame с именами признаков, затем predict
+            await bench(
+                f"catboost_predict[rows={n}]",
+                lambda: model.predict(pd.DataFrame(matrix, columns=names)),
+                rows=n,
+            )
+
+    return {
+        "created_at": datetime.now().isoformat(),
+        "params": {
+            "rounds": rounds, "min_round_time": min_round_time, "dim": dim, "index_size": index_size,
+            "seed": seed, "model": str(model_path) if model_path else f"synthetic:{model_iterations}",
+        },
+        "host": {"python": sys.version.split()[0], "platform": platform.platform()},
+        "results": results,
+    }
+
+
+def _compare(results: list[dict], baseline_path: Path, max_regression: float) -> list[str]:
+    with open(baseline_path) as f:
+        baseline = {r["name"]: r for r in json.load(f)["results"]}
+    regressions = []
+    for result in results:
+        previous = baseline.get(result["name"])
+        if previous and result["median_us"] > previous["median_us"] * (1 + max_regression):
+            regressions.append(f"{result['name']}: {previous['median_us']:.2f} -> {result['median_us']:.2f} us")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--only", nargs="+", choices=GROUPS, default=list(GROUPS))
+    parser.add_argument("--rounds", type=int, default=100)
+    parser.add_argument("--min-round-time", type=float, default=0.001, help="Секунды на раунд при калибровке")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--index-size", type=int, default=20000)
+    parser.add_argument("--candidates", type=int, nargs="+", default=[20, 100])
+    parser.add_argument("--k", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--predict-rows", type=int, nargs="+", default=[20, 100, 500])
+    parser.add_argument("--model", type=Path, default=None, help=".cbm; по умолчанию синтетическая модель")
+    parser.add_argument("--model-iterations", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", type=Path, default=None)
+    parser.add_argument("--baseline", type=Path, default=None)
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args()
+
+    report = asyncio.run(benchmark_micro(
+        groups=args.only,
+        rounds=args.rounds,
+        min_round_time=args.min_round_time,
+        dim=args.dim,
+        index_size=args.index_size,
+        candidates=args.candidates,
+        ks=args.k,
+        predict_rows=args.predict_rows,
+        model_path=args.model,
+        model_iterations=args.model_iterations,
+        seed=args.seed,
+    ))
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Результаты: {args.output}")
+
+    if args.baseline:
+        regressions = _compare(report["results"], args.baseline, args.max_regression)
+        for line in regressions:
+            print(f"  РЕГРЕССИЯ {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"Регрессий относительно {args.baseline} нет (порог {args.max_regression:.0%})")
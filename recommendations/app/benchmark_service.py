@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный бенчмарк рекомендаций: задержка и пропускная способность эндпоинтов
+/recommendations/{id}, /scenarios/{id}/recommendations, /recommendations/scenario/auto
+и CatBoost rank_candidates на нескольких уровнях конкурентности.
+
+По умолчанию сервис поднимается в этом же процессе (lifespan + httpx ASGITransport) —
+без сети и uvicorn, повторяемо на одной машине; --url направляет HTTP-запросы в
+запущенный сервис (rank_candidates тогда не замеряется). Входы (товары, корзины)
+выбираются из базы settings.postgres_db детерминированно по --seed; на каждый уровень
+сначала идёт прогрев. Результаты — JSON (--output), сравнение с прошлым прогоном —
+--baseline: при росте p95 или падении пропускной способности больше --max-regression
+код выхода 1.
+
+Запуск: POSTGRES_DB=spbtechrun_bench python -m app.benchmark_service \\
+            [--targets product scenario auto rank] [--concurrency 1 8 32] [--requests 200] \\
+            [--output results.json] [--baseline previous.json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+from itertools import count
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+import httpx
+import numpy as np
+from sqlalchemy import text
+
+from .core.config import settings
+from .db import queries
+from .db.database import async_session
+from .services.scenarios import CATEGORY_IDS, SCENARIOS
+
+TARGETS = ("product", "scenario", "auto", "rank")
+RANK_CANDIDATES = 100
+
+
+async def _sample_inputs(rng: np.random.Generator, size: int) -> dict:
+    """Товары с эмбеддингами и корзины из категорий сценариев"""
+    async with async_session() as session:
+        product_ids = [row[0] for row in (await session.execute(text("""
+            SELECT p.id FROM products p
+            JOIN product_embeddings e ON e.product_id = p.id
+            WHERE p.available = true
+            ORDER BY p.id
+        """))).fetchall()]
+        scenario_category_ids = sorted({cid for ids in CATEGORY_IDS.values() for cid in ids})
+        by_category = {}
+        for pid, cid in (await session.execute(
+            text("SELECT id, category_id FROM products WHERE available = true AND category_id = ANY(:ids) ORDER BY id"),
+            {"ids": scenario_category_ids}
+        )).fetchall():
+            by_category.setdefault(cid, []).append(pid)
+
+    if not product_ids:
+        raise SystemExit(f"В базе {settings.postgres_db} нет товаров с эмбеддингами (см. app.benchmark_catalog)")
+
+    scenarios = list(SCENARIOS.values())
+    carts = []
+    for _ in range(size):
+        scenario = scenarios[int(rng.integers(len(scenarios)))]
+        cart = []
+        for group in scenario.groups:
+            pool = [pid for cid in group.category_ids for pid in by_category.get(cid, [])]
+            # Часть групп уже в корзине: сценарий то почти пуст, то почти собран
+            if pool and rng.random() < 0.3:
+                cart.append(int(rng.choice(pool)))
+        carts.append((scenario.id, cart))
+
+    return {
+        "products": [int(pid) for pid in rng.choice(product_ids, size=size)],
+        "carts": carts,
+    }
+
+
+def _latency(timings: np.ndarray) -> dict:
+    if not len(timings):
+        return {key: None for key in ("mean", "p50", "p90", "p95", "p99", "max")}
+    return {
+        "mean": round(float(timings.mean()), 3),
+        "p50": round(float(np.percentile(timings, 50)), 3),
+        "p90": round(float(np.percentile(timings, 90)), 3),
+        "p95": round(float(np.percentile(timings, 95)), 3),
+        "p99": round(float(np.percentile(timings, 99)), 3),
+        "max": round(float(timings.max()), 3),
+    }
+
+
+async def _run_level(call: Callable[[int], Awaitable[bool]], concurrency: int, requests: int, warmup: int) -> dict:
+    """requests вызовов call(i) в concurrency воркеров; call возвращает False на ошибку"""
+    for i in range(warmup):
+        await call(i)
+
+    counter = count()
+    timings = []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        while (i := next(counter)) < requests:
+            start = time.perf_counter()
+            try:
+                ok = await call(warmup + i)
+            except Exception:
+                ok = False
+            timings.append((time.perf_counter() - start) * 1000)
+            errors += not ok
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(requests / elapsed, 2) if elapsed > 0 else None,
+        "latency_ms": _latency(np.array(timings)),
+    }
+
+
+def _row(target: str, result: dict) -> str:
+    latency = result["latency_ms"]
+    return (
+        f"  {target:<9} c={result['concurrency']:<4} {result['throughput_rps']:8.1f} rps   "
+        f"p50 {latency['p50']:7.2f} ms   p95 {latency['p95']:7.2f} ms   p99 {latency['p99']:7.2f} ms   "
+        f"errors {result['errors']}"
+    )
+
+
+def _http_calls(client: httpx.AsyncClient, inputs: dict) -> dict:
+    products, carts = inputs["products"], inputs["carts"]
+
+    async def get(url: str) -> bool:
+        response = await client.get(url)
+        return response.status_code == 200
+
+    return {
+        "product": lambda i: get(f"/recommendations/{products[i % len(products)]}"),
+        "scenario": lambda i: get(
+            f"/scenarios/{carts[i % len(carts)][0]}/recommendations"
+            f"?cart_product_ids={','.join(map(str, carts[i % len(carts)][1]))}"
+        ),
+        "auto": lambda i: get(
+            f"/recommendations/scenario/auto?cart_product_ids={','.join(map(str, carts[i % len(carts)][1]))}"
+        ),
+    }
+
+
+async def _rank_call(inputs: dict, size: int) -> Optional[Callable[[int], Awaitable[bool]]]:
+    """rank_candidates на заранее собранных кандидатах (формульный топ-100 товара)"""
+    from .ml.catboost_ranker import catboost_ranker
+    from .services.product_recommender import product_recommender
+
+    if catboost_ranker.registry.active is None:
+        print("  rank: нет обученной модели, пропуск")
+        return None
+
+    prepared = []
+    async with async_session() as session:
+        for product_id in inputs["products"][:size]:
+            product = await queries.get_product_by_id(session, product_id)
+            result = await product_recommender.get_recommendations(
+                product_id, session, limit=RANK_CANDIDATES, use_ml=False
+            )
+            candidates = [rec["product"] for rec in result.get("recommendations", [])]
+            if product and candidates:
+                prepared.append((product, candidates))
+    if not prepared:
+        print("  rank: нет кандидатов, пропуск")
+        return None
+
+    async def call(i: int) -> bool:
+        product, candidates = prepared[i % len(prepared)]
+        async with async_session() as session:
+            # rank_candidates пишет ml_score в кандидатов — каждому вызову свои копии
+            ranked = await catboost_ranker.rank_candidates(product, [dict(c) for c in candidates], session)
+        return bool(ranked)
+
+    return call
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).resolve().parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def _catalog_summary() -> dict:
+    async with async_session() as session:
+        counts = {}
+        for table in ("products", "categories", "product_embeddings", "orders", "copurchase_stats",
+                      "pair_feedback_stats", "scenario_feedback_stats"):
+            counts[table] = (await session.execute(text(f"SELECT COUNT(*) FROM {table}"))).scalar()
+    return counts
+
+
+def _compare(results: list[dict], baseline_path: Path, max_regression: float) -> list[str]:
+    """Регрессии относительно прошлого прогона по (target, concurrency)"""
+    with open(baseline_path) as f:
+        baseline = {(r["target"], r["concurrency"]): r for r in json.load(f)["results"]}
+    regressions = []
+    for result in results:
+        previous = baseline.get((result["target"], result["concurrency"]))
+        if previous is None:
+            continue
+        p95, previous_p95 = result["latency_ms"]["p95"], previous["latency_ms"]["p95"]
+        if p95 and previous_p95 and p95 > previous_p95 * (1 + max_regression):
+            regressions.append(
+                f"{result['target']} c={result['concurrency']}: p95 {previous_p95:.2f} -> {p95:.2f} ms"
+            )
+        rps, previous_rps = result["throughput_rps"], previous["throughput_rps"]
+        if rps and previous_rps and rps < previous_rps * (1 - max_regression):
+            regressions.append(
+                f"{result['target']} c={result['concurrency']}: {previous_rps:.1f} -> {rps:.1f} rps"
+            )
+    return regressions
+
+
+async def benchmark_service(
+    targets: list[str],
+    concurrency: list[int],
+    requests: int = 200,
+    warmup: int = 20,
+    seed: int = 42,
+    url: Optional[str] = None,
+) -> dict:
+    rng = np.random.default_rng(seed)
+    inputs = await _sample_inputs(rng, requests + warmup)
+    results = []
+
+    async def run(target: str, call):
+        for level in concurrency:
+            result = await _run_level(call, level, requests, warmup)
+            results.append({"target": target, **result})
+            print(_row(target, result))
+
+    print(f"База {settings.postgres_db}, запросов на уровень: {requests} (+{warmup} прогрев), конкурентность {concurrency}")
+    limits = httpx.Limits(max_connections=max(concurrency), max_keepalive_connections=max(concurrency))
+    model_version = None
+
+    if url:
+        async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60.0) as client:
+            calls = _http_calls(client, inputs)
+            for target in targets:
+                if target == "rank":
+                    print("  rank: только в процессе (без --url), пропуск")
+                    continue
+                await run(target, calls[target])
+    else:
+        from .main import app
+        from .ml.catboost_ranker import catboost_ranker
+
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", limits=limits, timeout=60.0) as client:
+                calls = _http_calls(client, inputs)
+                for target in targets:
+                    call = await _rank_call(inputs, min(requests, 50)) if target == "rank" else calls[target]
+                    if call is not None:
+                        await run(target, call)
+            active = catboost_ranker.registry.active
+            model_version = active.version if active else None
+
+    return {
+        "created_at": datetime.now().isoformat(),
+        "git_commit": _git_commit(),
+        "mode": "http" if url else "in-process",
+        "url": url,
+        "database": settings.postgres_db,
+        "catalog": await _catalog_summary(),
+        "model_version": model_version,
+        "params": {"requests": requests, "warmup": warmup, "seed": seed, "concurrency": concurrency},
+        "settings": {
+            key: getattr(settings, key)
+            for key in ("embedding_storage", "embedding_dim", "db_fast_path", "db_pool_size",
+                        "db_statement_cache_size", "tracing_enabled")
+        },
+        "host": {
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--targets", nargs="+", choices=TARGETS, default=list(TARGETS))
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200, help="Запросов на уровень конкурентности")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--url", default=None, help="Запущенный сервис, напр. http://localhost:8000")
+    parser.add_argument("--output", type=Path, default=None, help="JSON с результатами")
+    parser.add_argument("--baseline", type=Path, default=None, help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Допустимое ухудшение p95/rps (доля)")
+    args = parser.parse_args()
+
+    report = asyncio.run(benchmark_service(
+        targets=args.targets,
+        concurrency=args.concurrency,
+        requests=args.requests,
+        warmup=args.warmup,
+        seed=args.seed,
+        url=args.url,
+    ))
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Результаты: {args.output}")
+
+    if args.baseline:
+        regressions = _compare(report["results"], args.baseline, args.max_regression)
+        for line in regressions:
+            print(f"  РЕГРЕССИЯ {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"Регрессий относительно {args.baseline} нет (порог {args.max_regression:.0%})")
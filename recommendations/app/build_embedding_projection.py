@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Обучение PCA для поиска в пониженной размерности и отчёт по recall/скорости.
+Запуск: python -m app.build_embedding_projection --dim 256 [--method truncate]
+
+Сервис подхватывает models/embedding_pca_{dim}.faiss при EMBEDDING_DIM={dim}.
+"""
+
+import argparse
+import asyncio
+import time
+import faiss
+import numpy as np
+from sqlalchemy import text
+
+from .core.config import settings
+from .core.projection import EmbeddingProjection, projection_path
+from .db.database import async_session, init_db
+
+
+def search_report(full: np.ndarray, reduced: np.ndarray, k: int, rerank_k: int, sample_size: int = 500) -> dict:
+    """Recall@k поиска в пониженной размерности относительно полной, без и с full-dim rerank"""
+    full_index = faiss.IndexFlatIP(full.shape[1])
+    full_index.add(full)
+    reduced_index = faiss.IndexFlatIP(reduced.shape[1])
+    reduced_index.add(reduced)
+
+    rng = np.random.default_rng(42)
+    sample = rng.choice(len(full), size=min(sample_size, len(full)), replace=False)
+
+    k = min(k, len(full))
+    rerank_k = max(min(rerank_k, len(full)), k)
+
+    started = time.perf_counter()
+    _, exact_top = full_index.search(full[sample], k)
+    full_ms = (time.perf_counter() - started) * 1000 / len(sample)
+
+    started = time.perf_counter()
+    _, reduced_top = reduced_index.search(reduced[sample], rerank_k)
+    reduced_ms = (time.perf_counter() - started) * 1000 / len(sample)
+
+    recall_raw = 0.0
+    recall_reranked = 0.0
+    for q, exact_row, reduced_row in zip(full[sample], exact_top, reduced_top):
+        truth = set(exact_row.tolist())
+        recall_raw += len(truth & set(reduced_row[:k].tolist())) / k
+
+        reranked = reduced_row[np.argsort(-(full[reduced_row] @ q))][:k]
+        recall_reranked += len(truth & set(reranked.tolist())) / k
+
+    return {
+        "k": k,
+        "rerank_k": rerank_k,
+        "queries": len(sample),
+        "recall_raw": recall_raw / len(sample),
+        "recall_reranked": recall_reranked / len(sample),
+        "full_ms": full_ms,
+        "reduced_ms": reduced_ms,
+    }
+
+
+async def build_embedding_projection(dim: int, method: str = "pca"):
+    """Обучает проекцию на каталоге и печатает отчёт"""
+    await init_db()
+
+    async with async_session() as session:
+        result = await session.execute(
+            text("SELECT embedding FROM product_embeddings WHERE embedding IS NOT NULL")
+        )
+        matrix = np.asarray([row[0] for row in result.fetchall()], dtype=np.float32)
+
+    if len(matrix) == 0:
+        print("No embeddings found")
+        return
+
+    faiss.normalize_L2(matrix)
+    n, raw_dim = matrix.shape
+
+    if dim >= raw_dim:
+        print(f"dim={dim} >= исходной размерности {raw_dim}, понижать нечего")
+        return
+
+    if method == "pca":
+        projection = EmbeddingProjection.train_pca(matrix, dim)
+        path = projection_path("models", dim)
+        projection.save(path)
+        print(f"✓ PCA сохранена: {path}")
+        print(f"  Сохранено дисперсии: {projection.explained_variance():.1%}")
+    else:
+        projection = EmbeddingProjection.truncate(raw_dim, dim)
+
+    reduced = projection.apply(matrix)
+    report = search_report(matrix, reduced, k=20, rerank_k=settings.embedding_rescore_k)
+
+    print(f"\nEmbeddings: {n}, {method} {raw_dim} -> {dim}")
+    print(f"RAM (float32): {matrix.nbytes / 1024 / 1024:.1f} MB -> {reduced.nbytes / 1024 / 1024:.1f} MB")
+    print(f"Поиск (на запрос): {report['full_ms']:.2f} ms -> {report['reduced_ms']:.2f} ms")
+    print(f"Recall@{report['k']} без rerank: {report['recall_raw']:.4f}")
+    print(f"Recall@{report['k']} с full-dim rerank top-{report['rerank_k']}: {report['recall_reranked']:.4f}")
+    print(f"(по {report['queries']} случайным запросам)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--method", choices=["pca", "truncate"], default="pca")
+    args = parser.parse_args()
+    asyncio.run(build_embedding_projection(args.dim, args.method))
@@ -8,10 +8,90 @@ class Settings(BaseSettings):
     postgres_password: str = "postgres"
     postgres_db: str = "spbtechrun"
 
+    # Пул соединений для запросов API
+    db_pool_size: int = 10
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30.0  # секунды ожидания свободного соединения
+    db_pool_pre_ping: bool = False
+    db_pool_recycle: int = 1800  # секунды; -1 -> не пересоздавать
+    # Отдельный пул для обучения и фоновых задач
+    db_background_pool_size: int = 3
+    db_background_max_overflow: int = 2
+    # Кэш подготовленных выражений asyncpg на соединение; 0 -> выключен и уникальные имена
+    # выражений (pgbouncer в transaction mode, см. README)
+    db_statement_cache_size: int = 100
+    db_plan_cache_mode: str = "auto"  # auto, force_generic_plan, force_custom_plan
+    # Пул asyncpg без SQLAlchemy для горячих чтений ранкера (эмбеддинги, co-purchase)
+    db_fast_path: bool = True
+    db_fast_path_pool_size: int = 10
+
+    # Реплика для чтения (те же пользователь и база); пусто -> всё на основной
+    postgres_replica_host: str = ""
+    postgres_replica_port: int = 5432
+    replica_max_lag: float = 5.0  # секунды; при большем отставании чтения идут на основную
+    replica_check_interval: float = 5.0  # секунды
+
     ollama_url: str = "http://localhost:11434"
     ollama_model: str = "nomic-embed-text"
 
-    embedding_dim: int = 768
+    embedding_dim: int = 768  # Размерность поиска; меньше исходной -> PCA/усечение
+    embedding_reduction: str = "pca"  # pca, truncate
+    embedding_storage: str = "float32"  # float32, float16, int8
+    embedding_rescore_k: int = 100
+    embeddings_file: str = ""  # embeddings.npy из data/export_embeddings.py; пусто -> из БД
+
+    # Буфер событий /events: сброс в БД по размеру или по таймеру
+    event_flush_size: int = 500
+    event_flush_interval: float = 1.0  # секунды
+    event_buffer_max_size: int = 50000  # при переполнении запросы ждут сброса
+    event_buffer_put_timeout: float = 5.0  # дольше -> 503
+
+    # Партиции recommendation_events и дневной rollup
+    events_partition_days_ahead: int = 7
+    events_retention_days: int = 90
+    events_rollup_days: int = 1  # пересчитывать rollup за сегодня и N предыдущих дней
+    events_maintenance_interval: float = 300.0  # секунды; 0 -> только app.maintain_events
+
+    # Write-behind фидбека: счётчики в памяти, сброс пачкой
+    feedback_flush_size: int = 1000
+    feedback_flush_interval: float = 2.0  # секунды
+    feedback_buffer_max_size: int = 50000  # при переполнении запросы ждут сброса
+    feedback_buffer_put_timeout: float = 5.0  # дольше -> 503
+    # Статистика фидбека в памяти: опрос изменений в БД (от других реплик); 0 -> без опроса
+    feedback_store_refresh_interval: float = 5.0  # секунды
+    # Колоночные признаки товаров для ранкера: проверка каталога/скидок/product_stats; 0 -> без обновлений
+    product_features_refresh_interval: float = 60.0  # секунды
+    # CTR-признаки и метки из recommendation_event_daily: окно, сглаживание, порог показов для метки
+    events_ctr_window_days: int = 30
+    ctr_prior_strength: float = 5.0  # псевдо-клики: (clicks + a) / (expected_clicks + a)
+    ctr_label_min_impressions: int = 20
+    event_features_refresh_interval: float = 300.0  # секунды; 0 -> без обновлений
+
+    # Снапшоты обучающей выборки (.npz + метаданные) для повторного обучения без сборки
+    training_datasets_dir: str = "models/datasets"
+    training_datasets_keep: int = 5  # версий на имя; 0 -> хранить все
+    # CatBoost: потоки (-1 -> все ядра), число границ квантования, лимит памяти ("8gb"; пусто -> без лимита)
+    training_thread_count: int = -1
+    training_border_count: int = 254
+    training_used_ram_limit: str = ""
+    # Квантованные Pool рядом со снапшотом выборки: повторное обучение на той же версии без квантования
+    training_quantized_pool_cache: bool = False
+    # Hard negatives: показы без клика/корзины за окно rollup, затем FAISS-соседи из других категорий
+    hard_negative_window_days: int = 30
+    hard_negative_min_impressions: int = 2
+    hard_negative_neighbours_k: int = 50  # 0 -> без соседей
+    # Обучение в отдельном процессе (/ml/train возвращает job_id)
+    training_job_nice: int = 10  # приоритет процесса обучения относительно сервиса; 0 -> как у сервиса
+    training_job_cancel_timeout: float = 10.0  # секунды до принудительного завершения при отмене
+    training_jobs_history: int = 20  # завершённых задач в памяти
+
+    # Реестр моделей: новая модель сначала скорит в shadow долю запросов, в работу — через promote
+    model_shadow_fraction: float = 0.1
+    model_auto_promote: bool = False  # True -> модель после обучения сразу становится активной
+    model_history_size: int = 5  # версий для отката
+
+    # Трассировка запросов: этапы и число обращений к БД -> гистограммы /metrics и ?debug=true
+    tracing_enabled: bool = True
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,88 @@
+"""
+Понижение размерности эмбеддингов для поиска кандидатов: PCA или Matryoshka-усечение.
+PCA обучается офлайн (app.build_embedding_projection) и хранится рядом с моделями.
+"""
+
+import logging
+from pathlib import Path
+from typing import Optional
+
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+REDUCTION_METHODS = ("pca", "truncate")
+
+
+def projection_path(models_dir: str, dim: int) -> Path:
+    return Path(models_dir) / f"embedding_pca_{dim}.faiss"
+
+
+class EmbeddingProjection:
+    """Проекция нормализованных векторов в out_dim с повторной L2-нормализацией"""
+
+    def __init__(self, method: str, in_dim: int, out_dim: int, transform: Optional[faiss.VectorTransform] = None):
+        self.method = method
+        self.in_dim = in_dim
+        self.out_dim = out_dim
+        self.transform = transform
+
+    @classmethod
+    def train_pca(cls, matrix: np.ndarray, out_dim: int) -> "EmbeddingProjection":
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        pca = faiss.PCAMatrix(matrix.shape[1], out_dim)
+        pca.train(matrix)
+        return cls("pca", matrix.shape[1], out_dim, pca)
+
+    @classmethod
+    def truncate(cls, in_dim: int, out_dim: int) -> "EmbeddingProjection":
+        return cls("truncate", in_dim, out_dim)
+
+    @classmethod
+    def load(cls, path: Path) -> "EmbeddingProjection":
+        transform = faiss.read_VectorTransform(str(path))
+        return cls("pca", transform.d_in, transform.d_out, transform)
+
+    def save(self, path: Path):
+        if self.transform is None:
+            raise ValueError("Only PCA projection can be saved")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        faiss.write_VectorTransform(self.transform, str(path))
+
+    def explained_variance(self) -> Optional[float]:
+        """Доля дисперсии, сохранённая PCA"""
+        if self.transform is None:
+            return None
+        eigenvalues = faiss.vector_to_array(self.transform.eigenvalues)
+        return float(eigenvalues[:self.out_dim].sum() / eigenvalues.sum())
+
+    def apply(self, matrix: np.ndarray) -> np.ndarray:
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        if self.transform is not None:
+            reduced = self.transform.apply(matrix)
+        else:
+            reduced = np.ascontiguousarray(matrix[:, :self.out_dim])
+        faiss.normalize_L2(reduced)
+        return reduced
+
+
+def load_projection(method: str, in_dim: int, out_dim: int, models_dir: str = "models") -> Optional[EmbeddingProjection]:
+    """
+    Возвращает проекцию in_dim -> out_dim или None, если понижать не нужно.
+    Если PCA ещё не обучена, откатывается на усечение.
+    """
+    if out_dim <= 0 or out_dim >= in_dim:
+        return None
+
+    if method == "pca":
+        path = projection_path(models_dir, out_dim)
+        if path.exists():
+            projection = EmbeddingProjection.load(path)
+            if projection.in_dim == in_dim:
+                return projection
+            logger.warning(f"PCA {path} trained for dim={projection.in_dim}, got {in_dim}; using truncation")
+        else:
+            logger.warning(f"PCA {path} not found, using truncation. Run: python -m app.build_embedding_projection")
+
+    return EmbeddingProjection.truncate(in_dim, out_dim)
@@ -0,0 +1,107 @@
+"""
+Компактное хранение эмбеддингов: float16 и int8 с per-vector scale.
+
+Формат bytea в product_embeddings.embedding_q:
+- float16: d * 2 байт (little-endian)
+- int8:    4 байта scale (float32) + d байт кодов
+"""
+
+from typing import Optional
+
+import numpy as np
+
+STORAGE_MODES = ("float32", "float16", "int8")
+
+
+def quantize(matrix: np.ndarray, mode: str) -> tuple[np.ndarray, Optional[np.ndarray]]:
+    """Квантует матрицу эмбеддингов. Возвращает (коды, scales); scales только для int8."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if mode == "float16":
+        return matrix.astype(np.float16), None
+    if mode == "int8":
+        scales = np.abs(matrix).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.rint(matrix / scales[:, None]).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    return matrix, None
+
+
+def dequantize(codes: np.ndarray, scales: Optional[np.ndarray] = None) -> np.ndarray:
+    """Восстанавливает float32 из компактного представления."""
+    matrix = codes.astype(np.float32)
+    if scales is not None:
+        matrix *= scales.reshape(-1, 1) if matrix.ndim == 2 else scales
+    return matrix
+
+
+def encode_vector(vector: np.ndarray, mode: str) -> bytes:
+    """Кодирует один вектор в bytea для колонки embedding_q."""
+    codes, scales = quantize(np.asarray(vector, dtype=np.float32).reshape(1, -1), mode)
+    if mode == "int8":
+        return scales.astype("<f4").tobytes() + codes.tobytes()
+    if mode == "float16":
+        return codes.astype("<f2").tobytes()
+    return codes.astype("<f4").tobytes()
+
+
+def decode_vector(data: bytes, mode: str) -> tuple[np.ndarray, float]:
+    """Декодирует bytea в (коды, scale). Для float16 scale = 1.0."""
+    if mode == "int8":
+        scale = float(np.frombuffer(data, dtype="<f4", count=1)[0])
+        return np.frombuffer(data, dtype=np.int8, offset=4), scale
+    if mode == "float16":
+        return np.frombuffer(data, dtype="<f2"), 1.0
+    return np.frombuffer(data, dtype="<f4"), 1.0
+
+
+def stored_size(dim: int, mode: str) -> int:
+    """Размер вектора в БД в байтах (без overhead строки)."""
+    if mode == "int8":
+        return 4 + dim
+    if mode == "float16":
+        return 2 * dim
+    return 8 * dim  # FLOAT[] = double precision
+
+
+class CompactIndex:
+    """
+    Brute-force inner-product поиск по квантованной матрице.
+    Интерфейс совместим с faiss.IndexFlatIP: search / reconstruct / ntotal.
+    """
+
+    def __init__(self, codes: np.ndarray, scales: Optional[np.ndarray] = None, chunk_size: int = 16384):
+        self.codes = codes
+        self.scales = scales
+        self.chunk_size = chunk_size
+
+    @property
+    def ntotal(self) -> int:
+        return self.codes.shape[0]
+
+    @property
+    def d(self) -> int:
+        return self.codes.shape[1]
+
+    def reconstruct(self, idx: int) -> np.ndarray:
+        scale = self.scales[idx] if self.scales is not None else None
+        return dequantize(self.codes[idx], scale)
+
+    def search(self, queries: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        queries = np.asarray(queries, dtype=np.float32)
+        n = self.ntotal
+        k = min(k, n)
+        scores = np.empty((queries.shape[0], n), dtype=np.float32)
+
+        # Декодируем блоками, чтобы не держать float32-копию всей матрицы
+        for start in range(0, n, self.chunk_size):
+            end = min(start + self.chunk_size, n)
+            block = self.codes[start:end].astype(np.float32)
+            block_scores = queries @ block.T
+            if self.scales is not None:
+                block_scores *= self.scales[start:end]
+            scores[:, start:end] = block_scores
+
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        return np.take_along_axis(top_scores, order, axis=1), np.take_along_axis(top, order, axis=1)
@@ -0,0 +1,158 @@
+"""
+Лёгкая трассировка запросов: этапы (span) и число обращений к БД.
+
+TracingMiddleware кладёт Trace запроса в ContextVar; span("name") добавляет время этапа,
+count_db_query() — один round-trip (SQLAlchemy-листенер в database.py и fast_reader).
+Вложенные этапы именуются через точку ("candidates.faiss") и входят во время родителя;
+повторный этап (группа сценария в цикле) суммируется. По завершении запроса время этапов,
+запроса и число запросов к БД попадают в гистограммы по шаблону маршрута — /metrics
+отдаёт их в текстовом формате Prometheus; ?debug=true возвращает разбивку в ответе.
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+# Секунды: от долей миллисекунды (FAISS, predict) до медленных запросов
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+DB_QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Trace:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}  # секунды, в порядке первого входа
+        self.db_queries = 0
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def breakdown(self) -> Dict:
+        return {
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 3),
+            "db_queries": self.db_queries,
+            "stages_ms": {stage: round(seconds * 1000, 3) for stage, seconds in self.stages.items()},
+        }
+
+
+_current: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+@contextmanager
+def span(stage: str):
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(stage, time.perf_counter() - start)
+
+
+def count_db_query():
+    trace = _current.get()
+    if trace is not None:
+        trace.db_queries += 1
+
+
+class Histogram:
+    """Кумулятивные корзины Prometheus по набору меток"""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...], buckets: Tuple[float, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series: Dict[Tuple[str, ...], list] = {}  # метки -> [счётчики корзин..., sum, count]
+
+    def observe(self, labels: Tuple[str, ...], value: float):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self._series.items()):
+            pairs = list(zip(self.label_names, labels))
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_labels(pairs + [('le', f'{bound:g}')])} {count}")
+            lines.append(f"{self.name}_bucket{_labels(pairs + [('le', '+Inf')])} {series[-1]}")
+            lines.append(f"{self.name}_sum{_labels(pairs)} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{_labels(pairs)} {series[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(pairs) -> str:
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+request_duration = Histogram(
+    "recommendation_request_duration_seconds", "Request duration by route",
+    ("method", "endpoint", "status"), DURATION_BUCKETS,
+)
+stage_duration = Histogram(
+    "recommendation_stage_duration_seconds", "Time spent in a request stage",
+    ("endpoint", "stage"), DURATION_BUCKETS,
+)
+db_queries = Histogram(
+    "recommendation_db_queries", "Database round-trips per request",
+    ("endpoint",), DB_QUERY_BUCKETS,
+)
+
+
+def observe(method: str, endpoint: str, status: int, trace: Trace):
+    request_duration.observe((method, endpoint, str(status)), time.perf_counter() - trace.started)
+    db_queries.observe((endpoint,), trace.db_queries)
+    for stage, seconds in trace.stages.items():
+        stage_duration.observe((endpoint, stage), seconds)
+
+
+def render_metrics() -> str:
+    return "".join(h.render() for h in (request_duration, stage_duration, db_queries))
+
+
+class TracingMiddleware:
+    """ASGI middleware: Trace на каждый HTTP-запрос, метрики — по шаблону маршрута"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace()
+        token = _current.set(trace)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _current.reset(token)
+            # Маршрут проставляет роутер Starlette; без него (404) метки не плодим
+            route = scope.get("route")
+            if route is not None:
+                observe(scope["method"], getattr(route, "path", "unknown"), status, trace)
@@ -1,4 +1,4 @@
-from .database import engine, async_session, Base, init_db, get_session
+from .database import engine, async_session, background_session, Base, init_db, get_session, pool_metrics
 from .models import (
     ProductEmbedding,
     ScenarioFeedback,
@@ -10,9 +10,11 @@ from .models import (
 __all__ = [
     "engine",
     "async_session",
+    "background_session",
     "Base",
     "init_db",
     "get_session",
+    "pool_metrics",
     "ProductEmbedding",
     "ScenarioFeedback",
     "ScenarioFeedbackStats",
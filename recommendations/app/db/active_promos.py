@@ -0,0 +1,26 @@
+"""
+Снапшот активных скидок (таблица active_promos, миграция 000009).
+Пересобирается функцией refresh_active_promos() в БД: после импорта скидок
+это делает data/load_data.py, на смене дня — сервис.
+"""
+
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+async def refresh_active_promos(session: AsyncSession, only_if_stale: bool = True) -> Optional[int]:
+    """Пересобирает снапшот; при only_if_stale — только если он собран не сегодня. Возвращает число скидок"""
+    if only_if_stale:
+        stale = (await session.execute(text("""
+            SELECT NOT EXISTS (
+                SELECT 1 FROM active_promos_snapshot WHERE snapshot_date = CURRENT_DATE
+            )
+        """))).scalar()
+        if not stale:
+            return None
+
+    total = (await session.execute(text("SELECT refresh_active_promos()"))).scalar()
+    await session.commit()
+    return total
@@ -1,13 +1,150 @@
+import time
+from uuid import uuid4
+
+from sqlalchemy import event, exc
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from ..core.config import settings
+from ..core.tracing import count_db_query
 
 DATABASE_URL = f"postgresql+asyncpg://{settings.postgres_user}:{settings.postgres_password}@{settings.postgres_host}:{settings.postgres_port}/{settings.postgres_db}"
+REPLICA_DATABASE_URL = (
+    f"postgresql+asyncpg://{settings.postgres_user}:{settings.postgres_password}@{settings.postgres_replica_host}:{settings.postgres_replica_port}/{settings.postgres_db}"
+    if settings.postgres_replica_host else None
+)
+
+
+def is_row_error(error: BaseException) -> bool:
+    """
+    Ошибка в самих данных (SQLSTATE 22xxx / 23xxx): пакетная запись падает целиком, хотя
+    остальные строки валидны. Адаптер asyncpg в SQLAlchemy отдаёт большую часть таких ошибок
+    как общий DBAPIError, поэтому смотрим на код, а не на класс исключения.
+    """
+    if isinstance(error, exc.DBAPIError):
+        error = error.orig
+    sqlstate = getattr(error, "sqlstate", None) or ""
+    return sqlstate[:2] in ("22", "23")
+
+
+class PoolMetrics:
+    """Ожидание соединения из пула и попадания в кэш подготовленных выражений"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.checkouts = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+        self.checkout_timeouts = 0
+        self.statement_cache_hits = 0
+        self.statement_cache_misses = 0
+
+    def observe_checkout(self, seconds: float):
+        self.checkouts += 1
+        self.checkout_wait_total += seconds
+        self.checkout_wait_max = max(self.checkout_wait_max, seconds)
+
+    def snapshot(self, pool) -> dict:
+        statements = self.statement_cache_hits + self.statement_cache_misses
+        return {
+            "pool_size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "overflow": max(pool.overflow(), 0),
+            "checkouts": self.checkouts,
+            "checkout_wait_avg_ms": self.checkout_wait_total / self.checkouts * 1000 if self.checkouts else 0.0,
+            "checkout_wait_max_ms": self.checkout_wait_max * 1000,
+            "checkout_timeouts": self.checkout_timeouts,
+            "statement_cache_hits": self.statement_cache_hits,
+            "statement_cache_misses": self.statement_cache_misses,
+            "statement_cache_hit_rate": self.statement_cache_hits / statements if statements else 0.0,
+        }
+
+
+class _TimedQueuePool(AsyncAdaptedQueuePool):
+    metrics: PoolMetrics
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.checkout_timeouts += 1
+            raise
+        finally:
+            self.metrics.observe_checkout(time.perf_counter() - start)
 
-engine = create_async_engine(DATABASE_URL, echo=False)
+
+def _create_engine(name: str, url: str, pool_size: int, max_overflow: int, read_only: bool = False):
+    metrics = PoolMetrics(name)
+    poolclass = type(f"TimedQueuePool_{name}", (_TimedQueuePool,), {"metrics": metrics})
+
+    server_settings = {}
+    if settings.db_plan_cache_mode != "auto":
+        server_settings["plan_cache_mode"] = settings.db_plan_cache_mode
+    if read_only:
+        # Случайная запись через пул реплики упадёт сразу, а не после промоута реплики
+        server_settings["default_transaction_read_only"] = "on"
+    connect_args = {"prepared_statement_cache_size": settings.db_statement_cache_size}
+    if settings.db_statement_cache_size == 0:
+        # pgbouncer (transaction mode): адаптер всё равно готовит именованные выражения,
+        # а соединение с сервером меняется между транзакциями — имена должны быть уникальны
+        connect_args["prepared_statement_name_func"] = lambda: f"__asyncpg_{uuid4()}__"
+    if server_settings:
+        connect_args["server_settings"] = server_settings
+
+    db_engine = create_async_engine(
+        url,
+        echo=False,
+        poolclass=poolclass,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_pre_ping=settings.db_pool_pre_ping,
+        pool_recycle=settings.db_pool_recycle,
+        connect_args=connect_args,
+    )
+
+    @event.listens_for(db_engine.sync_engine, "before_cursor_execute")
+    def _count_statement_cache(conn, cursor, statement, parameters, context, executemany):
+        count_db_query()
+        # LRU подготовленных выражений адаптера asyncpg, ключ — текст SQL
+        cache = getattr(conn.connection.dbapi_connection, "_prepared_statement_cache", None)
+        if cache is None:
+            return
+        if statement in cache:
+            metrics.statement_cache_hits += 1
+        else:
+            metrics.statement_cache_misses += 1
+
+    return db_engine, metrics
+
+
+# Запросы API
+engine, engine_metrics = _create_engine("primary", DATABASE_URL, settings.db_pool_size, settings.db_max_overflow)
 async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
+# Обучение и фоновые задачи: отдельный небольшой пул, чтобы не забирать соединения у запросов
+background_engine, background_engine_metrics = _create_engine(
+    "background", DATABASE_URL, settings.db_background_pool_size, settings.db_background_max_overflow
+)
+background_session = sessionmaker(background_engine, class_=AsyncSession, expire_on_commit=False)
+
+# Реплика: те же два пула, только для чтения (маршрутизация — replica.replica_router)
+replica_engines = []
+replica_session = None
+replica_background_session = None
+if REPLICA_DATABASE_URL:
+    replica_engines = [
+        _create_engine("replica", REPLICA_DATABASE_URL, settings.db_pool_size, settings.db_max_overflow, read_only=True),
+        _create_engine(
+            "replica_background", REPLICA_DATABASE_URL,
+            settings.db_background_pool_size, settings.db_background_max_overflow, read_only=True,
+        ),
+    ]
+    replica_session = sessionmaker(replica_engines[0][0], class_=AsyncSession, expire_on_commit=False)
+    replica_background_session = sessionmaker(replica_engines[1][0], class_=AsyncSession, expire_on_commit=False)
+
 Base = declarative_base()
 
 
@@ -18,3 +155,10 @@ async def init_db():
 async def get_session() -> AsyncSession:
     async with async_session() as session:
         yield session
+
+
+def pool_metrics() -> dict:
+    return {
+        metrics.name: metrics.snapshot(db_engine.pool)
+        for db_engine, metrics in [(engine, engine_metrics), (background_engine, background_engine_metrics)] + replica_engines
+    }
@@ -0,0 +1,172 @@
+"""
+Обслуживание партиционированной recommendation_events (миграция 000008).
+"""
+
+import re
+from datetime import date, timedelta
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..core.config import settings
+
+PARTITION_PREFIX = "recommendation_events_p"
+PARTITION_NAME_RE = re.compile(rf"^{PARTITION_PREFIX}(\d{{8}})$")
+
+# Позиции глубже — одна корзина для среднего CTR позиции (как в миграции 000010)
+POSITION_PRIOR_MAX_RANK = 50
+
+
+def partition_name(day: date) -> str:
+    return f"{PARTITION_PREFIX}{day:%Y%m%d}"
+
+
+async def ensure_partitions(session: AsyncSession, start: date, end: date) -> list[str]:
+    """
+    Создаёт дневные партиции recommendation_events на [start, end].
+    Если события за день уже упали в default-партицию, переносит их в новую.
+    """
+    created = []
+    day = start
+    while day <= end:
+        name = partition_name(day)
+        exists = await session.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name})
+        if not exists.scalar():
+            bounds = {"start": day, "end": day + timedelta(days=1)}
+            in_default = await session.execute(
+                text("""
+                    SELECT EXISTS (
+                        SELECT 1 FROM recommendation_events_default
+                        WHERE created_at >= :start AND created_at < :end
+                    )
+                """),
+                bounds
+            )
+            if in_default.scalar():
+                await session.execute(text(
+                    f"CREATE TABLE {name} (LIKE recommendation_events INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+                ))
+                await session.execute(
+                    text(f"""
+                        WITH moved AS (
+                            DELETE FROM recommendation_events_default
+                            WHERE created_at >= :start AND created_at < :end
+                            RETURNING *
+                        )
+                        INSERT INTO {name} SELECT * FROM moved
+                    """),
+                    bounds
+                )
+                await session.execute(text(
+                    f"ALTER TABLE recommendation_events ATTACH PARTITION {name} "
+                    f"FOR VALUES FROM ('{bounds['start']}') TO ('{bounds['end']}')"
+                ))
+            else:
+                await session.execute(text(
+                    f"CREATE TABLE {name} PARTITION OF recommendation_events "
+                    f"FOR VALUES FROM ('{bounds['start']}') TO ('{bounds['end']}')"
+                ))
+            created.append(name)
+        day += timedelta(days=1)
+    return created
+
+
+async def rollup_events(session: AsyncSession, start: date, end: date) -> int:
+    """
+    Пересчитывает recommendation_event_daily за дни [start, end] целиком (идемпотентно).
+    Благодаря партиционированию читаются только партиции этих дней.
+    expected_clicks / expected_add_to_cart — сумма средних CTR/ATC дня на позициях,
+    где пару показали (знаменатель CTR с поправкой на позицию).
+    """
+    result = await session.execute(
+        text("""
+            WITH position_prior AS (
+                SELECT created_at::date AS day,
+                       LEAST(COALESCE(recommendation_rank, 0), :max_rank) AS rank,
+                       COUNT(*) FILTER (WHERE event_type = 'click')::float8
+                           / NULLIF(COUNT(*) FILTER (WHERE event_type = 'impression'), 0) AS click_rate,
+                       COUNT(*) FILTER (WHERE event_type = 'add_to_cart')::float8
+                           / NULLIF(COUNT(*) FILTER (WHERE event_type = 'impression'), 0) AS add_to_cart_rate
+                FROM recommendation_events
+                WHERE created_at >= :start AND created_at < :end
+                GROUP BY 1, 2
+            )
+            INSERT INTO recommendation_event_daily
+                (main_product_id, recommended_product_id, day, impressions, clicks, add_to_cart,
+                 expected_clicks, expected_add_to_cart, updated_at)
+            SELECT e.main_product_id, e.recommended_product_id, e.created_at::date,
+                   COUNT(*) FILTER (WHERE e.event_type = 'impression'),
+                   COUNT(*) FILTER (WHERE e.event_type = 'click'),
+                   COUNT(*) FILTER (WHERE e.event_type = 'add_to_cart'),
+                   COALESCE(SUM(p.click_rate) FILTER (WHERE e.event_type = 'impression'), 0),
+                   COALESCE(SUM(p.add_to_cart_rate) FILTER (WHERE e.event_type = 'impression'), 0),
+                   NOW()
+            FROM recommendation_events e
+            LEFT JOIN position_prior p
+                ON p.day = e.created_at::date
+                AND p.rank = LEAST(COALESCE(e.recommendation_rank, 0), :max_rank)
+            WHERE e.created_at >= :start AND e.created_at < :end
+            GROUP BY e.main_product_id, e.recommended_product_id, e.created_at::date
+            ON CONFLICT (main_product_id, recommended_product_id, day)
+            DO UPDATE SET impressions = EXCLUDED.impressions,
+                          clicks = EXCLUDED.clicks,
+                          add_to_cart = EXCLUDED.add_to_cart,
+                          expected_clicks = EXCLUDED.expected_clicks,
+                          expected_add_to_cart = EXCLUDED.expected_add_to_cart,
+                          updated_at = NOW()
+        """),
+        {"start": start, "end": end + timedelta(days=1), "max_rank": POSITION_PRIOR_MAX_RANK}
+    )
+    return result.rowcount
+
+
+async def drop_expired_partitions(session: AsyncSession, keep_from: date) -> list[str]:
+    """Удаляет партиции старше keep_from (rollup за эти дни остаётся)"""
+    result = await session.execute(text("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'recommendation_events'::regclass
+    """))
+
+    dropped = []
+    for (name,) in result.fetchall():
+        match = PARTITION_NAME_RE.match(name)
+        if not match:
+            continue
+        day = date(int(match.group(1)[:4]), int(match.group(1)[4:6]), int(match.group(1)[6:]))
+        if day < keep_from:
+            await session.execute(text(f"DROP TABLE {name}"))
+            dropped.append(name)
+
+    await session.execute(
+        text("DELETE FROM recommendation_events_default WHERE created_at < :keep_from"),
+        {"keep_from": keep_from}
+    )
+    return sorted(dropped)
+
+
+async def run_maintenance(session: AsyncSession, rollup_days: Optional[int] = None) -> Optional[dict]:
+    """
+    Один проход обслуживания. Между репликами сервиса сериализуется
+    advisory-локом; если лок занят, возвращает None.
+    """
+    locked = await session.execute(
+        text("SELECT pg_try_advisory_xact_lock(hashtext('recommendation_events_maintenance'))")
+    )
+    if not locked.scalar():
+        return None
+
+    today = date.today()
+    if rollup_days is None:
+        rollup_days = settings.events_rollup_days
+
+    created = await ensure_partitions(
+        session, today - timedelta(days=1), today + timedelta(days=settings.events_partition_days_ahead)
+    )
+    rolled = await rollup_events(session, today - timedelta(days=rollup_days), today)
+    dropped = await drop_expired_partitions(session, today - timedelta(days=settings.events_retention_days))
+    await session.commit()
+
+    return {"created": created, "dropped": dropped, "rollup_rows": rolled}
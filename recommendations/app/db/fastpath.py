@@ -0,0 +1,124 @@
+"""
+Быстрый путь чтения для ранжирования: отдельный пул asyncpg без SQLAlchemy.
+
+Выражения готовятся один раз на соединение (кэш подготовленных выражений asyncpg),
+эмбеддинг приходит как bytea (array_send — бинарный формат float8[]) и декодируется
+сразу в NumPy — без списка Python float на каждый элемент. Результаты — столбцы
+и матрицы для feature_extractor.extract_batch.
+Чтения идут на реплику, если она здорова (replica_router).
+"""
+
+import logging
+import struct
+from typing import Optional
+
+import asyncpg
+import numpy as np
+
+from ..core.config import settings
+from ..core.tracing import count_db_query
+from .replica import replica_router
+
+logger = logging.getLogger(__name__)
+
+EMBEDDINGS_SQL = "SELECT product_id, array_send(embedding) FROM product_embeddings WHERE product_id = ANY($1::int[])"
+
+COPURCHASE_SQL = """
+    SELECT product_id_2, copurchase_count
+    FROM copurchase_stats
+    WHERE product_id_1 = $1 AND product_id_2 = ANY($2::int[])
+    UNION
+    SELECT product_id_1, copurchase_count
+    FROM copurchase_stats
+    WHERE product_id_2 = $1 AND product_id_1 = ANY($2::int[])
+"""
+
+# Элемент одномерного массива без NULL в бинарном формате: длина + значение
+_FLOAT8_ITEM = np.dtype([("length", ">i4"), ("value", ">f8")])
+_ARRAY_HEADER = struct.Struct(">iiI")
+_DIMENSION = struct.Struct(">ii")
+
+
+def decode_float8_array(data: bytes) -> np.ndarray:
+    """Бинарное представление float8[] (array_send) -> float32 вектор"""
+    ndim, has_null, _ = _ARRAY_HEADER.unpack_from(data)
+    if ndim == 0:
+        return np.empty(0, dtype=np.float32)
+    if ndim != 1 or has_null:
+        raise ValueError("only one-dimensional float8[] without NULLs is supported")
+    size, _ = _DIMENSION.unpack_from(data, _ARRAY_HEADER.size)
+    items = np.frombuffer(data, dtype=_FLOAT8_ITEM, count=size, offset=_ARRAY_HEADER.size + _DIMENSION.size)
+    return items["value"].astype(np.float32)
+
+
+class FastReader:
+    def __init__(self):
+        self._pool: Optional[asyncpg.Pool] = None
+        self._replica_pool: Optional[asyncpg.Pool] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._pool is not None
+
+    async def _create_pool(self, host: str, port: int) -> asyncpg.Pool:
+        return await asyncpg.create_pool(
+            host=host,
+            port=port,
+            user=settings.postgres_user,
+            password=settings.postgres_password,
+            database=settings.postgres_db,
+            min_size=1,
+            max_size=settings.db_fast_path_pool_size,
+            statement_cache_size=settings.db_statement_cache_size,
+        )
+
+    async def start(self):
+        if not settings.db_fast_path or self._pool is not None:
+            return
+        self._pool = await self._create_pool(settings.postgres_host, settings.postgres_port)
+        if replica_router.enabled:
+            try:
+                self._replica_pool = await self._create_pool(
+                    settings.postgres_replica_host, settings.postgres_replica_port
+                )
+            except Exception as e:
+                logger.warning(f"Fast path replica pool not created: {e}")
+
+    async def stop(self):
+        for pool in (self._pool, self._replica_pool):
+            if pool is not None:
+                await pool.close()
+        self._pool = None
+        self._replica_pool = None
+
+    def _read_pool(self) -> asyncpg.Pool:
+        if self._replica_pool is not None and replica_router.healthy:
+            return self._replica_pool
+        return self._pool
+
+    async def embedding_matrix(self, product_ids: list[int]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Матрица эмбеддингов (len(product_ids), dim) float32 в порядке product_ids и маска найденных.
+        Строки ненайденных товаров — нули.
+        """
+        count_db_query()
+        rows = await self._read_pool().fetch(EMBEDDINGS_SQL, product_ids)
+        vectors = {row[0]: vector for row in rows if len(vector := decode_float8_array(row[1]))}
+        valid = np.fromiter((pid in vectors for pid in product_ids), dtype=bool, count=len(product_ids))
+        if not vectors:
+            return np.zeros((len(product_ids), 0), dtype=np.float32), valid
+        dim = len(next(iter(vectors.values())))
+        matrix = np.zeros((len(product_ids), dim), dtype=np.float32)
+        if valid.any():
+            matrix[valid] = np.stack([vectors[pid] for pid in product_ids if pid in vectors])
+        return matrix, valid
+
+    async def copurchase_counts(self, product_id: int, candidate_ids: list[int]) -> np.ndarray:
+        """Число совместных покупок для кандидатов в порядке candidate_ids"""
+        count_db_query()
+        rows = await self._read_pool().fetch(COPURCHASE_SQL, product_id, candidate_ids)
+        counts = {row[0]: row[1] for row in rows}
+        return np.fromiter((counts.get(cid, 0) for cid in candidate_ids), dtype=np.float64, count=len(candidate_ids))
+
+
+fast_reader = FastReader()
@@ -0,0 +1,339 @@
+"""
+Write-behind для фидбека: счётчики pair_feedback_stats / scenario_feedback_stats
+копятся в памяти и сбрасываются пачкой, сырой лог пишется через COPY.
+Чтения (queries.get_pair_feedback_stats / get_scenario_feedback_stats)
+досчитывают ещё не записанные дельты, так что свежесть не теряется.
+"""
+
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Callable, Optional
+
+from sqlalchemy import text
+
+from ..core.config import settings
+from .database import background_session, is_row_error
+
+logger = logging.getLogger(__name__)
+
+PAIR_LOG_COLUMNS = ["user_id", "main_product_id", "recommended_product_id", "feedback_type", "context"]
+SCENARIO_LOG_COLUMNS = ["user_id", "scenario_id", "group_name", "product_id", "feedback_type"]
+
+
+def _new_deltas() -> defaultdict:
+    # key -> {product_id: [positive, negative]}
+    return defaultdict(lambda: defaultdict(lambda: [0, 0]))
+
+
+def _count_pair(deltas: dict, record: tuple, step: int = 1):
+    _, main_product_id, recommended_product_id, feedback_type, _ = record
+    deltas[main_product_id][recommended_product_id][0 if feedback_type == "positive" else 1] += step
+
+
+def _count_scenario(deltas: dict, record: tuple, step: int = 1):
+    _, scenario_id, group_name, product_id, feedback_type = record
+    deltas[(scenario_id, group_name)][product_id][0 if feedback_type == "positive" else 1] += step
+
+
+class FeedbackBufferFull(Exception):
+    """Буфер не освободился за feedback_buffer_put_timeout"""
+
+
+class FeedbackBuffer:
+    def __init__(self):
+        self._pair_deltas = _new_deltas()       # main_product_id -> {recommended_id: [pos, neg]}
+        self._scenario_deltas = _new_deltas()   # (scenario_id, group_name) -> {product_id: [pos, neg]}
+        self._pair_log: list[tuple] = []
+        self._scenario_log: list[tuple] = []
+        # Дельты, которые сейчас пишутся в БД: до коммита их тоже нужно учитывать при чтении
+        self._inflight_pairs = _new_deltas()
+        self._inflight_scenarios = _new_deltas()
+        self._flush_requested = asyncio.Event()
+        self._space_available = asyncio.Event()
+        self._space_available.set()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._listeners: list[Callable[[dict, dict], None]] = []
+        self.dropped_total = 0
+
+    def __len__(self) -> int:
+        return len(self._pair_log) + len(self._scenario_log)
+
+    async def record_pair(
+        self,
+        main_product_id: int,
+        recommended_product_id: int,
+        feedback_type: str,
+        user_id: int = None,
+        context: str = "product_page",
+    ):
+        await self._wait_for_space()
+        record = (user_id, main_product_id, recommended_product_id, feedback_type, context)
+        self._pair_log.append(record)
+        _count_pair(self._pair_deltas, record)
+        self._maybe_request_flush()
+
+    async def record_scenario(
+        self,
+        scenario_id: str,
+        group_name: str,
+        product_id: int,
+        feedback_type: str,
+        user_id: int = None,
+    ):
+        await self._wait_for_space()
+        record = (user_id, scenario_id, group_name, product_id, feedback_type)
+        self._scenario_log.append(record)
+        _count_scenario(self._scenario_deltas, record)
+        self._maybe_request_flush()
+
+    async def _wait_for_space(self):
+        """При feedback_buffer_max_size записей ждёт сброса, как EventBuffer.put"""
+        while len(self) >= settings.feedback_buffer_max_size:
+            self._space_available.clear()
+            self._flush_requested.set()
+            try:
+                await asyncio.wait_for(self._space_available.wait(), settings.feedback_buffer_put_timeout)
+            except asyncio.TimeoutError:
+                raise FeedbackBufferFull() from None
+
+    def _maybe_request_flush(self):
+        if len(self) >= settings.feedback_flush_size:
+            self._flush_requested.set()
+
+    def _requeue(self, pair_log: list[tuple], scenario_log: list[tuple]):
+        """Возвращает незаписанные записи в начало буфера; дельты пересчитываются по логу"""
+        self._pair_log = pair_log + self._pair_log
+        self._scenario_log = scenario_log + self._scenario_log
+        for record in pair_log:
+            _count_pair(self._pair_deltas, record)
+        for record in scenario_log:
+            _count_scenario(self._scenario_deltas, record)
+
+    @staticmethod
+    def _merge(stats: dict[int, dict], *sources: dict):
+        for source in sources:
+            for product_id, (positive, negative) in source.items():
+                if product_id not in stats:
+                    stats[product_id] = {"positive": 0, "negative": 0}
+                stats[product_id]["positive"] += positive
+                stats[product_id]["negative"] += negative
+
+    def merge_pair_stats(self, main_product_id: int, product_ids: list[int], stats: dict[int, dict]) -> dict[int, dict]:
+        """Добавляет к статистике из БД незаписанные дельты пар (main, rec) для product_ids"""
+        wanted = set(product_ids)
+        self._merge(stats, *(
+            {pid: c for pid, c in deltas[main_product_id].items() if pid in wanted}
+            for deltas in (self._inflight_pairs, self._pair_deltas)
+            if main_product_id in deltas
+        ))
+        return stats
+
+    def merge_scenario_stats(
+        self, scenario_id: str, group_name: str, product_ids: list[int], stats: dict[int, dict]
+    ) -> dict[int, dict]:
+        """Добавляет к статистике из БД незаписанные дельты (scenario, group, product)"""
+        key = (scenario_id, group_name)
+        wanted = set(product_ids)
+        self._merge(stats, *(
+            {pid: c for pid, c in deltas[key].items() if pid in wanted}
+            for deltas in (self._inflight_scenarios, self._scenario_deltas)
+            if key in deltas
+        ))
+        return stats
+
+    def add_listener(self, listener: Callable[[dict, dict], None]):
+        """listener(pair_deltas, scenario_deltas) вызывается после коммита каждой пачки"""
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Final feedback flush failed, {len(self)} records lost: {e}")
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), settings.feedback_flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Feedback flush failed: {e}")
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pair_log and not self._scenario_log:
+                return
+
+            pair_log, self._pair_log = self._pair_log, []
+            scenario_log, self._scenario_log = self._scenario_log, []
+            self._inflight_pairs, self._pair_deltas = self._pair_deltas, _new_deltas()
+            self._inflight_scenarios, self._scenario_deltas = self._scenario_deltas, _new_deltas()
+
+            committed = None
+            try:
+                try:
+                    async with background_session() as session:
+                        await self._write(session, self._inflight_pairs, self._inflight_scenarios, pair_log, scenario_log)
+                        await session.commit()
+                        # Дельты уже в БД: убираем их из inflight сразу после коммита, до закрытия
+                        # сессии и слушателей — иначе чтения в этом окне посчитают их дважды
+                        committed = self._take_inflight()
+                except Exception as e:
+                    if committed is not None:
+                        # Упало уже после коммита (закрытие сессии) — повторять нельзя
+                        logger.warning("Feedback session close failed after commit", exc_info=True)
+                    elif is_row_error(e):
+                        # Одна битая запись валит всю пачку — пишем построчно и отбрасываем только её
+                        logger.warning(
+                            f"Bulk feedback write of {len(pair_log) + len(scenario_log)} records failed ({e}), "
+                            f"retrying row by row"
+                        )
+                        committed = await self._write_rows(pair_log, scenario_log)
+                    else:
+                        # БД недоступна: возвращаем всё в буфер, повторим на следующем тике
+                        self._take_inflight()
+                        self._requeue(pair_log, scenario_log)
+                        raise
+            finally:
+                self._space_available.set()
+
+            self._notify(committed)
+
+    def _notify(self, committed: tuple[dict, dict]):
+        for listener in self._listeners:
+            try:
+                listener(*committed)
+            except Exception as e:
+                logger.error(f"Feedback flush listener failed: {e}")
+
+    async def _write_rows(self, pair_log: list[tuple], scenario_log: list[tuple]) -> tuple[dict, dict]:
+        """
+        Построчная запись: каждая запись (лог + её +1 к счётчику) — своя транзакция,
+        невалидные отбрасываются. Обработанная запись сразу снимается с inflight.
+        Если посреди записи отвалилась БД, уже записанное отдаётся слушателям,
+        а остаток возвращается в буфер.
+        """
+        records = [(False, record) for record in pair_log] + [(True, record) for record in scenario_log]
+        committed = (_new_deltas(), _new_deltas())
+        done = 0
+        try:
+            async with background_session() as session:
+                for is_scenario, record in records:
+                    count = _count_scenario if is_scenario else _count_pair
+                    deltas = (_new_deltas(), _new_deltas())
+                    count(deltas[is_scenario], record)
+                    logs = ([], [record]) if is_scenario else ([record], [])
+                    try:
+                        await self._write(session, *deltas, *logs)
+                        await session.commit()
+                    except Exception as e:
+                        if not is_row_error(e):
+                            raise
+                        await session.rollback()
+                        self.dropped_total += 1
+                        logger.warning(f"Dropped feedback record {record}: {e}")
+                    else:
+                        count(committed[is_scenario], record)
+                    count((self._inflight_pairs, self._inflight_scenarios)[is_scenario], record, -1)
+                    done += 1
+        except Exception:
+            self._take_inflight()
+            rest = records[done:]
+            self._requeue(
+                [record for is_scenario, record in rest if not is_scenario],
+                [record for is_scenario, record in rest if is_scenario],
+            )
+            self._notify(committed)
+            raise
+        self._take_inflight()
+        return committed
+
+    def _take_inflight(self) -> tuple[dict, dict]:
+        taken = self._inflight_pairs, self._inflight_scenarios
+        self._inflight_pairs = _new_deltas()
+        self._inflight_scenarios = _new_deltas()
+        return taken
+
+    @staticmethod
+    async def _write(session, pair_deltas: dict, scenario_deltas: dict, pair_log: list[tuple], scenario_log: list[tuple]):
+        """Одна транзакция (коммитит вызывающий): upsert счётчиков (в порядке ключей — без дедлоков между репликами) + COPY логов"""
+        pairs = sorted(
+            (main_id, rec_id, pos, neg)
+            for main_id, products in pair_deltas.items()
+            for rec_id, (pos, neg) in products.items()
+        )
+        if pairs:
+            main_ids, rec_ids, positives, negatives = map(list, zip(*pairs))
+            await session.execute(
+                text("""
+                    INSERT INTO pair_feedback_stats
+                        (main_product_id, recommended_product_id, positive_count, negative_count)
+                    SELECT * FROM unnest(
+                        CAST(:main_ids AS INT[]), CAST(:rec_ids AS INT[]),
+                        CAST(:positives AS INT[]), CAST(:negatives AS INT[])
+                    )
+                    ON CONFLICT (main_product_id, recommended_product_id)
+                    DO UPDATE SET positive_count = pair_feedback_stats.positive_count + EXCLUDED.positive_count,
+                                  negative_count = pair_feedback_stats.negative_count + EXCLUDED.negative_count,
+                                  updated_at = NOW()
+                """),
+                {"main_ids": main_ids, "rec_ids": rec_ids, "positives": positives, "negatives": negatives}
+            )
+
+        scenarios = sorted(
+            (scenario_id, group_name, product_id, pos, neg)
+            for (scenario_id, group_name), products in scenario_deltas.items()
+            for product_id, (pos, neg) in products.items()
+        )
+        if scenarios:
+            scenario_ids, group_names, product_ids, positives, negatives = map(list, zip(*scenarios))
+            await session.execute(
+                text("""
+                    INSERT INTO scenario_feedback_stats
+                        (scenario_id, group_name, product_id, positive_count, negative_count)
+                    SELECT * FROM unnest(
+                        CAST(:scenario_ids AS VARCHAR[]), CAST(:group_names AS VARCHAR[]),
+                        CAST(:product_ids AS INT[]), CAST(:positives AS INT[]), CAST(:negatives AS INT[])
+                    )
+                    ON CONFLICT (scenario_id, group_name, product_id)
+                    DO UPDATE SET positive_count = scenario_feedback_stats.positive_count + EXCLUDED.positive_count,
+                                  negative_count = scenario_feedback_stats.negative_count + EXCLUDED.negative_count,
+                                  updated_at = NOW()
+                """),
+                {
+                    "scenario_ids": scenario_ids,
+                    "group_names": group_names,
+                    "product_ids": product_ids,
+                    "positives": positives,
+                    "negatives": negatives,
+                }
+            )
+
+        # COPY идёт в той же транзакции, что и upsert выше
+        conn = await session.connection()
+        raw = (await conn.get_raw_connection()).driver_connection
+        if pair_log:
+            await raw.copy_records_to_table("product_pair_feedback", records=pair_log, columns=PAIR_LOG_COLUMNS)
+        if scenario_log:
+            await raw.copy_records_to_table("scenario_feedback", records=scenario_log, columns=SCENARIO_LOG_COLUMNS)
+
+
+feedback_buffer = FeedbackBuffer()
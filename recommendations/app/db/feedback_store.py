@@ -0,0 +1,208 @@
+"""
+In-memory копия pair_feedback_stats и scenario_feedback_stats для горячего пути.
+
+Для каждого main_product_id (и каждой пары scenario_id, group_name) хранятся
+отсортированный массив id кандидатов и массивы positive/negative. Поиск по
+массиву кандидатов — один searchsorted. Свежесть: опрос строк с updated_at
+новее последнего виденного плюс дельты, только что записанные FeedbackBuffer.
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..core.config import settings
+from . import queries
+from .database import background_session
+from .feedback_buffer import feedback_buffer
+
+logger = logging.getLogger(__name__)
+
+# Транзакция со старым NOW() может закоммититься позже опроса — перечитываем с запасом.
+# Счётчики абсолютные, повторное чтение ничего не задваивает.
+POLL_OVERLAP = timedelta(seconds=60)
+
+_EMPTY = np.empty(0, dtype=np.int64)
+
+
+def _build_tables(keys: list, ids: np.ndarray, positive: np.ndarray, negative: np.ndarray) -> dict:
+    """Строки, отсортированные по (key, id) -> {key: (ids, positive, negative)}"""
+    tables = {}
+    bounds = [i for i in range(1, len(keys)) if keys[i] != keys[i - 1]]
+    for start, end in zip([0] + bounds, bounds + [len(keys)]):
+        tables[keys[start]] = (ids[start:end], positive[start:end], negative[start:end])
+    return tables
+
+
+def _lookup(table: Optional[tuple], candidate_ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    if table is None:
+        return np.zeros(len(candidate_ids), dtype=np.int64), np.zeros(len(candidate_ids), dtype=np.int64)
+    ids, positive, negative = table
+    idx = np.minimum(np.searchsorted(ids, candidate_ids), len(ids) - 1)
+    found = ids[idx] == candidate_ids
+    return np.where(found, positive[idx], 0), np.where(found, negative[idx], 0)
+
+
+def _upsert(table: Optional[tuple], ids: np.ndarray, positive: np.ndarray, negative: np.ndarray) -> tuple:
+    """Объединяет таблицу с новыми значениями; при совпадении id побеждают новые"""
+    old_ids, old_positive, old_negative = table if table is not None else (_EMPTY, _EMPTY, _EMPTY)
+    all_ids = np.concatenate([old_ids, ids])
+    all_positive = np.concatenate([old_positive, positive])
+    all_negative = np.concatenate([old_negative, negative])
+    # np.unique берёт первое вхождение — разворачиваем, чтобы это были новые значения
+    unique_ids, first = np.unique(all_ids[::-1], return_index=True)
+    last = len(all_ids) - 1 - first
+    return unique_ids, all_positive[last], all_negative[last]
+
+
+class FeedbackStore:
+    def __init__(self):
+        self._pairs: dict[int, tuple] = {}
+        self._scenarios: dict[tuple[str, str], tuple] = {}
+        self._watermark: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+        self.loaded = False
+
+    async def load(self, session: AsyncSession):
+        """Полная загрузка при старте сервиса"""
+        self._pairs = {}
+        self._scenarios = {}
+        self._watermark = None
+        await self.refresh(session)
+        self.loaded = True
+        feedback_buffer.add_listener(self.apply_deltas)
+        logger.info(f"Feedback store: {len(self._pairs)} main products, {len(self._scenarios)} scenario groups")
+
+    async def refresh(self, session: AsyncSession):
+        """Подтягивает строки, изменённые после последнего опроса"""
+        since = self._watermark - POLL_OVERLAP if self._watermark else datetime.min
+        pairs = (await session.execute(
+            text("""
+                SELECT main_product_id, recommended_product_id, positive_count, negative_count, updated_at
+                FROM pair_feedback_stats
+                WHERE updated_at > :since
+                ORDER BY main_product_id, recommended_product_id
+            """),
+            {"since": since}
+        )).fetchall()
+        scenarios = (await session.execute(
+            text("""
+                SELECT scenario_id, group_name, product_id, positive_count, negative_count, updated_at
+                FROM scenario_feedback_stats
+                WHERE updated_at > :since
+                ORDER BY scenario_id, group_name, product_id
+            """),
+            {"since": since}
+        )).fetchall()
+
+        if pairs:
+            self._apply_rows(self._pairs, [row[0] for row in pairs], [row[1:4] for row in pairs])
+        if scenarios:
+            self._apply_rows(self._scenarios, [(row[0], row[1]) for row in scenarios], [row[2:5] for row in scenarios])
+
+        seen = [row[-1] for row in pairs + scenarios if row[-1] is not None]
+        if seen:
+            self._watermark = max(seen + ([self._watermark] if self._watermark else []))
+
+    @staticmethod
+    def _apply_rows(tables: dict, keys: list, values: list):
+        columns = np.asarray(values, dtype=np.int64).reshape(-1, 3)
+        for key, (ids, positive, negative) in _build_tables(keys, columns[:, 0], columns[:, 1], columns[:, 2]).items():
+            tables[key] = _upsert(tables.get(key), ids, positive, negative)
+
+    def apply_deltas(self, pair_deltas: dict, scenario_deltas: dict):
+        """Колбэк FeedbackBuffer: дельты только что закоммичены, прибавляем их до следующего опроса"""
+        for tables, deltas in ((self._pairs, pair_deltas), (self._scenarios, scenario_deltas)):
+            for key, products in deltas.items():
+                ids = np.fromiter(products.keys(), dtype=np.int64, count=len(products))
+                counts = np.asarray(list(products.values()), dtype=np.int64).reshape(-1, 2)
+                order = np.argsort(ids)
+                ids, counts = ids[order], counts[order]
+                positive, negative = _lookup(tables.get(key), ids)
+                tables[key] = _upsert(tables.get(key), ids, positive + counts[:, 0], negative + counts[:, 1])
+
+    @staticmethod
+    def _with_pending(positive, negative, candidate_ids, pending: dict):
+        if pending:
+            index = {pid: i for i, pid in enumerate(candidate_ids.tolist())}
+            for pid, counts in pending.items():
+                positive[index[pid]] += counts["positive"]
+                negative[index[pid]] += counts["negative"]
+        return positive, negative
+
+    def pair_counts(self, main_product_id: int, candidate_ids) -> tuple[np.ndarray, np.ndarray]:
+        """Векторы positive/negative для кандидатов (с учётом ещё не записанного фидбека)"""
+        candidate_ids = np.asarray(candidate_ids, dtype=np.int64)
+        positive, negative = _lookup(self._pairs.get(main_product_id), candidate_ids)
+        pending = feedback_buffer.merge_pair_stats(main_product_id, candidate_ids.tolist(), {})
+        return self._with_pending(positive, negative, candidate_ids, pending)
+
+    def scenario_counts(self, scenario_id: str, group_name: str, product_ids) -> tuple[np.ndarray, np.ndarray]:
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        positive, negative = _lookup(self._scenarios.get((scenario_id, group_name)), product_ids)
+        pending = feedback_buffer.merge_scenario_stats(scenario_id, group_name, product_ids.tolist(), {})
+        return self._with_pending(positive, negative, product_ids, pending)
+
+    @staticmethod
+    def _as_stats(ids: list[int], positive: np.ndarray, negative: np.ndarray) -> dict[int, dict]:
+        return {
+            pid: {"positive": int(pos), "negative": int(neg)}
+            for pid, pos, neg in zip(ids, positive, negative)
+            if pos or neg
+        }
+
+    async def get_pair_stats(self, session: AsyncSession, main_product_id: int, candidate_ids: list[int]) -> dict[int, dict]:
+        """Тот же формат, что queries.get_pair_feedback_stats; без загруженного стора — запрос в БД"""
+        if not self.loaded:
+            return await queries.get_pair_feedback_stats(session, main_product_id, candidate_ids)
+        return self._as_stats(candidate_ids, *self.pair_counts(main_product_id, candidate_ids))
+
+    async def get_pair_arrays(
+        self, session: AsyncSession, main_product_id: int, candidate_ids: list[int]
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Как pair_counts, но с запросом в БД, если стор не загружен"""
+        if self.loaded:
+            return self.pair_counts(main_product_id, candidate_ids)
+        stats = await queries.get_pair_feedback_stats(session, main_product_id, candidate_ids)
+        empty = {"positive": 0, "negative": 0}
+        return (
+            np.array([stats.get(pid, empty)["positive"] for pid in candidate_ids], dtype=np.int64),
+            np.array([stats.get(pid, empty)["negative"] for pid in candidate_ids], dtype=np.int64),
+        )
+
+    async def get_scenario_stats(
+        self, session: AsyncSession, scenario_id: str, group_name: str, product_ids: list[int]
+    ) -> dict[int, dict]:
+        if not self.loaded:
+            return await queries.get_scenario_feedback_stats(session, scenario_id, group_name, product_ids)
+        return self._as_stats(product_ids, *self.scenario_counts(scenario_id, group_name, product_ids))
+
+    def start(self):
+        if self._task is None and self.loaded and settings.feedback_store_refresh_interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.feedback_store_refresh_interval)
+            try:
+                async with background_session() as session:
+                    await self.refresh(session)
+            except Exception as e:
+                logger.error(f"Feedback store refresh failed: {e}")
+
+
+feedback_store = FeedbackStore()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Text, TIMESTAMP, Index
+from sqlalchemy import Column, Integer, String, Float, Text, TIMESTAMP, Index, LargeBinary
 from sqlalchemy.dialects.postgresql import ARRAY
 from datetime import datetime, timezone
 
@@ -14,6 +14,8 @@ class ProductEmbedding(Base):
 
     product_id = Column(Integer, primary_key=True)
     embedding = Column(ARRAY(Float), nullable=False)
+    embedding_q = Column(LargeBinary, nullable=True)
+    embedding_q_dtype = Column(String(8), nullable=True)
     text_representation = Column(Text)
     created_at = Column(TIMESTAMP, default=utc_now)
 
@@ -2,6 +2,19 @@ from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional
 
+from .feedback_buffer import feedback_buffer
+
+# Порядок полей в кортежах событий для bulk_insert_recommendation_events
+RECOMMENDATION_EVENT_COLUMNS = (
+    "user_id",
+    "session_id",
+    "event_type",
+    "main_product_id",
+    "recommended_product_id",
+    "recommendation_context",
+    "recommendation_rank",
+)
+
 
 async def get_product_by_id(session: AsyncSession, product_id: int) -> Optional[dict]:
     result = await session.execute(
@@ -11,9 +24,7 @@ async def get_product_by_id(session: AsyncSession, product_id: int) -> Optional[
                    pr.discount_price
             FROM products p
             LEFT JOIN categories c ON p.category_id = c.id
-            LEFT JOIN promos pr ON p.id = pr.product_id
-                AND pr.start_date <= CURRENT_DATE
-                AND pr.end_date >= CURRENT_DATE
+            LEFT JOIN active_promos pr ON p.id = pr.product_id
             WHERE p.id = :id
         """),
         {"id": product_id}
@@ -34,11 +45,17 @@ async def get_product_by_id(session: AsyncSession, product_id: int) -> Optional[
     }
 
 
-async def get_products_by_ids(session: AsyncSession, product_ids: list[int]) -> dict[int, dict]:
+async def get_products_by_ids(
+    session: AsyncSession,
+    product_ids: list[int],
+    available_only: bool = False,
+) -> dict[int, dict]:
+    """available_only — для кандидатов рекомендаций: снятые с продажи (delta-импорт) не отдаём"""
     if not product_ids:
         return {}
+    available_filter = "AND p.available = true" if available_only else ""
     result = await session.execute(
-        text("""
+        text(f"""
             SELECT p.id, p.name, p.category_id, p.vendor, p.price, p.picture,
                    c.name as category_name,
                    pr.discount_price,
@@ -47,11 +64,10 @@ async def get_products_by_ids(session: AsyncSession, product_ids: list[int]) ->
                    COALESCE(ps.order_count, 0) as order_count
             FROM products p
             LEFT JOIN categories c ON p.category_id = c.id
-            LEFT JOIN promos pr ON p.id = pr.product_id
-                AND pr.start_date <= CURRENT_DATE
-                AND pr.end_date >= CURRENT_DATE
+            LEFT JOIN active_promos pr ON p.id = pr.product_id
             LEFT JOIN product_stats ps ON p.id = ps.product_id
             WHERE p.id = ANY(:ids)
+              {available_filter}
         """),
         {"ids": product_ids}
     )
@@ -90,9 +106,7 @@ async def get_products_by_categories(
                    COALESCE(ps.order_count, 0) as order_count
             FROM products p
             LEFT JOIN categories c ON p.category_id = c.id
-            LEFT JOIN promos pr ON p.id = pr.product_id
-                AND pr.start_date <= CURRENT_DATE
-                AND pr.end_date >= CURRENT_DATE
+            LEFT JOIN active_promos pr ON p.id = pr.product_id
             LEFT JOIN product_stats ps ON p.id = ps.product_id
             WHERE p.category_id = ANY(:cat_ids)
               AND p.id != ALL(:exclude)
@@ -229,10 +243,11 @@ async def get_pair_feedback_stats(
         """),
         {"main_id": main_product_id, "rec_ids": recommended_ids}
     )
-    return {
+    stats = {
         row[0]: {"positive": row[1], "negative": row[2]}
         for row in result.fetchall()
     }
+    return feedback_buffer.merge_pair_stats(main_product_id, recommended_ids, stats)
 
 
 async def get_scenario_feedback_stats(
@@ -253,59 +268,11 @@ async def get_scenario_feedback_stats(
         """),
         {"scenario_id": scenario_id, "group_name": group_name, "product_ids": product_ids}
     )
-    return {
+    stats = {
         row[0]: {"positive": row[1], "negative": row[2]}
         for row in result.fetchall()
     }
-
-
-async def record_pair_feedback(
-    session: AsyncSession,
-    main_product_id: int,
-    recommended_product_id: int,
-    feedback_type: str,
-    user_id: int = None,
-    context: str = "product_page",
-):
-    await session.execute(
-        text("""
-            INSERT INTO product_pair_feedback
-                (user_id, main_product_id, recommended_product_id, feedback_type, context)
-            VALUES (:user_id, :main_id, :rec_id, :feedback, :context)
-        """),
-        {
-            "user_id": user_id,
-            "main_id": main_product_id,
-            "rec_id": recommended_product_id,
-            "feedback": feedback_type,
-            "context": context,
-        }
-    )
-
-    if feedback_type == "positive":
-        await session.execute(
-            text("""
-                INSERT INTO pair_feedback_stats (main_product_id, recommended_product_id, positive_count, negative_count)
-                VALUES (:main_id, :rec_id, 1, 0)
-                ON CONFLICT (main_product_id, recommended_product_id)
-                DO UPDATE SET positive_count = pair_feedback_stats.positive_count + 1,
-                              updated_at = NOW()
-            """),
-            {"main_id": main_product_id, "rec_id": recommended_product_id}
-        )
-    else:
-        await session.execute(
-            text("""
-                INSERT INTO pair_feedback_stats (main_product_id, recommended_product_id, positive_count, negative_count)
-                VALUES (:main_id, :rec_id, 0, 1)
-                ON CONFLICT (main_product_id, recommended_product_id)
-                DO UPDATE SET negative_count = pair_feedback_stats.negative_count + 1,
-                              updated_at = NOW()
-            """),
-            {"main_id": main_product_id, "rec_id": recommended_product_id}
-        )
-
-    await session.commit()
+    return feedback_buffer.merge_scenario_stats(scenario_id, group_name, product_ids, stats)
 
 
 async def get_copurchase_stats(
@@ -333,52 +300,81 @@ async def get_copurchase_stats(
     return {row[0]: row[1] for row in result.fetchall()}
 
 
-async def record_scenario_feedback(
+async def get_pair_feedback_stats_bulk(
     session: AsyncSession,
-    scenario_id: str,
-    group_name: str,
-    product_id: int,
-    feedback_type: str,
-    user_id: int = None,
-):
+    main_ids: list[int],
+    recommended_ids: list[int],
+) -> dict[tuple[int, int], dict]:
+    """Фидбек для произвольного набора пар одним запросом (без незаписанных дельт буфера)"""
+    if not main_ids:
+        return {}
+    result = await session.execute(
+        text("""
+            SELECT s.main_product_id, s.recommended_product_id, s.positive_count, s.negative_count
+            FROM (
+                SELECT DISTINCT * FROM unnest(CAST(:main_ids AS INT[]), CAST(:rec_ids AS INT[]))
+                    AS p(main_product_id, recommended_product_id)
+            ) p
+            JOIN pair_feedback_stats s
+                ON s.main_product_id = p.main_product_id
+                AND s.recommended_product_id = p.recommended_product_id
+        """),
+        {"main_ids": main_ids, "rec_ids": recommended_ids}
+    )
+    return {
+        (row[0], row[1]): {"positive": row[2], "negative": row[3]}
+        for row in result.fetchall()
+    }
+
+
+async def get_copurchase_stats_bulk(
+    session: AsyncSession,
+    main_ids: list[int],
+    candidate_ids: list[int],
+) -> dict[tuple[int, int], int]:
+    """Совместные покупки для произвольного набора пар одним запросом"""
+    if not main_ids:
+        return {}
+    result = await session.execute(
+        text("""
+            WITH pairs AS (
+                SELECT DISTINCT * FROM unnest(CAST(:main_ids AS INT[]), CAST(:candidate_ids AS INT[]))
+                    AS p(main_id, candidate_id)
+            )
+            SELECT p.main_id, p.candidate_id, c.copurchase_count
+            FROM pairs p
+            JOIN copurchase_stats c ON c.product_id_1 = p.main_id AND c.product_id_2 = p.candidate_id
+            UNION
+            SELECT p.main_id, p.candidate_id, c.copurchase_count
+            FROM pairs p
+            JOIN copurchase_stats c ON c.product_id_2 = p.main_id AND c.product_id_1 = p.candidate_id
+        """),
+        {"main_ids": main_ids, "candidate_ids": candidate_ids}
+    )
+    return {(row[0], row[1]): row[2] for row in result.fetchall()}
+
+
+async def insert_recommendation_event(session: AsyncSession, event: tuple):
     await session.execute(
         text("""
-            INSERT INTO scenario_feedback
-                (user_id, scenario_id, group_name, product_id, feedback_type)
-            VALUES (:user_id, :scenario_id, :group_name, :product_id, :feedback)
+            INSERT INTO recommendation_events
+                (user_id, session_id, event_type, main_product_id, recommended_product_id,
+                 recommendation_context, recommendation_rank)
+            VALUES (:user_id, :session_id, :event_type, :main_product_id, :recommended_product_id,
+                    :recommendation_context, :recommendation_rank)
         """),
-        {
-            "user_id": user_id,
-            "scenario_id": scenario_id,
-            "group_name": group_name,
-            "product_id": product_id,
-            "feedback": feedback_type,
-        }
+        dict(zip(RECOMMENDATION_EVENT_COLUMNS, event))
     )
+    await session.commit()
 
-    if feedback_type == "positive":
-        await session.execute(
-            text("""
-                INSERT INTO scenario_feedback_stats
-                    (scenario_id, group_name, product_id, positive_count, negative_count)
-                VALUES (:scenario_id, :group_name, :product_id, 1, 0)
-                ON CONFLICT (scenario_id, group_name, product_id)
-                DO UPDATE SET positive_count = scenario_feedback_stats.positive_count + 1,
-                              updated_at = NOW()
-            """),
-            {"scenario_id": scenario_id, "group_name": group_name, "product_id": product_id}
-        )
-    else:
-        await session.execute(
-            text("""
-                INSERT INTO scenario_feedback_stats
-                    (scenario_id, group_name, product_id, positive_count, negative_count)
-                VALUES (:scenario_id, :group_name, :product_id, 0, 1)
-                ON CONFLICT (scenario_id, group_name, product_id)
-                DO UPDATE SET negative_count = scenario_feedback_stats.negative_count + 1,
-                              updated_at = NOW()
-            """),
-            {"scenario_id": scenario_id, "group_name": group_name, "product_id": product_id}
-        )
 
+async def bulk_insert_recommendation_events(session: AsyncSession, events: list[tuple]):
+    """Пишет пачку событий одним COPY (asyncpg copy_records_to_table)"""
+    conn = await session.connection()
+    raw = await conn.get_raw_connection()
+    await raw.driver_connection.copy_records_to_table(
+        "recommendation_events",
+        records=events,
+        columns=list(RECOMMENDATION_EVENT_COLUMNS),
+    )
     await session.commit()
@@ -0,0 +1,97 @@
+"""
+Маршрутизация чтений на реплику.
+
+Эндпоинты рекомендаций и обучение только читают — их сессии берутся здесь.
+Пока реплика отстаёт больше replica_max_lag секунд или недоступна, чтения идут
+на основную базу. Записи (буферы событий и фидбека, обслуживание) всегда на основной.
+"""
+
+import asyncio
+import logging
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..core.config import settings
+from . import database
+
+logger = logging.getLogger(__name__)
+
+# Отставание в секундах; при совпадении принятого и применённого WAL — 0 (тихая основная не даёт ложного лага)
+REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+class ReplicaRouter:
+    def __init__(self):
+        self.lag: Optional[float] = None
+        self.healthy = False
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return database.replica_session is not None
+
+    def read_session(self) -> AsyncSession:
+        """Сессия для запросов API, которые только читают"""
+        if self.enabled and self.healthy:
+            return database.replica_session()
+        return database.async_session()
+
+    def background_read_session(self) -> AsyncSession:
+        """Сессия для тяжёлых чтений (обучение): фоновый пул реплики или основной"""
+        if self.enabled and self.healthy:
+            return database.replica_background_session()
+        return database.background_session()
+
+    async def check(self):
+        try:
+            async with database.replica_background_session() as session:
+                self.lag = float((await session.execute(text(REPLICA_LAG_SQL))).scalar())
+        except Exception as e:
+            if self.healthy:
+                logger.warning(f"Replica unavailable, reads go to primary: {e}")
+            self.lag = None
+            self.healthy = False
+            return
+
+        healthy = self.lag <= settings.replica_max_lag
+        if healthy != self.healthy:
+            logger.info(f"Replica lag {self.lag:.1f}s, reads go to {'replica' if healthy else 'primary'}")
+        self.healthy = healthy
+
+    async def start(self):
+        if self.enabled and self._task is None:
+            await self.check()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.replica_check_interval)
+            await self.check()
+
+    def status(self) -> dict:
+        return {"enabled": self.enabled, "healthy": self.healthy, "lag_seconds": self.lag}
+
+
+replica_router = ReplicaRouter()
+
+
+async def get_read_session() -> AsyncSession:
+    async with replica_router.read_session() as session:
+        yield session
@@ -1,11 +1,16 @@
 """
 Скрипт генерации эмбеддингов для всех товаров.
-Запуск: python -m app.generate_embeddings
+Запуск: python -m app.generate_embeddings [--ids-file ../data/data/changed_product_ids.txt]
+
+С --ids-file пересчитываются только перечисленные товары (список пишет
+data/load_data.py --mode delta), в том числе уже имеющие эмбеддинг.
 """
 
+import argparse
 import asyncio
 import json
 import logging
+from typing import Optional
 from sqlalchemy import text
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
@@ -40,7 +45,12 @@ async def get_category_path(session: AsyncSession, category_id: int) -> str:
     return row[0] if row else ""
 
 
-async def generate_all_embeddings(batch_size: int = 100):
+def read_ids_file(path: str) -> list[int]:
+    with open(path, encoding="utf-8") as f:
+        return [int(line) for line in f if line.strip()]
+
+
+async def generate_all_embeddings(batch_size: int = 100, product_ids: Optional[list[int]] = None):
     engine = create_async_engine(DATABASE_URL, echo=False)
     async_session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
@@ -62,19 +72,35 @@ async def generate_all_embeddings(batch_size: int = 100):
 
         processed = 0
         errors = 0
+        offset = 0
 
         while True:
-            result = await session.execute(
-                text("""
-                    SELECT p.id, p.name, p.category_id, p.vendor, p.description, p.params
-                    FROM products p
-                    LEFT JOIN product_embeddings pe ON p.id = pe.product_id
-                    WHERE pe.product_id IS NULL
-                    ORDER BY p.id
-                    LIMIT :limit
-                """),
-                {"limit": batch_size}
-            )
+            if product_ids is not None:
+                batch_ids = product_ids[offset:offset + batch_size]
+                offset += batch_size
+                if not batch_ids:
+                    break
+                result = await session.execute(
+                    text("""
+                        SELECT p.id, p.name, p.category_id, p.vendor, p.description, p.params
+                        FROM products p
+                        WHERE p.id = ANY(:ids)
+                        ORDER BY p.id
+                    """),
+                    {"ids": batch_ids}
+                )
+            else:
+                result = await session.execute(
+                    text("""
+                        SELECT p.id, p.name, p.category_id, p.vendor, p.description, p.params
+                        FROM products p
+                        LEFT JOIN product_embeddings pe ON p.id = pe.product_id
+                        WHERE pe.product_id IS NULL
+                        ORDER BY p.id
+                        LIMIT :limit
+                    """),
+                    {"limit": batch_size}
+                )
             products = result.fetchall()
 
             if not products:
@@ -102,12 +128,14 @@ async def generate_all_embeddings(batch_size: int = 100):
                 embedding = await ollama.generate(text_repr)
 
                 if embedding:
+                    # Квантованная копия устарела — её пересчитает app.quantize_embeddings
                     await session.execute(
                         text("""
                             INSERT INTO product_embeddings (product_id, embedding, text_representation, created_at)
                             VALUES (:product_id, :embedding, :text_repr, NOW())
                             ON CONFLICT (product_id) DO UPDATE
-                            SET embedding = :embedding, text_representation = :text_repr, created_at = NOW()
+                            SET embedding = :embedding, text_representation = :text_repr, created_at = NOW(),
+                                embedding_q = NULL, embedding_q_dtype = NULL
                         """),
                         {"product_id": product_id, "embedding": embedding, "text_repr": text_repr}
                     )
@@ -125,4 +153,8 @@ async def generate_all_embeddings(batch_size: int = 100):
 
 
 if __name__ == "__main__":
-    asyncio.run(generate_all_embeddings())
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ids-file", help="Файл с ID товаров (по одному в строке) для пересчёта")
+    args = parser.parse_args()
+    ids = read_ids_file(args.ids_file) if args.ids_file else None
+    asyncio.run(generate_all_embeddings(product_ids=ids))
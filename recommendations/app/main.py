@@ -2,9 +2,21 @@ from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+from .core.config import settings
+from .core.tracing import TracingMiddleware
 from .db import init_db, async_session
+from .db.feedback_buffer import feedback_buffer
+from .db.active_promos import refresh_active_promos
+from .db.feedback_store import feedback_store
+from .db.replica import replica_router
+from .db.fastpath import fast_reader
+from .ml.event_features import event_feature_store
+from .ml.product_features import product_feature_store
+from .ml.training_jobs import training_jobs
 from .services.scenarios import scenarios_service
 from .services.product_recommender import product_recommender
+from .services.event_buffer import event_buffer
+from .services.event_maintenance import event_maintenance
 from .api import router
 
 
@@ -18,9 +30,40 @@ async def lifespan(app: FastAPI):
         await scenarios_service.initialize(session)
         # Загружаем эмбеддинги в FAISS
         await product_recommender.load_embeddings(session)
+        # Статистика фидбека в памяти для ранжирования
+        await feedback_store.load(session)
+        # Снапшот скидок мог остаться со вчерашнего дня
+        await refresh_active_promos(session)
+        # Признаки товаров для ранкера
+        await product_feature_store.load(session)
+        # CTR из событий рекомендаций (признаки ранкера)
+        await event_feature_store.load(session)
+
+    # Чтения API идут на реплику, пока её отставание в пределах REPLICA_MAX_LAG
+    await replica_router.start()
+    await fast_reader.start()
+
+    # Фоновая запись событий рекомендаций и обслуживание их партиций
+    event_buffer.start()
+    event_maintenance.start()
+    feedback_buffer.start()
+    feedback_store.start()
+    product_feature_store.start()
+    event_feature_store.start()
 
     yield
 
+    # Дописываем накопленные события перед остановкой
+    await training_jobs.stop()
+    await event_maintenance.stop()
+    await replica_router.stop()
+    await fast_reader.stop()
+    await feedback_store.stop()
+    await product_feature_store.stop()
+    await event_feature_store.stop()
+    await event_buffer.stop()
+    await feedback_buffer.stop()
+
 
 app = FastAPI(
     title="Recommendations ML Service",
@@ -37,4 +80,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if settings.tracing_enabled:
+    # Этапы и обращения к БД на запрос -> /metrics и ?debug=true
+    app.add_middleware(TracingMiddleware)
+
 app.include_router(router)
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+Обслуживание recommendation_events: партиции вперёд, retention и дневной rollup.
+Сервис делает это сам раз в EVENTS_MAINTENANCE_INTERVAL; скрипт — для cron и backfill.
+Запуск: python -m app.maintain_events [--rollup-days 30]
+"""
+
+import argparse
+import asyncio
+
+from .db.database import async_session, init_db
+from .db.event_partitions import run_maintenance
+
+
+async def maintain_events(rollup_days: int = None):
+    await init_db()
+
+    async with async_session() as session:
+        report = await run_maintenance(session, rollup_days)
+
+    if report is None:
+        print("Maintenance is already running in another process")
+        return
+
+    print(f"Created partitions: {', '.join(report['created']) or '-'}")
+    print(f"Dropped partitions: {', '.join(report['dropped']) or '-'}")
+    print(f"Rollup rows upserted: {report['rollup_rows']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rollup-days", type=int, default=None, help="Пересчитать rollup за последние N дней")
+    args = parser.parse_args()
+    asyncio.run(maintain_events(args.rollup_days))
@@ -4,17 +4,42 @@ CatBoost Ranker для ранжирования товарных рекомен
 
 import os
 import json
+import time
 import numpy as np
 import pandas as pd
 from pathlib import Path
 from datetime import datetime
-from typing import List, Dict, Optional, Tuple
+from typing import Callable, List, Dict, Optional, Tuple
 from catboost import CatBoostRanker, Pool
+from sklearn.model_selection import train_test_split
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from ..core.config import settings
+from ..core.tracing import span
+from .event_features import event_feature_store
 from .feature_extractor import feature_extractor
+from .model_registry import ModelRegistry
+from .product_features import product_feature_store
 from .training_data_generator import training_data_generator
+from .training_datasets import TrainingDataset, validate_dataset_name
 from ..db import queries
+from ..db.fastpath import fast_reader
+from ..db.feedback_store import feedback_store
+
+
+class TrainingCancelled(Exception):
+    pass
+
+
+class _ProgressCallback:
+    """Колбэк CatBoost: прогресс по итерациям, False из progress останавливает fit"""
+
+    def __init__(self, iterations: int, progress: Callable[[str, float], bool]):
+        self.iterations = iterations
+        self.progress = progress
+
+    def after_iteration(self, info) -> bool:
+        return self.progress("fit", (info.iteration + 1) / self.iterations) is not False
 
 
 class CatBoostRankerService:
@@ -32,42 +57,23 @@ class CatBoostRankerService:
         self.models_dir = Path(models_dir)
         self.models_dir.mkdir(parents=True, exist_ok=True)
 
-        self.model: Optional[CatBoostRanker] = None
-        self.model_version: Optional[str] = None
-        self.model_metadata: Optional[Dict] = None
-
-        self._load_latest_model()
+        self.registry = ModelRegistry(self.models_dir)
+        self.registry.load_initial()
 
-    def _load_latest_model(self):
-        """Загружает последнюю обученную модель"""
-        model_files = list(self.models_dir.glob("catboost_ranker_*.cbm"))
+    @property
+    def model(self) -> Optional[CatBoostRanker]:
+        active = self.registry.active
+        return active.model if active else None
 
-        if not model_files:
-            print("Нет обученных моделей. Используется формульный скоринг.")
-            return
+    @property
+    def model_version(self) -> Optional[str]:
+        active = self.registry.active
+        return active.version if active else None
 
-        latest_model = max(model_files, key=lambda p: p.stat().st_mtime)
-
-        try:
-            self.model = CatBoostRanker()
-            self.model.load_model(str(latest_model))
-
-            self.model_version = latest_model.stem.replace("catboost_ranker_", "")
-
-            metadata_file = latest_model.parent / f"{latest_model.stem}_metadata.json"
-            if metadata_file.exists():
-                with open(metadata_file, "r") as f:
-                    self.model_metadata = json.load(f)
-
-            print(f"✓ Загружена модель: {latest_model.name}")
-            print(f"  Версия: {self.model_version}")
-            if self.model_metadata:
-                print(f"  Обучена: {self.model_metadata.get('trained_at')}")
-                print(f"  Примеров: {self.model_metadata.get('train_samples')}")
-
-        except Exception as e:
-            print(f"Ошибка загрузки модели {latest_model}: {e}")
-            self.model = None
+    @property
+    def model_metadata(self) -> Optional[Dict]:
+        active = self.registry.active
+        return active.metadata if active else None
 
     async def train_model(
         self,
@@ -77,6 +83,9 @@ class CatBoostRankerService:
         depth: int = 6,
         min_feedback_count: int = 5,
         negative_sampling_ratio: int = 3,
+        dataset: Optional[str] = None,
+        update_dataset: bool = False,
+        progress: Optional[Callable[[str, float], bool]] = None,
     ) -> Dict:
         """
         Обучает CatBoost ранкер на исторических данных.
@@ -88,75 +97,63 @@ class CatBoostRankerService:
             depth: глубина деревьев
             min_feedback_count: минимум фидбеков для включения примера
             negative_sampling_ratio: соотношение негативных к позитивным
+            dataset: имя снапшота выборки; если он есть — обучение на нём без сборки
+            update_dataset: дописать в снапшот новый фидбек перед обучением
+            progress: progress(stage, доля этапа) на границах этапов и каждой итерации;
+                False -> остановить обучение (TrainingCancelled)
 
         Returns:
             Dict с метриками обучения
+
+        Модель только сохраняется на диск; в работу её вводит registry
+        (load_candidate -> shadow -> promote).
         """
         print("\n" + "=" * 80)
         print("ОБУЧЕНИЕ CATBOOST RANKER")
         print("=" * 80)
 
-        X_train, y_train, groups = await training_data_generator.generate_training_data(
-            session=session,
-            min_feedback_count=min_feedback_count,
-            negative_sampling_ratio=negative_sampling_ratio,
-        )
+        def report(stage: str, fraction: float):
+            if progress is not None and progress(stage, fraction) is False:
+                raise TrainingCancelled(f"Обучение остановлено на этапе {stage}")
 
-        if len(X_train) < 100:
-            raise ValueError(
-                f"Недостаточно данных для обучения: {len(X_train)} примеров. "
-                "Нужно минимум 100. Соберите больше фидбека или заказов."
-            )
+        phases: Dict[str, float] = {}
+        phase_started = time.perf_counter()
 
-        from sklearn.model_selection import train_test_split
+        def lap(phase: str):
+            nonlocal phase_started
+            now = time.perf_counter()
+            phases[phase] = round(now - phase_started, 3)
+            phase_started = now
 
-        unique_groups = list(set(groups))
-        train_groups, val_groups = train_test_split(
-            unique_groups, test_size=0.2, random_state=42
+        report("dataset", 0.0)
+        training_set = await self._training_dataset(
+            session, dataset, update_dataset, min_feedback_count, negative_sampling_ratio
         )
+        report("dataset", 1.0)
+        lap("dataset")
 
-        train_mask = [g in train_groups for g in groups]
-        val_mask = [g in val_groups for g in groups]
-
-        X_train_split = X_train[train_mask].reset_index(drop=True)
-        y_train_split = y_train[train_mask].reset_index(drop=True)
-        groups_train_split = [groups[i] for i, m in enumerate(train_mask) if m]
-
-        X_val = X_train[val_mask].reset_index(drop=True)
-        y_val = y_train[val_mask].reset_index(drop=True)
-        groups_val = [groups[i] for i, m in enumerate(val_mask) if m]
-
-        # CatBoost требует чтобы данные были отсортированы по group_id
-        train_order = np.argsort(groups_train_split)
-        X_train_split = X_train_split.iloc[train_order].reset_index(drop=True)
-        y_train_split = y_train_split.iloc[train_order].reset_index(drop=True)
-        groups_train_split = [groups_train_split[i] for i in train_order]
-
-        val_order = np.argsort(groups_val)
-        X_val = X_val.iloc[val_order].reset_index(drop=True)
-        y_val = y_val.iloc[val_order].reset_index(drop=True)
-        groups_val = [groups_val[i] for i in val_order]
+        if len(training_set) < 100:
+            raise ValueError(
+                f"Недостаточно данных для обучения: {len(training_set)} примеров. "
+                "Нужно минимум 100. Соберите больше фидбека или заказов."
+            )
 
-        print(f"\nTrain: {len(X_train_split)} примеров, {len(train_groups)} query")
-        print(f"Val:   {len(X_val)} примеров, {len(val_groups)} query")
+        train_idx, val_idx, train_groups, val_groups = self._split_by_group(training_set.groups)
+        y_train_split = training_set.y[train_idx]
+        y_val = training_set.y[val_idx]
+        lap("split")
 
-        train_pool = Pool(
-            data=X_train_split,
-            label=y_train_split,
-            group_id=groups_train_split,
-        )
+        print(f"\nTrain: {len(train_idx)} примеров, {len(train_groups)} query")
+        print(f"Val:   {len(val_idx)} примеров, {len(val_groups)} query")
 
-        val_pool = Pool(
-            data=X_val,
-            label=y_val,
-            group_id=groups_val,
-        )
+        train_pool, val_pool = self._build_pools(training_set, train_idx, val_idx)
+        lap("pools")
 
         print("\n" + "-" * 80)
         print("ЗАПУСК ОБУЧЕНИЯ")
         print("-" * 80)
 
-        self.model = CatBoostRanker(
+        model = CatBoostRanker(
             iterations=iterations,
             learning_rate=learning_rate,
             depth=depth,
@@ -166,28 +163,35 @@ class CatBoostRankerService:
             verbose=50,
             use_best_model=True,
             eval_metric="NDCG:top=10",
+            thread_count=settings.training_thread_count,
+            border_count=settings.training_border_count,
+            used_ram_limit=settings.training_used_ram_limit or None,
         )
 
-        self.model.fit(
+        model.fit(
             train_pool,
             eval_set=val_pool,
             plot=False,
+            callbacks=[_ProgressCallback(iterations, progress)] if progress is not None else None,
         )
+        report("fit", 1.0)
+        lap("fit")
 
         print("\n" + "-" * 80)
         print("ОЦЕНКА КАЧЕСТВА")
         print("-" * 80)
 
-        train_predictions = self.model.predict(train_pool)
-        val_predictions = self.model.predict(val_pool)
+        train_predictions = model.predict(train_pool, thread_count=settings.training_thread_count)
+        val_predictions = model.predict(val_pool, thread_count=settings.training_thread_count)
 
         from sklearn.metrics import roc_auc_score, average_precision_score
 
-        train_auc = roc_auc_score(y_train_split, train_predictions)
-        val_auc = roc_auc_score(y_val, val_predictions)
+        # Метки градуированные (0-3), AUC/AP — по «релевантен или нет»
+        train_auc = roc_auc_score(y_train_split > 0, train_predictions)
+        val_auc = roc_auc_score(y_val > 0, val_predictions)
 
-        train_ap = average_precision_score(y_train_split, train_predictions)
-        val_ap = average_precision_score(y_val, val_predictions)
+        train_ap = average_precision_score(y_train_split > 0, train_predictions)
+        val_ap = average_precision_score(y_val > 0, val_predictions)
 
         print(f"Train AUC: {train_auc:.4f}")
         print(f"Val AUC:   {val_auc:.4f}")
@@ -198,8 +202,8 @@ class CatBoostRankerService:
         print("TOP-10 ВАЖНЫХ ПРИЗНАКОВ")
         print("-" * 80)
 
-        feature_importance = self.model.get_feature_importance(data=train_pool)
-        feature_names = X_train.columns
+        feature_importance = model.get_feature_importance(data=train_pool, thread_count=settings.training_thread_count)
+        feature_names = training_set.metadata["feature_names"]
 
         importance_df = pd.DataFrame({
             "feature": feature_names,
@@ -207,17 +211,19 @@ class CatBoostRankerService:
         }).sort_values("importance", ascending=False)
 
         print(importance_df.head(10).to_string(index=False))
+        lap("evaluate")
 
-        self.model_version = datetime.now().strftime("%Y%m%d_%H%M%S")
-        model_path = self.models_dir / f"catboost_ranker_{self.model_version}.cbm"
+        report("save", 0.0)
+        version = datetime.now().strftime("%Y%m%d_%H%M%S")
+        model_path = self.models_dir / f"catboost_ranker_{version}.cbm"
 
-        self.model.save_model(str(model_path))
+        model.save_model(str(model_path))
 
-        self.model_metadata = {
-            "version": self.model_version,
+        metadata = {
+            "version": version,
             "trained_at": datetime.now().isoformat(),
-            "train_samples": len(X_train_split),
-            "val_samples": len(X_val),
+            "train_samples": len(train_idx),
+            "val_samples": len(val_idx),
             "train_groups": len(train_groups),
             "val_groups": len(val_groups),
             "metrics": {
@@ -231,22 +237,122 @@ class CatBoostRankerService:
                 "learning_rate": learning_rate,
                 "depth": depth,
                 "loss_function": "YetiRank",
+                "thread_count": settings.training_thread_count,
+                "border_count": settings.training_border_count,
             },
             "top_features": importance_df.head(10).to_dict("records"),
+            "dataset": training_set.summary(),
+            "phase_seconds": dict(phases),
         }
 
-        metadata_path = self.models_dir / f"catboost_ranker_{self.model_version}_metadata.json"
+        metadata_path = self.models_dir / f"catboost_ranker_{version}_metadata.json"
         with open(metadata_path, "w") as f:
-            json.dump(self.model_metadata, f, indent=2)
+            json.dump(metadata, f, indent=2)
+
+        lap("save")
 
         print(f"\n✓ Модель сохранена: {model_path}")
         print(f"✓ Метаданные: {metadata_path}")
+        print("\nВремя по этапам: " + ", ".join(f"{phase} {seconds:.1f}s" for phase, seconds in phases.items()))
 
         print("\n" + "=" * 80)
         print("ОБУЧЕНИЕ ЗАВЕРШЕНО")
         print("=" * 80)
 
-        return self.model_metadata
+        return metadata
+
+    @staticmethod
+    def _split_by_group(groups: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Train/val 80/20 по query (main_product_id) — индексы строк, отсортированные по группе
+        (CatBoost требует, чтобы строки одной группы шли подряд)
+        """
+        unique_groups = np.unique(groups)
+        train_groups, val_groups = train_test_split(unique_groups, test_size=0.2, random_state=42)
+        val_mask = np.isin(groups, val_groups)
+
+        train_idx = np.flatnonzero(~val_mask)
+        val_idx = np.flatnonzero(val_mask)
+        train_idx = train_idx[np.argsort(groups[train_idx], kind="stable")]
+        val_idx = val_idx[np.argsort(groups[val_idx], kind="stable")]
+        return train_idx, val_idx, train_groups, val_groups
+
+    def _build_pools(self, training_set: TrainingDataset, train_idx: np.ndarray, val_idx: np.ndarray) -> Tuple[Pool, Pool]:
+        """
+        Квантованные Pool из непрерывных float32 массивов; val — на границах train.
+        При training_quantized_pool_cache пулы сохраняются рядом со снапшотом выборки
+        и при повторном обучении на той же версии читаются с диска без квантования.
+        """
+        border_count = settings.training_border_count
+        cache_dir = Path(settings.training_datasets_dir) / training_set.name
+        cache_prefix = cache_dir / f"{training_set.version}.b{border_count}"
+        train_cache = cache_prefix.with_name(cache_prefix.name + ".train.qpool")
+        val_cache = cache_prefix.with_name(cache_prefix.name + ".val.qpool")
+
+        if settings.training_quantized_pool_cache and train_cache.exists() and val_cache.exists():
+            print(f"  ✓ Квантованные пулы из кэша: {train_cache.name}")
+            return Pool(f"quantized://{train_cache}"), Pool(f"quantized://{val_cache}")
+
+        feature_names = training_set.metadata["feature_names"]
+        used_ram_limit = settings.training_used_ram_limit or None
+
+        def pool(idx: np.ndarray) -> Pool:
+            return Pool(
+                data=np.ascontiguousarray(training_set.X[idx], dtype=np.float32),
+                label=training_set.y[idx],
+                group_id=training_set.groups[idx],
+                feature_names=feature_names,
+                thread_count=settings.training_thread_count,
+            )
+
+        train_pool = pool(train_idx)
+        train_pool.quantize(border_count=border_count, used_ram_limit=used_ram_limit)
+        val_pool = pool(val_idx)
+        borders_file = cache_prefix.with_name(cache_prefix.name + ".borders.tsv")
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        train_pool.save_quantization_borders(str(borders_file))
+        val_pool.quantize(input_borders=str(borders_file), used_ram_limit=used_ram_limit)
+
+        if settings.training_quantized_pool_cache:
+            train_pool.save(str(train_cache))
+            val_pool.save(str(val_cache))
+        else:
+            borders_file.unlink(missing_ok=True)
+        return train_pool, val_pool
+
+    async def _training_dataset(
+        self,
+        session: AsyncSession,
+        name: Optional[str],
+        update: bool,
+        min_feedback_count: int,
+        negative_sampling_ratio: int,
+    ) -> TrainingDataset:
+        """Снапшот выборки: готовый, дописанный новым фидбеком или собранный заново"""
+        training_set = TrainingDataset.load(validate_dataset_name(name)) if name else None
+        if training_set is not None and not training_set.is_compatible():
+            print(f"Снапшот {training_set.name}/{training_set.version} собран для другой схемы признаков — пересборка")
+            training_set = None
+
+        if training_set is None:
+            training_set = await training_data_generator.build_dataset(
+                session, name or "default", min_feedback_count, negative_sampling_ratio
+            )
+        elif update:
+            print(f"\nДозапись нового фидбека в снапшот {training_set.name}/{training_set.version}...")
+            params = training_set.metadata["params"]
+            updated = await training_data_generator.update_dataset(session, training_set)
+            training_set = updated or await training_data_generator.build_dataset(
+                session, training_set.name, params["min_feedback_count"], params["negative_sampling_ratio"]
+            )
+        else:
+            # Параметры генерации берутся из снапшота, а не из запроса
+            print(f"\nСнапшот выборки {training_set.name}/{training_set.version}: {len(training_set)} примеров")
+            return training_set
+
+        path = training_set.save()
+        print(f"  ✓ Снапшот выборки: {path}")
+        return training_set
 
     async def rank_candidates(
         self,
@@ -267,22 +373,118 @@ class CatBoostRankerService:
         Returns:
             Отсортированный список кандидатов с ML-скорами
         """
-        if not self.model or not candidates:
+        # Одна модель на весь запрос, даже если её сменят посередине
+        active = self.registry.active
+        if active is None or not candidates:
+            return candidates
+
+        main_id = main_product["id"]
+        candidate_ids = [c["id"] for c in candidates]
+
+        with span("rank.features"):
+            static = product_feature_store.gather([main_id] + candidate_ids)
+            if static is not None:
+                X, valid_candidates = await self._batch_features(
+                    main_product, candidates, candidate_ids, static, session, cart_products
+                )
+            else:
+                X, valid_candidates = await self._pairwise_features(
+                    main_product, candidates, candidate_ids, session, cart_products
+                )
+
+        if not len(X):
             return candidates
 
+        with span("rank.predict"):
+            X_df = pd.DataFrame(X, columns=feature_extractor.feature_names)
+            start = time.perf_counter()
+            raw_scores = active.predict(X_df)
+        self.registry.shadow_score(X_df, raw_scores, (time.perf_counter() - start) * 1000)
+
+        # Нормализуем скоры в диапазон 0-1 с помощью min-max scaling
+        min_score = float(np.min(raw_scores))
+        max_score = float(np.max(raw_scores))
+        score_range = max_score - min_score
+
+        for candidate, raw_score in zip(valid_candidates, raw_scores):
+            if score_range > 0:
+                normalized_score = (raw_score - min_score) / score_range
+            else:
+                normalized_score = 0.5
+            # Масштабируем в диапазон 0.5-1.0 чтобы все рекомендации выглядели релевантными
+            candidate["ml_score"] = float(0.5 + normalized_score * 0.5)
+
+        valid_candidates.sort(key=lambda x: x["ml_score"], reverse=True)
+
+        return valid_candidates
+
+    async def _batch_features(
+        self,
+        main_product: Dict,
+        candidates: List[Dict],
+        candidate_ids: List[int],
+        static: Dict[str, np.ndarray],
+        session: AsyncSession,
+        cart_products: Optional[List[Dict]],
+    ) -> Tuple[np.ndarray, List[Dict]]:
+        """Признаки кандидата — gather из product_feature_store, попарные — векторно"""
+        main_id = main_product["id"]
+        cart_ids = [p["id"] for p in cart_products] if cart_products else []
+        # Главный товар, кандидаты и корзина — одним запросом
+        lookup_ids = [main_id] + candidate_ids + cart_ids
+
+        with span("rank.features.lookup"):
+            if fast_reader.enabled:
+                embeddings, found = await fast_reader.embedding_matrix(lookup_ids)
+                copurchase_counts = await fast_reader.copurchase_counts(main_id, candidate_ids)
+            else:
+                embeddings_map = await queries.get_embeddings_map(session, lookup_ids)
+                embeddings, found = feature_extractor.embeddings_to_matrix([embeddings_map.get(pid) for pid in lookup_ids])
+                copurchase_stats = await queries.get_copurchase_stats(session, main_id, candidate_ids)
+                copurchase_counts = np.array([copurchase_stats.get(cid, 0) for cid in candidate_ids], dtype=np.float64)
+            pair_positive, pair_negative = await feedback_store.get_pair_arrays(session, main_id, candidate_ids)
+
+        n = len(candidate_ids)
+        cart_found = found[1 + n:]
+
+        X = feature_extractor.extract_batch(
+            main_product=main_product,
+            main_static={name: column[:1] for name, column in static.items()},
+            candidate_static={name: column[1:] for name, column in static.items()},
+            main_embedding=embeddings[0] if found[0] else None,
+            candidate_embeddings=embeddings[1:1 + n],
+            candidate_valid=found[1:1 + n],
+            pair_positive=pair_positive.astype(np.float64),
+            pair_negative=pair_negative.astype(np.float64),
+            copurchase_counts=copurchase_counts,
+            cart_embeddings=embeddings[1 + n:][cart_found] if cart_ids else None,
+            cart_products_count=len(cart_products) if cart_products else 0,
+            event_features=event_feature_store.features(main_id, candidate_ids),
+        )
+        return X, list(candidates)
+
+    async def _pairwise_features(
+        self,
+        main_product: Dict,
+        candidates: List[Dict],
+        candidate_ids: List[int],
+        session: AsyncSession,
+        cart_products: Optional[List[Dict]],
+    ) -> Tuple[List[List[float]], List[Dict]]:
+        """Признаки по одной паре — если стор не загружен или в нём нет кого-то из товаров"""
         X = []
         valid_candidates = []
 
         main_id = main_product["id"]
-        main_embedding = await queries.get_product_embedding(session, main_id)
+        with span("rank.features.lookup"):
+            main_embedding = await queries.get_product_embedding(session, main_id)
 
-        candidate_ids = [c["id"] for c in candidates]
-
-        embeddings_map = await queries.get_embeddings_map(session, candidate_ids)
-        pair_stats = await queries.get_pair_feedback_stats(session, main_id, candidate_ids)
-        copurchase_stats = await queries.get_copurchase_stats(session, main_id, candidate_ids)
+            embeddings_map = await queries.get_embeddings_map(session, candidate_ids)
+            pair_stats = await feedback_store.get_pair_stats(session, main_id, candidate_ids)
+            copurchase_stats = await queries.get_copurchase_stats(session, main_id, candidate_ids)
+        event_features = event_feature_store.features(main_id, candidate_ids)
 
-        for candidate in candidates:
+        for i, candidate in enumerate(candidates):
             cand_id = candidate["id"]
 
             features = await feature_extractor.extract_features(
@@ -295,47 +497,30 @@ class CatBoostRankerService:
                 copurchase_count=copurchase_stats.get(cand_id, 0),
                 cart_products=cart_products,
                 session=session,
+                event_features={name: column[i] for name, column in event_features.items()},
             )
 
             if features:
                 X.append(list(features.values()))
                 valid_candidates.append(candidate)
 
-        if not X:
-            return candidates
-
-        X_df = pd.DataFrame(X, columns=feature_extractor.feature_names)
-        raw_scores = self.model.predict(X_df)
-
-        # Нормализуем скоры в диапазон 0-1 с помощью min-max scaling
-        min_score = float(np.min(raw_scores))
-        max_score = float(np.max(raw_scores))
-        score_range = max_score - min_score
-
-        for candidate, raw_score in zip(valid_candidates, raw_scores):
-            if score_range > 0:
-                normalized_score = (raw_score - min_score) / score_range
-            else:
-                normalized_score = 0.5
-            # Масштабируем в диапазон 0.5-1.0 чтобы все рекомендации выглядели релевантными
-            candidate["ml_score"] = float(0.5 + normalized_score * 0.5)
-
-        valid_candidates.sort(key=lambda x: x["ml_score"], reverse=True)
-
-        return valid_candidates
+        return X, valid_candidates
 
     def get_model_info(self) -> Dict:
         """Возвращает информацию о текущей модели"""
-        if not self.model:
+        active = self.registry.active
+        if active is None:
             return {
                 "status": "no_model",
                 "message": "Модель не обучена. Используется формульный скоринг.",
             }
 
+        candidate = self.registry.candidate
         return {
             "status": "ready",
-            "version": self.model_version,
-            "metadata": self.model_metadata,
+            "version": active.version,
+            "metadata": active.metadata,
+            "candidate_version": candidate.version if candidate else None,
             "feature_count": len(feature_extractor.feature_names),
             "features": feature_extractor.feature_names,
         }
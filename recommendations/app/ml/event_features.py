@@ -0,0 +1,201 @@
+"""
+CTR-признаки и метки из событий рекомендаций (recommendation_event_daily).
+
+Кликабельность с поправкой на позицию — clicks over expected clicks (COEC): клики пары
+делятся на ожидаемые клики, то есть на сумму средних CTR позиций, где пару показывали
+(expected_clicks считает rollup). 1.0 — как в среднем на тех же позициях, выше — лучше.
+Сглаживание: (clicks + a) / (expected_clicks + a), a = ctr_prior_strength; то же для
+add_to_cart. Считается по паре (main, рекомендованный) и по рекомендованному товару.
+
+Окно — последние events_ctr_window_days дней. Дни старше events_rollup_days rollup уже не
+пересчитывает: их суммы держатся в памяти и сдвигаются на смене дня (плюс ставший стабильным
+день, минус выпавший из окна). Последние дни перечитываются на каждом refresh.
+"""
+
+import asyncio
+import logging
+from datetime import date, timedelta
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..core.config import settings
+from ..db import background_session
+from .training_datasets import pair_keys
+
+logger = logging.getLogger(__name__)
+
+# Столбцы сумм: impressions, clicks, add_to_cart, expected_clicks, expected_add_to_cart
+IMPRESSIONS, CLICKS, ADD_TO_CART, EXPECTED_CLICKS, EXPECTED_ADD_TO_CART = range(5)
+
+_Table = Tuple[np.ndarray, np.ndarray]  # (отсортированные ключи, суммы n x 5)
+
+
+def _empty() -> _Table:
+    return np.empty(0, dtype=np.int64), np.empty((0, 5), dtype=np.float64)
+
+
+def _aggregate(keys: np.ndarray, values: np.ndarray) -> _Table:
+    """Суммы по одинаковым ключам; строки без событий отбрасываются"""
+    if not len(keys):
+        return _empty()
+    unique, inverse = np.unique(keys, return_inverse=True)
+    sums = np.column_stack([np.bincount(inverse, weights=values[:, i], minlength=len(unique)) for i in range(5)])
+    # Счётчики целые: после вычитания выпавшего дня пустые строки дают ровно 0
+    alive = sums[:, [IMPRESSIONS, CLICKS, ADD_TO_CART]].any(axis=1)
+    return unique[alive], sums[alive]
+
+
+def _combine(*tables: _Table, sign: Tuple[int, ...] = None) -> _Table:
+    sign = sign or (1,) * len(tables)
+    return _aggregate(
+        np.concatenate([keys for keys, _ in tables]),
+        np.vstack([values * s for (_, values), s in zip(tables, sign)]),
+    )
+
+
+def _lookup(table: _Table, keys: np.ndarray) -> np.ndarray:
+    table_keys, values = table
+    if not len(table_keys):
+        return np.zeros((len(keys), 5))
+    idx = np.minimum(np.searchsorted(table_keys, keys), len(table_keys) - 1)
+    return np.where((table_keys[idx] == keys)[:, None], values[idx], 0.0)
+
+
+class EventFeatureStore:
+    def __init__(self):
+        self._stable: _Table = _empty()  # дни [window_start, stable_until]
+        self._window_start: Optional[date] = None
+        self._stable_until: Optional[date] = None
+        self._pairs: _Table = _empty()
+        self._products: _Table = _empty()
+        self._task: Optional[asyncio.Task] = None
+        self.loaded = False
+
+    def __len__(self) -> int:
+        return len(self._pairs[0])
+
+    @staticmethod
+    def _bounds(today: date) -> Tuple[date, date]:
+        window_start = today - timedelta(days=settings.events_ctr_window_days - 1)
+        stable_until = today - timedelta(days=settings.events_rollup_days + 1)
+        return window_start, stable_until
+
+    @staticmethod
+    async def _read_days(session: AsyncSession, start: date, end: date) -> _Table:
+        if start > end:
+            return _empty()
+        rows = (await session.execute(
+            text("""
+                SELECT main_product_id, recommended_product_id,
+                       SUM(impressions), SUM(clicks), SUM(add_to_cart),
+                       SUM(expected_clicks), SUM(expected_add_to_cart)
+                FROM recommendation_event_daily
+                WHERE day >= :start AND day <= :end
+                GROUP BY main_product_id, recommended_product_id
+            """),
+            {"start": start, "end": end}
+        )).fetchall()
+        if not rows:
+            return _empty()
+        columns = np.asarray(rows, dtype=np.float64)
+        return _aggregate(pair_keys(columns[:, 0].astype(np.int64), columns[:, 1].astype(np.int64)), columns[:, 2:])
+
+    async def load(self, session: AsyncSession):
+        """Полная загрузка окна при старте"""
+        self._stable_until = None
+        await self.refresh(session)
+        self.loaded = True
+        logger.info(f"Event feature store: {len(self)} pairs, {len(self._products[0])} products")
+
+    async def refresh(self, session: AsyncSession):
+        """Сдвигает стабильную часть окна на смене дня и перечитывает последние дни"""
+        today = date.today()
+        window_start, stable_until = self._bounds(today)
+        if self._stable_until is None or window_start > self._stable_until:
+            self._stable = await self._read_days(session, window_start, stable_until)
+        elif stable_until != self._stable_until or window_start != self._window_start:
+            added = await self._read_days(session, self._stable_until + timedelta(days=1), stable_until)
+            expired = await self._read_days(session, self._window_start, window_start - timedelta(days=1))
+            self._stable = _combine(self._stable, added, expired, sign=(1, 1, -1))
+        self._window_start, self._stable_until = window_start, stable_until
+
+        recent = await self._read_days(session, max(stable_until + timedelta(days=1), window_start), today)
+        pairs = _combine(self._stable, recent)
+        # По рекомендованному товару — суммы по всем main (младшие 32 бита ключа пары)
+        self._products = _aggregate(pairs[0] & 0xFFFFFFFF, pairs[1])
+        self._pairs = pairs
+
+    @staticmethod
+    def _debiased(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        a = settings.ctr_prior_strength
+        return (
+            (values[:, CLICKS] + a) / (values[:, EXPECTED_CLICKS] + a),
+            (values[:, ADD_TO_CART] + a) / (values[:, EXPECTED_ADD_TO_CART] + a),
+        )
+
+    def features(self, main_ids, candidate_ids) -> Dict[str, np.ndarray]:
+        """
+        CTR-признаки пар; main_ids — массив той же длины или один id.
+        Пары без событий (и незагруженный стор) дают нейтральные 1.0 и 0 показов.
+        """
+        candidate_ids = np.asarray(candidate_ids, dtype=np.int64)
+        main_ids = np.broadcast_to(np.asarray(main_ids, dtype=np.int64), candidate_ids.shape)
+        pair = _lookup(self._pairs, pair_keys(main_ids, candidate_ids))
+        product = _lookup(self._products, candidate_ids)
+        pair_ctr, pair_atc = self._debiased(pair)
+        product_ctr, product_atc = self._debiased(product)
+        return {
+            "pair_ctr_debiased": pair_ctr,
+            "pair_atc_debiased": pair_atc,
+            "pair_impressions": np.log1p(pair[:, IMPRESSIONS]),
+            "candidate_ctr_debiased": product_ctr,
+            "candidate_atc_debiased": product_atc,
+            "candidate_impressions": np.log1p(product[:, IMPRESSIONS]),
+        }
+
+    def _label_bonus(self, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Клики и корзина пары не ниже ожидаемых для её позиций — при достаточном числе показов"""
+        ctr, atc = self._debiased(values)
+        enough = values[:, IMPRESSIONS] >= settings.ctr_label_min_impressions
+        return (
+            enough & (values[:, CLICKS] > 0) & (ctr >= 1.0),
+            enough & (values[:, ADD_TO_CART] > 0) & (atc >= 1.0),
+        )
+
+    def label_bonus(self, main_ids: np.ndarray, candidate_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        return self._label_bonus(_lookup(self._pairs, pair_keys(main_ids, candidate_ids)))
+
+    def positive_pairs(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Пары, которые кликают не реже ожидаемого для их позиций: (main_ids, candidate_ids)"""
+        keys, values = self._pairs
+        clicked, _ = self._label_bonus(values)
+        keys = keys[clicked]
+        return keys >> 32, keys & 0xFFFFFFFF
+
+    def start(self):
+        if self._task is None and self.loaded and settings.event_features_refresh_interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.event_features_refresh_interval)
+            try:
+                async with background_session() as session:
+                    await self.refresh(session)
+            except Exception as e:
+                logger.error(f"Event feature store refresh failed: {e}")
+
+
+event_feature_store = EventFeatureStore()
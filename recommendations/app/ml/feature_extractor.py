@@ -1,6 +1,6 @@
 """
 Feature Extractor для CatBoost Ranker.
-Извлекает 39 признаков для ранжирования товаров.
+Извлекает 45 признаков для ранжирования товаров.
 """
 
 import numpy as np
@@ -23,8 +23,9 @@ class FeatureExtractor:
     5. Co-purchase - 3 признака
     6. Популярность - 7 признаков (view_count, cart_add_count, order_count)
     7. Контекстные (корзина) - 3 признака
+    8. CTR из событий рекомендаций с поправкой на позицию - 6 признаков (см. event_features)
 
-    Итого: 39 признаков
+    Итого: 45 признаков
     """
 
     def __init__(self):
@@ -72,6 +73,12 @@ class FeatureExtractor:
             "cart_similarity_max",
             "cart_similarity_avg",
             "cart_products_count",
+            "pair_ctr_debiased",
+            "pair_atc_debiased",
+            "pair_impressions",
+            "candidate_ctr_debiased",
+            "candidate_atc_debiased",
+            "candidate_impressions",
         ]
 
     async def extract_features(
@@ -85,9 +92,11 @@ class FeatureExtractor:
         copurchase_count: int,
         cart_products: Optional[List[Dict]] = None,
         session: Optional[AsyncSession] = None,
+        event_features: Optional[Dict[str, float]] = None,
     ) -> Dict[str, float]:
         """
         Извлекает все признаки для пары товаров.
+        event_features — CTR-признаки пары из event_feature_store (по умолчанию нейтральные).
         """
         features = {}
 
@@ -124,8 +133,24 @@ class FeatureExtractor:
             features["cart_similarity_avg"] = 0.0
             features["cart_products_count"] = 0
 
+        features.update(self._event_defaults())
+        if event_features:
+            features.update({name: float(value) for name, value in event_features.items()})
+
         return features
 
+    @staticmethod
+    def _event_defaults() -> Dict[str, float]:
+        """CTR-признаки пары без событий: как в среднем на тех же позициях, 0 показов"""
+        return {
+            "pair_ctr_debiased": 1.0,
+            "pair_atc_debiased": 1.0,
+            "pair_impressions": 0.0,
+            "candidate_ctr_debiased": 1.0,
+            "candidate_atc_debiased": 1.0,
+            "candidate_impressions": 0.0,
+        }
+
     def _extract_semantic_features(
         self,
         main_embedding: Optional[List[float]],
@@ -343,6 +368,137 @@ class FeatureExtractor:
             "cart_products_count": len(cart_products),
         }
 
+    @staticmethod
+    def embeddings_to_matrix(embeddings: List[Optional[List[float]]]) -> tuple:
+        """Список эмбеддингов (None/пустой — нет) -> матрица float32 с нулевыми строками и маска"""
+        valid = np.fromiter((bool(e) for e in embeddings), dtype=bool, count=len(embeddings))
+        if not valid.any():
+            return np.zeros((len(embeddings), 0), dtype=np.float32), valid
+        dim = len(next(e for e in embeddings if e))
+        matrix = np.zeros((len(embeddings), dim), dtype=np.float32)
+        matrix[valid] = np.array([e for e in embeddings if e], dtype=np.float32)
+        return matrix, valid
+
+    def extract_batch(
+        self,
+        main_product: Dict,
+        main_static: Dict[str, np.ndarray],
+        candidate_static: Dict[str, np.ndarray],
+        main_embedding: Optional[np.ndarray],
+        candidate_embeddings: np.ndarray,
+        candidate_valid: np.ndarray,
+        pair_positive: np.ndarray,
+        pair_negative: np.ndarray,
+        copurchase_counts: np.ndarray,
+        cart_embeddings: Optional[np.ndarray] = None,
+        cart_products_count: int = 0,
+        event_features: Optional[Dict[str, np.ndarray]] = None,
+    ) -> np.ndarray:
+        """
+        Те же признаки, что extract_features, сразу для всех кандидатов.
+        Признаки кандидата берутся из product_feature_store (main_static/candidate_static —
+        столбцы одного главного товара и кандидатов), попарные считаются векторно.
+        Эмбеддинги — матрицы float32 (см. embeddings_to_matrix / fast_reader.embedding_matrix),
+        cart_embeddings — только найденные строки, event_features — столбцы event_feature_store.features.
+        Возвращает матрицу (n_candidates, len(feature_names)).
+        """
+        n = len(candidate_valid)
+        f: Dict[str, np.ndarray] = {}
+
+        # Семантические
+        valid = candidate_valid
+        cand = candidate_embeddings if valid.any() else None
+        if cand is not None:
+            cand_n = np.linalg.norm(cand, axis=1)
+
+        has_main = main_embedding is not None and len(main_embedding) > 0
+        has_pair = valid & has_main
+        if cand is not None and has_main:
+            main_vec = np.asarray(main_embedding, dtype=np.float32)
+            main_n = np.linalg.norm(main_vec)
+            main_unit = main_vec / (main_n + 1e-8)
+            cand_unit = cand / (cand_n + 1e-8)[:, None]
+            norms = cand_n * main_n
+            cosine = np.where(norms > 0, (cand @ main_vec) / np.where(norms > 0, norms, 1), 0.0)
+
+            f["embedding_cosine_similarity"] = np.where(has_pair, cosine, 0.5)
+            f["embedding_l2_distance"] = np.where(has_pair, np.linalg.norm(cand_unit - main_unit, axis=1), 1.0)
+            f["embedding_dot_product"] = np.where(has_pair, cand_unit @ main_unit, 0.0)
+            f["embedding_euclidean_distance"] = np.where(has_pair, np.linalg.norm(cand - main_vec, axis=1), 1.0)
+            f["embedding_manhattan_distance"] = np.where(has_pair, np.abs(cand - main_vec).sum(axis=1), 1.0)
+        else:
+            f["embedding_cosine_similarity"] = np.full(n, 0.5)
+            f["embedding_l2_distance"] = np.ones(n)
+            f["embedding_dot_product"] = np.zeros(n)
+            f["embedding_euclidean_distance"] = np.ones(n)
+            f["embedding_manhattan_distance"] = np.ones(n)
+        f["embedding_has_valid"] = has_pair.astype(np.float64)
+
+        # Фидбек (сценарного фидбека на этом пути нет, как и в rank_candidates)
+        pair_total = pair_positive + pair_negative
+        f["pair_feedback_positive"] = pair_positive
+        f["pair_feedback_negative"] = pair_negative
+        f["pair_feedback_total"] = pair_total
+        f["pair_feedback_approval_rate"] = (pair_positive + 1) / (pair_total + 2)
+        f["scenario_feedback_positive"] = np.zeros(n)
+        f["scenario_feedback_negative"] = np.zeros(n)
+        f["scenario_feedback_total"] = np.zeros(n)
+        f["scenario_feedback_approval_rate"] = np.full(n, 0.5)
+
+        # Ценовые
+        main_price = main_product.get("price", 0)
+        cand_price = candidate_static["price"]
+        f["candidate_price"] = cand_price
+        f["price_ratio"] = cand_price / max(main_price, 1)
+        f["price_diff"] = cand_price - main_price
+        f["price_diff_percent"] = (cand_price - main_price) / max(main_price, 1) * 100
+        f["has_discount"] = candidate_static["is_discounted"]
+        f["discount_percent"] = candidate_static["discount_percent"]
+        f["discount_amount"] = candidate_static["discount_amount"]
+
+        # Категорийные
+        main_root = main_static["root_category_id"][0]
+        cand_root = candidate_static["root_category_id"]
+        same_root = (cand_root == main_root) & (main_root > 0) & (cand_root > 0)
+        main_vendor = main_static["vendor_code"][0]
+        same_vendor = ((candidate_static["vendor_code"] == main_vendor) & (main_vendor >= 0)).astype(np.float64)
+        f["same_category"] = (candidate_static["category_id"] == main_static["category_id"][0]).astype(np.float64)
+        f["same_root_category"] = same_root.astype(np.float64)
+        f["category_distance"] = np.where(
+            (main_root > 0) & (cand_root > 0), np.where(same_root, 0.0, 2.0), 3.0
+        )
+        f["same_vendor"] = same_vendor
+        f["different_vendor"] = 1.0 - same_vendor
+
+        # Co-purchase
+        f["copurchase_count"] = copurchase_counts
+        f["copurchase_log"] = np.log1p(copurchase_counts)
+        f["copurchase_exists"] = (copurchase_counts > 0).astype(np.float64)
+
+        # Популярность
+        for name in ("has_image", "is_discounted", "price_bucket", "name_length",
+                     "view_count", "cart_add_count", "order_count"):
+            f[name] = candidate_static[name]
+
+        # Корзина
+        if cart_embeddings is not None and len(cart_embeddings) and cand is not None:
+            cart_matrix = cart_embeddings
+            cart_n = np.linalg.norm(cart_matrix, axis=1)
+            norms = cand_n[:, None] * cart_n[None, :]
+            sims = np.where(norms > 0, (cand @ cart_matrix.T) / np.where(norms > 0, norms, 1), 0.0)
+            f["cart_similarity_max"] = np.where(valid, sims.max(axis=1), 0.0)
+            f["cart_similarity_avg"] = np.where(valid, sims.mean(axis=1), 0.0)
+        else:
+            f["cart_similarity_max"] = np.zeros(n)
+            f["cart_similarity_avg"] = np.zeros(n)
+        f["cart_products_count"] = np.full(n, float(cart_products_count))
+
+        # CTR из событий
+        for name, default in self._event_defaults().items():
+            f[name] = event_features[name] if event_features is not None else np.full(n, default)
+
+        return np.column_stack([np.asarray(f[name], dtype=np.float64) for name in self.feature_names])
+
     def features_to_array(self, features: Dict[str, float]) -> np.ndarray:
         """Конвертирует dict признаков в numpy array в правильном порядке"""
         return np.array([features.get(name, 0.0) for name in self.feature_names])
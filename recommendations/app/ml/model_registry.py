@@ -0,0 +1,285 @@
+"""
+Реестр моделей CatBoost: активная модель, кандидат в shadow-режиме и откат.
+
+Запрос берёт registry.active один раз и работает с ним до конца, поэтому смена
+модели — одна замена ссылки: запрос видит либо старую модель целиком, либо новую.
+Кандидат загружается и прогревается в потоке, затем скорит ту же матрицу признаков
+на доле живых запросов (model_shadow_fraction) вне пути ответа; согласие рангов
+и задержка копятся в ShadowStats. Версия активной модели сохраняется в
+active_model.json и переживает рестарт.
+"""
+
+import asyncio
+import json
+import logging
+import random
+import re
+import time
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from catboost import CatBoostRanker
+
+from ..core.config import settings
+from .feature_extractor import feature_extractor
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_POINTER = "active_model.json"
+SHADOW_TOP_K = 10
+SHADOW_LOG_EVERY = 100
+SHADOW_MAX_PENDING = 4  # не копим очередь shadow-скоринга под нагрузкой
+
+_VERSION_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class LoadedModel:
+    """Загруженная и прогретая модель; после создания не меняется"""
+
+    def __init__(self, version: str, model: CatBoostRanker, metadata: Optional[Dict], path: Path):
+        self.version = version
+        self.model = model
+        self.metadata = metadata
+        self.path = path
+        self.loaded_at = datetime.now().isoformat()
+        self.feature_names = list(model.feature_names_ or [])
+
+    def predict(self, X: pd.DataFrame) -> np.ndarray:
+        # Модель, обученная на прежнем наборе признаков, получает только свои столбцы
+        if self.feature_names and list(X.columns) != self.feature_names:
+            X = X[self.feature_names]
+        return self.model.predict(X)
+
+
+class ShadowStats:
+    def __init__(self):
+        self.samples = 0
+        self.skipped = 0
+        self.errors = 0
+        self.spearman_sum = 0.0
+        self.top_k_overlap_sum = 0.0
+        self.top1_agree = 0
+        self.active_ms: deque = deque(maxlen=1000)
+        self.candidate_ms: deque = deque(maxlen=1000)
+
+    def observe(self, active_scores: np.ndarray, candidate_scores: np.ndarray, active_ms: float, candidate_ms: float):
+        n = len(active_scores)
+        if n > 1:
+            active_rank = np.argsort(np.argsort(-active_scores))
+            candidate_rank = np.argsort(np.argsort(-candidate_scores))
+            d = (active_rank - candidate_rank).astype(np.float64)
+            self.spearman_sum += 1 - 6 * float(d @ d) / (n * (n * n - 1))
+        else:
+            self.spearman_sum += 1.0
+        k = min(SHADOW_TOP_K, n)
+        top_active = set(np.argsort(-active_scores)[:k].tolist())
+        top_candidate = set(np.argsort(-candidate_scores)[:k].tolist())
+        self.top_k_overlap_sum += len(top_active & top_candidate) / k if k else 1.0
+        self.top1_agree += int(np.argmax(active_scores) == np.argmax(candidate_scores)) if n else 1
+        self.active_ms.append(active_ms)
+        self.candidate_ms.append(candidate_ms)
+        self.samples += 1
+
+    def snapshot(self) -> Dict:
+        def latency(values: deque) -> Dict:
+            if not values:
+                return {"p50_ms": None, "p95_ms": None}
+            array = np.fromiter(values, dtype=np.float64)
+            return {"p50_ms": float(np.percentile(array, 50)), "p95_ms": float(np.percentile(array, 95))}
+
+        return {
+            "samples": self.samples,
+            "skipped": self.skipped,
+            "errors": self.errors,
+            "spearman": self.spearman_sum / self.samples if self.samples else None,
+            f"top{SHADOW_TOP_K}_overlap": self.top_k_overlap_sum / self.samples if self.samples else None,
+            "top1_agreement": self.top1_agree / self.samples if self.samples else None,
+            "active_latency": latency(self.active_ms),
+            "candidate_latency": latency(self.candidate_ms),
+        }
+
+
+class ModelRegistry:
+    def __init__(self, models_dir: Path):
+        self.models_dir = models_dir
+        self.active: Optional[LoadedModel] = None
+        self.candidate: Optional[LoadedModel] = None
+        self.shadow = ShadowStats()
+        self.history: List[str] = []  # предыдущие активные версии, последняя — для отката
+        self._lock = asyncio.Lock()
+        self._pending: set = set()
+
+    def model_path(self, version: str) -> Path:
+        if not _VERSION_RE.match(version):
+            raise FileNotFoundError(f"Model {version} not found")
+        return self.models_dir / f"catboost_ranker_{version}.cbm"
+
+    def available_versions(self) -> List[str]:
+        """Версии на диске, новые первыми"""
+        files = sorted(self.models_dir.glob("catboost_ranker_*.cbm"), key=lambda p: p.stat().st_mtime, reverse=True)
+        return [p.stem.replace("catboost_ranker_", "") for p in files]
+
+    def load(self, version: str) -> LoadedModel:
+        """Синхронная загрузка и прогрев; вызывается в потоке (или на старте)"""
+        path = self.model_path(version)
+        if not path.exists():
+            raise FileNotFoundError(f"Model {version} not found")
+
+        model = CatBoostRanker()
+        model.load_model(str(path))
+        metadata = None
+        metadata_file = path.parent / f"{path.stem}_metadata.json"
+        if metadata_file.exists():
+            with open(metadata_file, "r") as f:
+                metadata = json.load(f)
+
+        # Первый predict строит внутренние структуры — пусть это случится не на запросе
+        loaded = LoadedModel(version, model, metadata, path)
+        loaded.predict(pd.DataFrame(
+            np.zeros((1, len(feature_extractor.feature_names))), columns=feature_extractor.feature_names
+        ))
+        return loaded
+
+    def load_initial(self):
+        """Старт сервиса: сохранённая активная версия, иначе самая свежая на диске"""
+        versions = self.available_versions()
+        if not versions:
+            print("Нет обученных моделей. Используется формульный скоринг.")
+            return
+
+        pointer = self.models_dir / ACTIVE_POINTER
+        preferred = None
+        if pointer.exists():
+            with open(pointer) as f:
+                state = json.load(f)
+            preferred = state.get("version")
+            self.history = [v for v in state.get("history", []) if v in versions]
+
+        for version in ([preferred] if preferred in versions else []) + versions:
+            try:
+                self.active = self.load(version)
+                break
+            except Exception as e:
+                print(f"Ошибка загрузки модели {version}: {e}")
+
+        if self.active is not None:
+            metadata = self.active.metadata or {}
+            print(f"✓ Загружена модель: {self.active.path.name}")
+            print(f"  Версия: {self.active.version}")
+            if metadata:
+                print(f"  Обучена: {metadata.get('trained_at')}")
+                print(f"  Примеров: {metadata.get('train_samples')}")
+
+    async def load_candidate(self, version: Optional[str] = None) -> LoadedModel:
+        """Грузит кандидата в потоке; без активной модели он сразу становится активным"""
+        version = version or (self.available_versions() or [None])[0]
+        if version is None:
+            raise FileNotFoundError("No trained models")
+        loaded = await asyncio.to_thread(self.load, version)
+        async with self._lock:
+            if self.active is None:
+                self._swap(loaded)
+            else:
+                self.candidate = loaded
+                self.shadow = ShadowStats()
+                logger.info(f"Model {version} loaded as shadow candidate")
+        return loaded
+
+    async def promote(self) -> LoadedModel:
+        async with self._lock:
+            if self.candidate is None:
+                raise LookupError("No candidate model loaded")
+            self._swap(self.candidate)
+            return self.active
+
+    async def rollback(self, version: Optional[str] = None) -> LoadedModel:
+        """Возврат к предыдущей активной версии (или к указанной)"""
+        async with self._lock:
+            if version is None:
+                if not self.history:
+                    raise LookupError("No previous model version to roll back to")
+                version = self.history[-1]
+        loaded = await asyncio.to_thread(self.load, version)
+        async with self._lock:
+            if self.history and self.history[-1] == version:
+                self.history.pop()
+            self._swap(loaded, remember_previous=False)
+        return loaded
+
+    def discard_candidate(self):
+        self.candidate = None
+
+    def _swap(self, loaded: LoadedModel, remember_previous: bool = True):
+        previous = self.active
+        # Единственная точка смены модели для запросов
+        self.active = loaded
+        if self.candidate is loaded:
+            self.candidate = None
+        if previous is not None and remember_previous and previous.version != loaded.version:
+            self.history.append(previous.version)
+            self.history = self.history[-settings.model_history_size:]
+        self._save_pointer()
+        logger.info(f"Active model: {loaded.version} (was {previous.version if previous else None})")
+
+    def _save_pointer(self):
+        pointer = self.models_dir / ACTIVE_POINTER
+        tmp = pointer.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            json.dump({"version": self.active.version, "history": self.history}, f)
+        tmp.replace(pointer)
+
+    def shadow_score(self, X: pd.DataFrame, active_scores: np.ndarray, active_ms: float):
+        """Для доли запросов скорит ту же матрицу кандидатом в фоне; ответ запроса не ждёт"""
+        candidate = self.candidate
+        if candidate is None or random.random() >= settings.model_shadow_fraction:
+            return
+        if len(self._pending) >= SHADOW_MAX_PENDING:
+            self.shadow.skipped += 1
+            return
+        task = asyncio.create_task(self._shadow(candidate, self.shadow, X, active_scores, active_ms))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _shadow(self, candidate: LoadedModel, stats: ShadowStats, X: pd.DataFrame,
+                      active_scores: np.ndarray, active_ms: float):
+        try:
+            start = time.perf_counter()
+            candidate_scores = await asyncio.to_thread(candidate.predict, X)
+            candidate_ms = (time.perf_counter() - start) * 1000
+            stats.observe(np.asarray(active_scores), np.asarray(candidate_scores), active_ms, candidate_ms)
+        except Exception as e:
+            stats.errors += 1
+            logger.warning(f"Shadow scoring with {candidate.version} failed: {e}")
+            return
+
+        if stats.samples % SHADOW_LOG_EVERY == 0:
+            s = stats.snapshot()
+            logger.info(
+                f"Shadow {candidate.version}: {s['samples']} requests, spearman {s['spearman']:.3f}, "
+                f"top{SHADOW_TOP_K} overlap {s[f'top{SHADOW_TOP_K}_overlap']:.3f}, "
+                f"p95 {s['candidate_latency']['p95_ms']:.1f} ms vs {s['active_latency']['p95_ms']:.1f} ms active"
+            )
+
+    def status(self) -> Dict:
+        def describe(loaded: Optional[LoadedModel]) -> Optional[Dict]:
+            if loaded is None:
+                return None
+            return {
+                "version": loaded.version,
+                "loaded_at": loaded.loaded_at,
+                "trained_at": (loaded.metadata or {}).get("trained_at"),
+                "metrics": (loaded.metadata or {}).get("metrics"),
+            }
+
+        return {
+            "active": describe(self.active),
+            "candidate": describe(self.candidate),
+            "shadow": self.shadow.snapshot() if self.candidate is not None else None,
+            "shadow_fraction": settings.model_shadow_fraction,
+            "history": list(reversed(self.history)),
+            "available": self.available_versions(),
+        }
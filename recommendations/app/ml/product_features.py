@@ -0,0 +1,207 @@
+"""
+Колоночное хранилище признаков товара, не зависящих от пары (главный товар, кандидат).
+
+Товары лежат в плотном индексе (отсортированный массив id), на каждый признак —
+свой NumPy-столбец. Для пачки кандидатов признаки достаются одним gather.
+Каталог, скидки и категории перестраиваются целиком при смене сигнатуры
+(в том числе при пересборке снапшота active_promos на смене дня), product_stats
+подтягиваются инкрементально по updated_at.
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..core.config import settings
+from ..db import background_session
+
+logger = logging.getLogger(__name__)
+
+# Счётчики пишутся транзакциями бэкенда с NOW() на старте — перечитываем с запасом
+STATS_OVERLAP = timedelta(seconds=60)
+
+# Дешёвый отпечаток каталога по водяным знакам, как source_watermarks: число товаров и
+# max(updated_at) по индексу idx_products_updated_at (его ставят загрузчик и бэкенд),
+# пересборка active_promos и число категорий — без чтения всех строк products
+CATALOG_SIGNATURE_SQL = """
+    SELECT concat_ws('|',
+        (SELECT count(*) FROM products),
+        (SELECT max(updated_at) FROM products),
+        (SELECT refreshed_at FROM active_promos_snapshot),
+        (SELECT count(*) FROM categories)
+    )
+"""
+
+
+def root_categories(parents: dict[int, Optional[int]]) -> dict[int, Optional[int]]:
+    """category_id -> корневая категория (как queries.get_root_category_id, но для всего дерева сразу)"""
+    roots: dict[int, Optional[int]] = {}
+    for category_id in parents:
+        path = []
+        current = category_id
+        while True:
+            if current in roots:
+                root = roots[current]
+                break
+            if current not in parents or current in path:
+                # Обрыв цепочки или цикл: корня нет, как и в рекурсивном запросе
+                root = None
+                break
+            path.append(current)
+            if parents[current] is None:
+                root = current
+                break
+            current = parents[current]
+        for node in path:
+            roots[node] = root
+    return roots
+
+
+class ProductFeatureStore:
+    def __init__(self):
+        self.ids = np.empty(0, dtype=np.int64)
+        self.columns: dict[str, np.ndarray] = {}
+        self.loaded = False
+        self._signature: Optional[str] = None
+        self._stats_watermark: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    async def load(self, session: AsyncSession):
+        """Полная сборка столбцов из products, active_promos, categories и product_stats"""
+        signature = (await session.execute(text(CATALOG_SIGNATURE_SQL))).scalar()
+
+        rows = (await session.execute(text("""
+            SELECT p.id, p.category_id, p.vendor, p.price, p.picture, p.name,
+                   pr.discount_price,
+                   COALESCE(ps.view_count, 0), COALESCE(ps.cart_add_count, 0), COALESCE(ps.order_count, 0),
+                   ps.updated_at
+            FROM products p
+            LEFT JOIN active_promos pr ON p.id = pr.product_id
+            LEFT JOIN product_stats ps ON p.id = ps.product_id
+            ORDER BY p.id
+        """))).fetchall()
+        parents = dict((await session.execute(text("SELECT id, parent_id FROM categories"))).fetchall())
+
+        self.ids, self.columns = self.build_columns(rows, parents)
+        self._signature = signature
+        stats_seen = [row[10] for row in rows if row[10] is not None]
+        self._stats_watermark = max(stats_seen) if stats_seen else None
+        self.loaded = True
+        logger.info(f"Product feature store: {len(rows)} products, {len(self.columns)} columns")
+
+    @staticmethod
+    def build_columns(rows, parents: dict[int, Optional[int]]) -> tuple[np.ndarray, dict[str, np.ndarray]]:
+        """
+        Строки запроса load (id, category_id, vendor, price, picture, name, discount_price,
+        view_count, cart_add_count, order_count, ...) по возрастанию id -> (ids, столбцы)
+        """
+        roots = root_categories(parents)
+        n = len(rows)
+        ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=n)
+        category = np.fromiter((row[1] if row[1] is not None else -1 for row in rows), dtype=np.int64, count=n)
+        root = np.fromiter(
+            (roots.get(row[1]) if roots.get(row[1]) is not None else -1 for row in rows), dtype=np.int64, count=n
+        )
+        vendors = [row[2] or "" for row in rows]
+        vendor_names, vendor = np.unique(np.asarray(vendors, dtype=object), return_inverse=True)
+        vendor = vendor.astype(np.int64)
+        if len(vendor_names) and vendor_names[0] == "":
+            vendor[vendor == 0] = -1
+        price = np.fromiter((float(row[3]) if row[3] else 0.0 for row in rows), dtype=np.float64, count=n)
+        discount = np.fromiter((float(row[6]) if row[6] else 0.0 for row in rows), dtype=np.float64, count=n)
+        has_discount = discount > 0
+        with_discount = has_discount & (price > 0)
+
+        columns = {
+            "category_id": category,
+            "root_category_id": root,
+            "vendor_code": vendor,
+            "price": price,
+            "discount_price": discount,
+            "has_image": np.fromiter((1.0 if row[4] else 0.0 for row in rows), dtype=np.float64, count=n),
+            "is_discounted": has_discount.astype(np.float64),
+            "price_bucket": np.where(price > 10000, 2.0, np.where(price > 1000, 1.0, 0.0)),
+            "name_length": np.fromiter((float(len(row[5] or "")) for row in rows), dtype=np.float64, count=n),
+            "discount_percent": np.where(with_discount, (price - discount) / np.where(price > 0, price, 1) * 100, 0.0),
+            "discount_amount": np.where(with_discount, price - discount, 0.0),
+            "view_count": np.log1p(np.fromiter((row[7] for row in rows), dtype=np.float64, count=n)),
+            "cart_add_count": np.log1p(np.fromiter((row[8] for row in rows), dtype=np.float64, count=n)),
+            "order_count": np.log1p(np.fromiter((row[9] for row in rows), dtype=np.float64, count=n)),
+        }
+        return ids, columns
+
+    async def refresh(self, session: AsyncSession):
+        """Перестраивает всё при смене каталога, иначе обновляет только счётчики популярности"""
+        signature = (await session.execute(text(CATALOG_SIGNATURE_SQL))).scalar()
+        if signature != self._signature:
+            await self.load(session)
+            return
+
+        since = self._stats_watermark - STATS_OVERLAP if self._stats_watermark else datetime.min
+        rows = (await session.execute(
+            text("""
+                SELECT product_id, view_count, cart_add_count, order_count, updated_at
+                FROM product_stats
+                WHERE updated_at > :since
+            """),
+            {"since": since}
+        )).fetchall()
+        if not rows:
+            return
+
+        product_ids = np.asarray([row[0] for row in rows], dtype=np.int64)
+        idx, found = self.index_of(product_ids)
+        counts = np.asarray([[row[1] or 0, row[2] or 0, row[3] or 0] for row in rows], dtype=np.float64)
+        for column, values in zip(("view_count", "cart_add_count", "order_count"), counts.T):
+            self.columns[column][idx[found]] = np.log1p(values[found])
+        self._stats_watermark = max([row[4] for row in rows] + [self._stats_watermark or datetime.min])
+
+    def index_of(self, product_ids) -> tuple[np.ndarray, np.ndarray]:
+        """Плотные индексы товаров и маска «товар есть в хранилище»"""
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        if not len(self.ids):
+            return np.zeros(len(product_ids), dtype=np.int64), np.zeros(len(product_ids), dtype=bool)
+        idx = np.minimum(np.searchsorted(self.ids, product_ids), len(self.ids) - 1)
+        return idx, self.ids[idx] == product_ids
+
+    def gather(self, product_ids) -> Optional[dict[str, np.ndarray]]:
+        """Столбцы для списка товаров; None, если какого-то товара нет (новый товар до перестройки)"""
+        if not self.loaded:
+            return None
+        idx, found = self.index_of(product_ids)
+        if not found.all():
+            return None
+        return {name: column[idx] for name, column in self.columns.items()}
+
+    def start(self):
+        if self._task is None and self.loaded and settings.product_features_refresh_interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.product_features_refresh_interval)
+            try:
+                async with background_session() as session:
+                    await self.refresh(session)
+            except Exception as e:
+                logger.error(f"Product feature store refresh failed: {e}")
+
+
+product_feature_store = ProductFeatureStore()
@@ -3,23 +3,49 @@ Training Data Generator для CatBoost Ranker.
 Генерирует обучающие примеры из фидбека и реальных заказов.
 """
 
+import time
+import faiss
 import numpy as np
 import pandas as pd
+from datetime import datetime
 from typing import List, Dict, Tuple, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 
+from ..core.config import settings
+from .event_features import EventFeatureStore, event_feature_store
 from .feature_extractor import feature_extractor
+from .product_features import CATALOG_SIGNATURE_SQL, ProductFeatureStore, product_feature_store
+from .training_datasets import (
+    SOURCE_EVENT_POSITIVE,
+    SOURCE_FEEDBACK_NEGATIVE,
+    SOURCE_FEEDBACK_POSITIVE,
+    SOURCE_HARD_NEGATIVE,
+    SOURCE_IMPRESSION_NEGATIVE,
+    SOURCE_NEIGHBOUR_NEGATIVE,
+    SOURCE_ORDER_POSITIVE,
+    TrainingDataset,
+    feature_schema_hash,
+    new_version,
+    pair_keys,
+)
 from ..db import queries
+from ..db.feedback_store import POLL_OVERLAP
 
 
 class TrainingDataGenerator:
     """
     Генерирует обучающие данные для CatBoost из:
-    1. Позитивных примеров: фидбек положительный + реальные покупки
-    2. Негативных примеров: фидбек отрицательный + случайные товары
+    1. Позитивных примеров: фидбек положительный + реальные покупки + пары, которые кликают
+       не реже ожидаемого для позиций показа (recommendation_event_daily)
+    2. Негативных примеров: фидбек отрицательный + показы без клика, соседи по эмбеддингу
+       и случайные товары (hard negatives)
     """
 
+    def __init__(self):
+        self._local_store: Optional[ProductFeatureStore] = None
+        self._local_events: Optional[EventFeatureStore] = None
+
     async def generate_training_data(
         self,
         session: AsyncSession,
@@ -29,6 +55,24 @@ class TrainingDataGenerator:
         """
         Генерирует обучающие данные.
         """
+        dataset = await self.build_dataset(
+            session, "adhoc", min_feedback_count, negative_sampling_ratio
+        )
+        return dataset.to_frame()
+
+    async def build_dataset(
+        self,
+        session: AsyncSession,
+        name: str,
+        min_feedback_count: int = 5,
+        negative_sampling_ratio: int = 3,
+    ) -> TrainingDataset:
+        """
+        Полная сборка снапшота выборки (не сохраняет — см. TrainingDataset.save).
+        """
+        started = time.perf_counter()
+        # Водяные знаки — до чтения: всё, что закоммитят позже, попадёт в следующую дозапись
+        watermarks = await self.source_watermarks(session)
 
         print("\n[1/5] Извлечение позитивных примеров из фидбека...")
         positive_samples = await self._get_positive_samples_from_feedback(
@@ -36,11 +80,14 @@ class TrainingDataGenerator:
         )
         print(f"  ✓ Найдено {len(positive_samples)} позитивных примеров из фидбека")
 
-        print("\n[2/5] Извлечение позитивных примеров из заказов...")
+        print("\n[2/5] Извлечение позитивных примеров из заказов и событий рекомендаций...")
         order_samples = await self._get_positive_samples_from_orders(session)
         print(f"  ✓ Найдено {len(order_samples)} позитивных примеров из заказов")
+        events = await self._event_store(session)
+        event_samples = self._get_positive_samples_from_events(events, positive_samples + order_samples)
+        print(f"  ✓ Найдено {len(event_samples)} позитивных примеров из событий")
 
-        all_positive = positive_samples + order_samples
+        all_positive = positive_samples + order_samples + event_samples
         print(f"  ✓ Всего позитивных примеров: {len(all_positive)}")
 
         print("\n[3/5] Генерация негативных примеров...")
@@ -49,7 +96,8 @@ class TrainingDataGenerator:
         hard_negatives = await self._generate_hard_negatives(
             session,
             all_positive,
-            ratio=negative_sampling_ratio
+            ratio=negative_sampling_ratio,
+            known_samples=negative_samples,
         )
 
         all_negative = negative_samples + hard_negatives
@@ -59,47 +107,201 @@ class TrainingDataGenerator:
 
         print("\n[4/5] Извлечение признаков для всех примеров...")
 
-        X_positive = []
-        y_positive = []
-        groups_positive = []
+        samples = all_positive + all_negative
+        X, extracted = await self._extract_features_batch(session, samples)
 
-        for i, sample in enumerate(all_positive):
-            features = await self._extract_features_for_sample(session, sample)
-            if features:
-                X_positive.append(features)
-                groups_positive.append(sample["main_product_id"])
+        print(f"  ✓ Признаки извлечены для {int(extracted[:len(all_positive)].sum())}/{len(all_positive)} позитивных")
+        print(f"  ✓ Признаки извлечены для {int(extracted[len(all_positive):].sum())}/{len(all_negative)} негативных")
 
-        print(f"  ✓ Признаки извлечены для {len(X_positive)}/{len(all_positive)} позитивных")
+        print("\n[5/5] Формирование финального датасета...")
 
-        X_negative = []
-        y_negative = []
-        groups_negative = []
+        groups = self._sample_column(samples, "main_product_id")[extracted]
+        candidates = self._sample_column(samples, "candidate_product_id")[extracted]
+        sources = self._sample_column(samples, "source")[extracted]
+        dataset = TrainingDataset(
+            X=X[extracted],
+            y=self._graded_labels(events, groups, candidates, sources),
+            groups=groups,
+            candidates=candidates,
+            sources=sources,
+            metadata=self._metadata(
+                name, "full", None, min_feedback_count, negative_sampling_ratio, watermarks, started
+            ),
+        )
+        self._print_summary(dataset)
+        return dataset
 
-        for sample in all_negative:
-            features = await self._extract_features_for_sample(session, sample)
-            if features:
-                X_negative.append(features)
-                groups_negative.append(sample["main_product_id"])
+    async def update_dataset(
+        self,
+        session: AsyncSession,
+        dataset: TrainingDataset,
+    ) -> Optional[TrainingDataset]:
+        """
+        Дозапись в снапшот фидбека, пришедшего после его сборки.
+
+        Пары, у которых изменился pair_feedback_stats, пересобираются: примеры из фидбека
+        заново размечаются по текущим счётчикам, у примеров из заказов и hard negatives
+        пересчитываются признаки. Добавляются пары, которые начали кликать (события), для
+        новых main_product_id — hard negatives. Счётчики популярности и CTR-признаки
+        обновляются у всех строк, метки пересчитываются по текущим CTR.
+        Возвращает None, если изменились заказы, co-purchase, каталог, схема признаков
+        или эмбеддинги — тогда нужна полная сборка.
+        """
+        started = time.perf_counter()
+        params = dataset.metadata["params"]
+        old_watermarks = dataset.metadata["watermarks"]
+        watermarks = await self.source_watermarks(session)
 
-        print(f"  ✓ Признаки извлечены для {len(X_negative)}/{len(all_negative)} негативных")
+        if not dataset.is_compatible():
+            print("  Схема признаков изменилась — нужна полная сборка")
+            return None
+        changed_sources = [
+            key for key in watermarks
+            if not key.startswith("pair_feedback") and watermarks[key] != old_watermarks.get(key)
+        ]
+        if changed_sources:
+            print(f"  Изменились источники {changed_sources} — нужна полная сборка")
+            return None
 
-        print("\n[5/5] Формирование финального датасета...")
+        since = old_watermarks.get("pair_feedback_updated_at")
+        since = datetime.fromisoformat(since) - POLL_OVERLAP if since else datetime.min
+        rows = (await session.execute(
+            text("""
+                SELECT main_product_id, recommended_product_id, positive_count, negative_count
+                FROM pair_feedback_stats
+                WHERE updated_at > :since
+            """),
+            {"since": since}
+        )).fetchall()
+        print(f"  ✓ Пар с новым фидбеком: {len(rows)}")
+
+        changed = np.isin(
+            pair_keys(dataset.groups, dataset.candidates),
+            pair_keys([row[0] for row in rows], [row[1] for row in rows]),
+        )
+        feedback_sources = np.isin(dataset.sources, [SOURCE_FEEDBACK_POSITIVE, SOURCE_FEEDBACK_NEGATIVE])
+        keep = ~changed
+        recompute = changed & ~feedback_sources
 
-        X = X_positive + X_negative
-        y = y_positive + y_negative
-        groups = groups_positive + groups_negative
+        samples = [
+            {"main_product_id": int(m), "candidate_product_id": int(c), "source": int(src)}
+            for m, c, src in zip(dataset.groups[recompute], dataset.candidates[recompute], dataset.sources[recompute])
+        ]
 
-        feature_names = feature_extractor.feature_names
-        X_df = pd.DataFrame(X, columns=feature_names)
-        y_series = pd.Series(y)
+        new_positive = []
+        for main_id, candidate_id, positive, negative in rows:
+            pair = {"main_product_id": main_id, "candidate_product_id": candidate_id}
+            if positive >= params["min_feedback_count"]:
+                new_positive.append({**pair, "source": SOURCE_FEEDBACK_POSITIVE})
+            if negative > positive:
+                samples.append({**pair, "source": SOURCE_FEEDBACK_NEGATIVE})
+
+        # Пары, которые начали кликать после сборки снапшота
+        events = await self._event_store(session)
+        kept_samples = [
+            {"main_product_id": int(m), "candidate_product_id": int(c)}
+            for m, c in zip(dataset.groups[keep], dataset.candidates[keep])
+        ]
+        new_positive += self._get_positive_samples_from_events(events, kept_samples + samples + new_positive)
+        samples += new_positive
 
-        print(f"  ✓ Размер датасета: {len(X_df)} примеров")
-        print(f"  ✓ Позитивных: {sum(y)} ({sum(y)/len(y)*100:.1f}%)")
-        print(f"  ✓ Негативных: {len(y) - sum(y)} ({(len(y)-sum(y))/len(y)*100:.1f}%)")
-        print(f"  ✓ Уникальных query (main_product_id): {len(set(groups))}")
-        print(f"  ✓ Признаков: {len(feature_names)}")
+        known_mains = set(np.unique(dataset.groups[keep]).tolist())
+        new_main_positives = [s for s in new_positive if s["main_product_id"] not in known_mains]
+        hard_negatives = await self._generate_hard_negatives(
+            session, new_main_positives, ratio=params["negative_sampling_ratio"], known_samples=samples
+        )
+        samples += hard_negatives
+
+        X_new, extracted = await self._extract_features_batch(session, samples)
+        X_old = dataset.X[keep].astype(np.float64)
+        await self._refresh_popularity(session, X_old, dataset.candidates[keep])
+        self._refresh_event_features(events, X_old, dataset.groups[keep], dataset.candidates[keep])
+
+        groups = np.concatenate([dataset.groups[keep], self._sample_column(samples, "main_product_id")[extracted]])
+        candidates = np.concatenate([
+            dataset.candidates[keep], self._sample_column(samples, "candidate_product_id")[extracted]
+        ])
+        sources = np.concatenate([dataset.sources[keep], self._sample_column(samples, "source")[extracted]])
+        # Метки всех строк — по текущим CTR пар
+        updated = TrainingDataset(
+            X=np.vstack([X_old, X_new[extracted]]),
+            y=self._graded_labels(events, groups, candidates, sources),
+            groups=groups,
+            candidates=candidates,
+            sources=sources,
+            metadata=self._metadata(
+                dataset.name, "append", dataset.version,
+                params["min_feedback_count"], params["negative_sampling_ratio"], watermarks, started,
+            ),
+        )
+        print(f"  ✓ Пересобрано строк: {int(changed.sum())}, добавлено: {int(extracted.sum())}")
+        self._print_summary(updated)
+        return updated
 
-        return X_df, y_series, groups
+    async def source_watermarks(self, session: AsyncSession) -> Dict:
+        """Состояние источников выборки; сравнивается при дозаписи"""
+        row = (await session.execute(text("""
+            SELECT
+                (SELECT max(updated_at) FROM pair_feedback_stats),
+                (SELECT count(*) FROM pair_feedback_stats),
+                (SELECT max(id) FROM order_items),
+                (SELECT max(updated_at) FROM copurchase_stats),
+                (SELECT count(*) FROM copurchase_stats),
+                (SELECT count(*) FROM product_embeddings)
+        """))).fetchone()
+        catalog = (await session.execute(text(CATALOG_SIGNATURE_SQL))).scalar()
+        return {
+            "pair_feedback_updated_at": row[0].isoformat() if row[0] else None,
+            "pair_feedback_rows": row[1],
+            "order_items_max_id": row[2],
+            "copurchase_updated_at": row[3].isoformat() if row[3] else None,
+            "copurchase_rows": row[4],
+            "embeddings_rows": row[5],
+            "catalog_signature": catalog,
+        }
+
+    @staticmethod
+    def _sample_column(samples: List[Dict], key: str) -> np.ndarray:
+        return np.fromiter((s[key] for s in samples), dtype=np.int64, count=len(samples))
+
+    @staticmethod
+    def _metadata(
+        name: str,
+        mode: str,
+        parent_version: Optional[str],
+        min_feedback_count: int,
+        negative_sampling_ratio: int,
+        watermarks: Dict,
+        started: float,
+    ) -> Dict:
+        return {
+            "name": name,
+            "version": new_version(),
+            "created_at": datetime.now().isoformat(),
+            "mode": mode,
+            "parent_version": parent_version,
+            "feature_names": feature_extractor.feature_names,
+            "feature_schema": feature_schema_hash(feature_extractor.feature_names),
+            "params": {
+                "min_feedback_count": min_feedback_count,
+                "negative_sampling_ratio": negative_sampling_ratio,
+            },
+            "watermarks": watermarks,
+            "build_seconds": round(time.perf_counter() - started, 3),
+        }
+
+    @staticmethod
+    def _print_summary(dataset: TrainingDataset):
+        y = dataset.y
+        print(f"  ✓ Размер датасета: {len(dataset)} примеров")
+        if len(y):
+            positive = y > 0
+            print(f"  ✓ Позитивных: {int(positive.sum())} ({positive.mean()*100:.1f}%)")
+            print(f"  ✓ Негативных: {int((~positive).sum())} ({(~positive).mean()*100:.1f}%)")
+            grades = np.bincount(y, minlength=4)
+            print("  ✓ Метки: " + ", ".join(f"{grade}: {int(count)}" for grade, count in enumerate(grades)))
+        print(f"  ✓ Уникальных query (main_product_id): {len(np.unique(dataset.groups))}")
+        print(f"  ✓ Признаков: {len(feature_extractor.feature_names)}")
 
     async def _get_positive_samples_from_feedback(
         self,
@@ -125,10 +327,43 @@ class TrainingDataGenerator:
             {
                 "main_product_id": row[0],
                 "candidate_product_id": row[1],
+                "source": SOURCE_FEEDBACK_POSITIVE,
             }
             for row in rows
         ]
 
+    def _get_positive_samples_from_events(self, events: EventFeatureStore, known_samples: List[Dict]) -> List[Dict]:
+        """Пары, которые кликают не реже ожидаемого для позиций показа, кроме уже известных"""
+        main_ids, candidate_ids = events.positive_pairs()
+        if known_samples:
+            known = pair_keys(
+                self._sample_column(known_samples, "main_product_id"),
+                self._sample_column(known_samples, "candidate_product_id"),
+            )
+            new = ~np.isin(pair_keys(main_ids, candidate_ids), known)
+            main_ids, candidate_ids = main_ids[new], candidate_ids[new]
+        return [
+            {"main_product_id": int(m), "candidate_product_id": int(c), "source": SOURCE_EVENT_POSITIVE}
+            for m, c in zip(main_ids, candidate_ids)
+        ]
+
+    @staticmethod
+    def _graded_labels(
+        events: EventFeatureStore,
+        main_ids: np.ndarray,
+        candidate_ids: np.ndarray,
+        sources: np.ndarray,
+    ) -> np.ndarray:
+        """
+        Градуированная релевантность для YetiRank: негативы — 0; позитивы из фидбека и заказов — 1,
+        +1 за клики и +1 за добавления в корзину не ниже ожидаемых для позиций показа
+        (у позитивов из событий — только эти надбавки).
+        """
+        clicked, carted = events.label_bonus(main_ids, candidate_ids)
+        base = np.isin(sources, [SOURCE_FEEDBACK_POSITIVE, SOURCE_ORDER_POSITIVE]).astype(np.int8)
+        positive = (base > 0) | (sources == SOURCE_EVENT_POSITIVE)
+        return np.where(positive, base + clicked + carted, 0).astype(np.int8)
+
     async def _get_negative_samples_from_feedback(
         self,
         session: AsyncSession,
@@ -151,6 +386,7 @@ class TrainingDataGenerator:
             {
                 "main_product_id": row[0],
                 "candidate_product_id": row[1],
+                "source": SOURCE_FEEDBACK_NEGATIVE,
             }
             for row in rows
         ]
@@ -187,11 +423,13 @@ class TrainingDataGenerator:
                 "main_product_id": row[0],
                 "candidate_product_id": row[1],
                 "weight": row[2],
+                "source": SOURCE_ORDER_POSITIVE,
             })
             samples.append({
                 "main_product_id": row[1],
                 "candidate_product_id": row[0],
                 "weight": row[2],
+                "source": SOURCE_ORDER_POSITIVE,
             })
 
         return samples
@@ -201,90 +439,268 @@ class TrainingDataGenerator:
         session: AsyncSession,
         positive_samples: List[Dict],
         ratio: int = 3,
+        known_samples: List[Dict] = (),
     ) -> List[Dict]:
-        """Генерирует hard negatives: случайные товары для каждого main_product."""
+        """
+        До ratio негативов на каждый main_product из позитивов, по убыванию трудности:
+        1. показы без клика и add_to_cart (recommendation_event_daily за hard_negative_window_days);
+        2. ближайшие по эмбеддингу товары других категорий (top hard_negative_neighbours_k);
+        3. остаток — случайные доступные товары.
+        Пары из позитивов и known_samples не берутся.
+        """
         if not positive_samples:
             return []
 
-        main_product_ids = list(set(s["main_product_id"] for s in positive_samples))
-
-        positive_pairs = set(
-            (s["main_product_id"], s["candidate_product_id"])
-            for s in positive_samples
+        main_ids = np.unique(self._sample_column(positive_samples, "main_product_id"))
+        samples = list(positive_samples) + list(known_samples)
+        exclude = pair_keys(
+            self._sample_column(samples, "main_product_id"), self._sample_column(samples, "candidate_product_id")
         )
-
-        query = text("""
-            SELECT id
-            FROM products
-            WHERE available = true
-            ORDER BY RANDOM()
-            LIMIT :limit
-        """)
-
-        result = await session.execute(query, {"limit": len(main_product_ids) * ratio * 2})
-        random_products = [row[0] for row in result.fetchall()]
-
+        need = np.full(len(main_ids), ratio, dtype=np.int64)
+        rng = np.random.default_rng()
         negatives = []
-        random_idx = 0
 
-        for main_id in main_product_ids:
-            added = 0
-            while added < ratio and random_idx < len(random_products):
-                candidate_id = random_products[random_idx]
-                random_idx += 1
+        def take(source: int, pair_mains: np.ndarray, pair_cands: np.ndarray, priority: np.ndarray):
+            nonlocal exclude
+            mains, cands = self._take_per_main(main_ids, need, pair_mains, pair_cands, priority, exclude)
+            need[:] -= np.bincount(np.searchsorted(main_ids, mains), minlength=len(main_ids))
+            exclude = np.concatenate([exclude, pair_keys(mains, cands)])
+            negatives.extend(
+                {"main_product_id": int(m), "candidate_product_id": int(c), "source": source}
+                for m, c in zip(mains, cands)
+            )
+            return len(mains)
+
+        rows = (await session.execute(
+            text("""
+                SELECT main_product_id, recommended_product_id, SUM(impressions)
+                FROM recommendation_event_daily
+                WHERE main_product_id = ANY(:main_ids)
+                  AND day >= CURRENT_DATE - CAST(:days AS INT)
+                GROUP BY main_product_id, recommended_product_id
+                HAVING SUM(clicks) = 0 AND SUM(add_to_cart) = 0 AND SUM(impressions) >= :min_impressions
+            """),
+            {
+                "main_ids": main_ids.tolist(),
+                "days": settings.hard_negative_window_days,
+                "min_impressions": settings.hard_negative_min_impressions,
+            }
+        )).fetchall()
+        impressions = np.asarray(rows, dtype=np.int64).reshape(-1, 3)
+        # Чаще показанные без реакции — первыми; дробная часть только разбивает ничьи
+        from_impressions = take(
+            SOURCE_IMPRESSION_NEGATIVE, impressions[:, 0], impressions[:, 1],
+            -impressions[:, 2] + rng.random(len(impressions)),
+        )
 
-                if (main_id, candidate_id) not in positive_pairs and main_id != candidate_id:
-                    negatives.append({
-                        "main_product_id": main_id,
-                        "candidate_product_id": candidate_id,
-                    })
-                    added += 1
+        from_neighbours = 0
+        if need.any() and settings.hard_negative_neighbours_k > 0:
+            pair_mains, pair_cands = await self._embedding_neighbours(session, main_ids[need > 0])
+            from_neighbours = take(SOURCE_NEIGHBOUR_NEGATIVE, pair_mains, pair_cands, rng.random(len(pair_mains)))
 
+        from_random = 0
+        if need.any():
+            available = np.asarray(
+                (await session.execute(text("SELECT id FROM products WHERE available = true"))).scalars().all(),
+                dtype=np.int64,
+            )
+            if len(available):
+                # С запасом на совпадения с позитивами и самим товаром
+                draws = need * 2
+                pair_mains = np.repeat(main_ids, draws)
+                pair_cands = available[rng.integers(0, len(available), size=int(draws.sum()))]
+                from_random = take(SOURCE_HARD_NEGATIVE, pair_mains, pair_cands, rng.random(len(pair_mains)))
+
+        print(f"  ✓ Hard negatives: показы без клика {from_impressions}, "
+              f"соседи по эмбеддингу {from_neighbours}, случайные {from_random}")
         return negatives
 
-    async def _extract_features_for_sample(
+    @staticmethod
+    def _take_per_main(
+        main_ids: np.ndarray,
+        need: np.ndarray,
+        pair_mains: np.ndarray,
+        pair_cands: np.ndarray,
+        priority: np.ndarray,
+        exclude: np.ndarray,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Для каждого main_ids[i] — до need[i] пар с наименьшим priority,
+        без пар из exclude, повторов и кандидата, совпадающего с main.
+        """
+        pair_mains = np.asarray(pair_mains, dtype=np.int64)
+        pair_cands = np.asarray(pair_cands, dtype=np.int64)
+        keys = pair_keys(pair_mains, pair_cands)
+        valid = (pair_mains != pair_cands) & ~np.isin(keys, exclude)
+        _, first = np.unique(keys[valid], return_index=True)
+        rows = np.flatnonzero(valid)[first]
+        if not len(rows):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+        rows = rows[np.lexsort((priority[rows], pair_mains[rows]))]
+        mains = pair_mains[rows]
+        # Номер пары внутри своего main после сортировки
+        rank = np.arange(len(mains)) - np.searchsorted(mains, mains)
+        selected = rank < need[np.searchsorted(main_ids, mains)]
+        return mains[selected], pair_cands[rows][selected]
+
+    async def _embedding_neighbours(self, session: AsyncSession, main_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Пары (main, сосед): top hard_negative_neighbours_k доступных товаров по косинусу
+        эмбеддингов (FAISS, один batch-поиск на все main), без товаров той же категории —
+        их не предлагает и семантический поиск сервиса.
+        """
+        rows = (await session.execute(text("""
+            SELECT e.product_id, e.embedding, p.available
+            FROM product_embeddings e
+            JOIN products p ON p.id = e.product_id
+            WHERE e.embedding IS NOT NULL
+        """))).fetchall()
+        empty = np.empty(0, dtype=np.int64)
+        if not rows:
+            return empty, empty
+
+        ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        vectors, _ = feature_extractor.embeddings_to_matrix([row[1] for row in rows])
+        faiss.normalize_L2(vectors)
+        available = np.fromiter((bool(row[2]) for row in rows), dtype=bool, count=len(rows))
+
+        order = np.argsort(ids)
+        ids, vectors, available = ids[order], vectors[order], available[order]
+        rows_of_main = np.minimum(np.searchsorted(ids, main_ids), len(ids) - 1)
+        has_vector = ids[rows_of_main] == main_ids
+        main_ids, rows_of_main = main_ids[has_vector], rows_of_main[has_vector]
+        if not len(main_ids) or not available.any():
+            return empty, empty
+
+        index = faiss.IndexFlatIP(vectors.shape[1])
+        index.add(np.ascontiguousarray(vectors[available]))
+        candidate_ids = ids[available]
+
+        k = min(settings.hard_negative_neighbours_k + 1, len(candidate_ids))  # +1: сам товар
+        _, neighbours = index.search(np.ascontiguousarray(vectors[rows_of_main]), k)
+        pair_mains = np.repeat(main_ids, k)
+        pair_cands = candidate_ids[neighbours.ravel()]
+        found = neighbours.ravel() >= 0
+
+        store = await self._feature_store(session)
+        main_idx, main_found = store.index_of(pair_mains)
+        cand_idx, cand_found = store.index_of(pair_cands)
+        category = store.columns["category_id"]
+        other_category = main_found & cand_found & (category[main_idx] != category[cand_idx])
+        keep = found & other_category
+        return pair_mains[keep], pair_cands[keep]
+
+    async def _feature_store(self, session: AsyncSession) -> ProductFeatureStore:
+        if product_feature_store.loaded:
+            return product_feature_store
+        # Обучение вне сервиса (скрипт, отдельный процесс) — собираем хранилище сами
+        if self._local_store is None:
+            self._local_store = ProductFeatureStore()
+            await self._local_store.load(session)
+        else:
+            await self._local_store.refresh(session)
+        return self._local_store
+
+    async def _event_store(self, session: AsyncSession) -> EventFeatureStore:
+        if event_feature_store.loaded:
+            return event_feature_store
+        if self._local_events is None:
+            self._local_events = EventFeatureStore()
+            await self._local_events.load(session)
+        else:
+            await self._local_events.refresh(session)
+        return self._local_events
+
+    @staticmethod
+    def _refresh_event_features(events: EventFeatureStore, X: np.ndarray, main_ids: np.ndarray, candidate_ids: np.ndarray):
+        """Текущие CTR-признаки пар поверх сохранённой матрицы (in place)"""
+        for name, column in events.features(main_ids, candidate_ids).items():
+            X[:, feature_extractor.feature_names.index(name)] = column
+
+    async def _refresh_popularity(self, session: AsyncSession, X: np.ndarray, candidate_ids: np.ndarray):
+        """Текущие счётчики популярности кандидатов поверх сохранённой матрицы (in place)"""
+        store = await self._feature_store(session)
+        idx, found = store.index_of(candidate_ids)
+        for name in ("view_count", "cart_add_count", "order_count"):
+            X[found, feature_extractor.feature_names.index(name)] = store.columns[name][idx[found]]
+
+    async def _extract_features_batch(
         self,
         session: AsyncSession,
-        sample: Dict,
-    ) -> Optional[Dict[str, float]]:
-        """Извлекает признаки для одного обучающего примера"""
-        try:
-            main_id = sample["main_product_id"]
-            cand_id = sample["candidate_product_id"]
-
-            main_product = await queries.get_product_by_id(session, main_id)
-            candidate_product = await queries.get_product_by_id(session, cand_id)
-
-            if not main_product or not candidate_product:
-                return None
-
-            main_embedding = await queries.get_product_embedding(session, main_id)
-            cand_embedding = await queries.get_product_embedding(session, cand_id)
-
-            pair_stats = await queries.get_pair_feedback_stats(session, main_id, [cand_id])
-            pair_feedback = pair_stats.get(cand_id, {"positive": 0, "negative": 0})
-
-            scenario_feedback = {"positive": 0, "negative": 0}
-
-            copurchase_stats = await queries.get_copurchase_stats(session, main_id, [cand_id])
-            copurchase_count = copurchase_stats.get(cand_id, 0)
-
-            features = await feature_extractor.extract_features(
-                main_product=main_product,
-                candidate_product=candidate_product,
-                main_embedding=main_embedding,
-                candidate_embedding=cand_embedding,
-                pair_feedback=pair_feedback,
-                scenario_feedback=scenario_feedback,
-                copurchase_count=copurchase_count,
-                session=session,
+        samples: List[Dict],
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Признаки для всех примеров сразу: товары — из колоночного хранилища, CTR — из
+        event_feature_store, эмбеддинги, фидбек и co-purchase — несколькими запросами по всему набору,
+        матрица — extract_batch по группам одного main_product_id.
+        Возвращает матрицу в порядке samples и маску примеров, для которых есть оба товара.
+        """
+        n = len(samples)
+        X = np.zeros((n, len(feature_extractor.feature_names)), dtype=np.float64)
+        if not n:
+            return X, np.zeros(0, dtype=bool)
+
+        main_ids = np.fromiter((s["main_product_id"] for s in samples), dtype=np.int64, count=n)
+        cand_ids = np.fromiter((s["candidate_product_id"] for s in samples), dtype=np.int64, count=n)
+
+        store = await self._feature_store(session)
+        main_idx, main_found = store.index_of(main_ids)
+        cand_idx, cand_found = store.index_of(cand_ids)
+        extracted = main_found & cand_found
+        if not extracted.any():
+            return X, extracted
+
+        product_ids = np.unique(np.concatenate([main_ids[extracted], cand_ids[extracted]]))
+        embeddings_map = await queries.get_embeddings_map(session, product_ids.tolist())
+        embeddings, has_embedding = feature_extractor.embeddings_to_matrix(
+            [embeddings_map.get(pid) for pid in product_ids.tolist()]
+        )
+        main_rows = np.searchsorted(product_ids, main_ids)
+        cand_rows = np.searchsorted(product_ids, cand_ids)
+
+        pair_mains = main_ids[extracted].tolist()
+        pair_cands = cand_ids[extracted].tolist()
+        pair_stats = await queries.get_pair_feedback_stats_bulk(session, pair_mains, pair_cands)
+        copurchase = await queries.get_copurchase_stats_bulk(session, pair_mains, pair_cands)
+        events = await self._event_store(session)
+        event_columns = events.features(main_ids, cand_ids)
+
+        empty = {"positive": 0, "negative": 0}
+        pair_positive = np.zeros(n, dtype=np.int64)
+        pair_negative = np.zeros(n, dtype=np.int64)
+        copurchase_counts = np.zeros(n, dtype=np.float64)
+        for i in np.flatnonzero(extracted):
+            key = (int(main_ids[i]), int(cand_ids[i]))
+            stats = pair_stats.get(key, empty)
+            pair_positive[i] = stats["positive"]
+            pair_negative[i] = stats["negative"]
+            copurchase_counts[i] = copurchase.get(key, 0)
+
+        # Группы по main_product_id: границы в отсортированном порядке
+        order = np.flatnonzero(extracted)
+        order = order[np.argsort(main_ids[order], kind="stable")]
+        bounds = np.flatnonzero(np.diff(main_ids[order])) + 1
+
+        for group in np.split(order, bounds):
+            main = group[0]
+            main_static = {name: column[main_idx[main]:main_idx[main] + 1] for name, column in store.columns.items()}
+            candidate_static = {name: column[cand_idx[group]] for name, column in store.columns.items()}
+            main_row = main_rows[main]
+            X[group] = feature_extractor.extract_batch(
+                main_product={"price": float(main_static["price"][0])},
+                main_static=main_static,
+                candidate_static=candidate_static,
+                main_embedding=embeddings[main_row] if has_embedding[main_row] else None,
+                candidate_embeddings=embeddings[cand_rows[group]],
+                candidate_valid=has_embedding[cand_rows[group]],
+                pair_positive=pair_positive[group],
+                pair_negative=pair_negative[group],
+                copurchase_counts=copurchase_counts[group],
+                event_features={name: column[group] for name, column in event_columns.items()},
             )
 
-            return features
-
-        except Exception as e:
-            print(f"  Ошибка при извлечении признаков для {sample}: {e}")
-            return None
+        return X, extracted
 
 
 training_data_generator = TrainingDataGenerator()
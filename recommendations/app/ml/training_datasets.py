@@ -0,0 +1,165 @@
+"""
+Версионированные снапшоты обучающей выборки CatBoost.
+
+Снапшот — пара файлов в {training_datasets_dir}/{name}/: {version}.npz с матрицей
+признаков (float32), метками, main_product_id (группа), candidate_product_id и
+источником примера, и {version}.json с метаданными: схема признаков, параметры
+генерации и водяные знаки источников на момент сборки. По водяным знакам
+TrainingDataGenerator решает, можно ли дописать в снапшот только новый фидбек.
+"""
+
+import hashlib
+import json
+import re
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from ..core.config import settings
+from .feature_extractor import feature_extractor
+
+# Источник примера: от него зависит, что пересчитывать при дозаписи
+SOURCE_FEEDBACK_POSITIVE = 0
+SOURCE_ORDER_POSITIVE = 1
+SOURCE_FEEDBACK_NEGATIVE = 2
+SOURCE_HARD_NEGATIVE = 3  # случайный доступный товар
+SOURCE_IMPRESSION_NEGATIVE = 4  # показан в рекомендациях, но без клика и add_to_cart
+SOURCE_NEIGHBOUR_NEGATIVE = 5  # близкий по эмбеддингу товар другой категории
+SOURCE_EVENT_POSITIVE = 6  # кликают не реже ожидаемого для позиций показа
+
+_NAME_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def feature_schema_hash(feature_names: List[str]) -> str:
+    return hashlib.sha1("\n".join(feature_names).encode()).hexdigest()[:12]
+
+
+def pair_keys(main_ids: np.ndarray, candidate_ids: np.ndarray) -> np.ndarray:
+    """Пара (main, candidate) -> один int64 для np.isin"""
+    return (np.asarray(main_ids, dtype=np.int64) << 32) | np.asarray(candidate_ids, dtype=np.int64)
+
+
+class TrainingDataset:
+    def __init__(
+        self,
+        X: np.ndarray,
+        y: np.ndarray,
+        groups: np.ndarray,
+        candidates: np.ndarray,
+        sources: np.ndarray,
+        metadata: Dict,
+    ):
+        self.X = np.ascontiguousarray(X, dtype=np.float32)
+        self.y = np.asarray(y, dtype=np.int8)  # градуированная релевантность 0-3
+        self.groups = np.asarray(groups, dtype=np.int64)
+        self.candidates = np.asarray(candidates, dtype=np.int64)
+        self.sources = np.asarray(sources, dtype=np.int8)
+        self.metadata = metadata
+
+    def __len__(self) -> int:
+        return len(self.y)
+
+    @property
+    def name(self) -> str:
+        return self.metadata["name"]
+
+    @property
+    def version(self) -> str:
+        return self.metadata["version"]
+
+    def to_frame(self) -> Tuple[pd.DataFrame, pd.Series, List[int]]:
+        """Формат generate_training_data: (X, y, groups)"""
+        return (
+            pd.DataFrame(self.X, columns=self.metadata["feature_names"]),
+            pd.Series(self.y.astype(int)),
+            self.groups.tolist(),
+        )
+
+    def summary(self) -> Dict:
+        return {
+            "name": self.name,
+            "version": self.version,
+            "rows": len(self),
+            "positives": int((self.y > 0).sum()),
+            "groups": int(len(np.unique(self.groups))),
+            **{key: self.metadata.get(key) for key in ("created_at", "mode", "parent_version", "build_seconds")},
+        }
+
+    def save(self, directory: Optional[str] = None) -> Path:
+        """Пишет {version}.npz и {version}.json; старые версии сверх training_datasets_keep удаляются"""
+        path = Path(directory or settings.training_datasets_dir) / self.name
+        path.mkdir(parents=True, exist_ok=True)
+
+        self.metadata.update({
+            "rows": len(self),
+            "positives": int((self.y > 0).sum()),
+            "groups": int(len(np.unique(self.groups))),
+        })
+        np.savez(
+            path / f"{self.version}.npz",
+            X=self.X, y=self.y, groups=self.groups, candidates=self.candidates, sources=self.sources,
+        )
+        with open(path / f"{self.version}.json", "w") as f:
+            json.dump(self.metadata, f, indent=2, ensure_ascii=False)
+
+        versions = sorted(p.stem for p in path.glob("*.npz"))
+        for old in versions[:-settings.training_datasets_keep] if settings.training_datasets_keep > 0 else []:
+            # Вместе с версией — её кэш квантованных пулов ({version}.b{border_count}.*)
+            for file in path.glob(f"{old}.*"):
+                file.unlink(missing_ok=True)
+
+        return path / f"{self.version}.npz"
+
+    @classmethod
+    def load(cls, name: str, version: Optional[str] = None, directory: Optional[str] = None) -> Optional["TrainingDataset"]:
+        """Снапшот по имени (последняя версия, если version не задана); None — если такого нет"""
+        path = Path(directory or settings.training_datasets_dir) / name
+        if not path.is_dir():
+            return None
+        if version is None:
+            versions = sorted(p.stem for p in path.glob("*.npz"))
+            if not versions:
+                return None
+            version = versions[-1]
+        if not (path / f"{version}.npz").exists():
+            return None
+
+        with open(path / f"{version}.json") as f:
+            metadata = json.load(f)
+        with np.load(path / f"{version}.npz") as data:
+            return cls(data["X"], data["y"], data["groups"], data["candidates"], data["sources"], metadata)
+
+    def is_compatible(self) -> bool:
+        """Схема признаков совпадает с текущим feature_extractor"""
+        return self.metadata.get("feature_schema") == feature_schema_hash(feature_extractor.feature_names)
+
+
+def validate_dataset_name(name: str) -> str:
+    if not _NAME_RE.match(name):
+        raise ValueError(f"Недопустимое имя датасета: {name!r} (латиница, цифры, _ и -)")
+    return name
+
+
+def new_version() -> str:
+    return datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+
+
+def list_datasets(directory: Optional[str] = None) -> List[Dict]:
+    """Метаданные всех сохранённых снапшотов, новые версии первыми"""
+    root = Path(directory or settings.training_datasets_dir)
+    if not root.is_dir():
+        return []
+    result = []
+    for metadata_file in root.glob("*/*.json"):
+        with open(metadata_file) as f:
+            metadata = json.load(f)
+        result.append({
+            key: metadata.get(key)
+            for key in ("name", "version", "created_at", "mode", "parent_version", "rows", "positives",
+                        "groups", "feature_schema", "params", "watermarks", "build_seconds")
+        })
+    result.sort(key=lambda m: (m["name"] or "", m["version"] or ""), reverse=True)
+    return result
@@ -0,0 +1,230 @@
+"""
+Фоновые задачи обучения CatBoost.
+
+Обучение идёт в отдельном процессе (spawn, свой event loop и свои пулы БД, пониженный
+приоритет), поэтому сборка выборки и fit не блокируют event loop сервиса и не
+конкурируют с ним за GIL. Процесс присылает прогресс и результат через очередь,
+отмена — через Event: его проверяют границы этапов и колбэк CatBoost на каждой
+итерации; если процесс не остановился за training_job_cancel_timeout, он
+завершается принудительно. Одновременно выполняется не больше одной задачи.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from ..core.config import settings
+from ..db import database
+from ..db.replica import replica_router
+from .catboost_ranker import TrainingCancelled, catboost_ranker
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ("queued", "running", "cancelling")
+
+# Доля общего прогресса на этап train_model
+STAGE_RANGES = {
+    "dataset": (0.0, 0.2),
+    "fit": (0.2, 0.95),
+    "save": (0.95, 1.0),
+}
+
+PROGRESS_INTERVAL = 0.5  # секунды между сообщениями о прогрессе из процесса
+
+
+class TrainingJobConflict(Exception):
+    def __init__(self, job_id: str):
+        super().__init__(f"Training job {job_id} is already running")
+        self.job_id = job_id
+
+
+def _train_in_process(params: Dict, events, cancel_event):
+    """Точка входа процесса обучения"""
+    if settings.training_job_nice:
+        os.nice(settings.training_job_nice)
+    asyncio.run(_train(params, events, cancel_event))
+
+
+async def _train(params: Dict, events, cancel_event):
+    last_sent = 0.0
+
+    def progress(stage: str, fraction: float) -> bool:
+        nonlocal last_sent
+        if cancel_event.is_set():
+            return False
+        now = time.monotonic()
+        if fraction in (0.0, 1.0) or now - last_sent >= PROGRESS_INTERVAL:
+            events.put({"type": "progress", "stage": stage, "fraction": fraction})
+            last_sent = now
+        return True
+
+    try:
+        if replica_router.enabled:
+            await replica_router.check()
+        async with replica_router.background_read_session() as session:
+            metadata = await catboost_ranker.train_model(session=session, progress=progress, **params)
+        events.put({"type": "succeeded", "metadata": metadata})
+    except TrainingCancelled as e:
+        events.put({"type": "cancelled", "error": str(e)})
+    except Exception as e:
+        events.put({"type": "failed", "error": str(e)})
+    finally:
+        await database.background_engine.dispose()
+        for replica_engine, _ in database.replica_engines:
+            await replica_engine.dispose()
+
+
+class TrainingJobManager:
+    def __init__(self):
+        self._jobs: "OrderedDict[str, Dict]" = OrderedDict()
+        self._active_id: Optional[str] = None
+        self._process: Optional[multiprocessing.Process] = None
+        self._cancel_event = None
+        self._cancel_requested_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        self._context = multiprocessing.get_context("spawn")
+
+    def submit(self, params: Dict) -> Dict:
+        """Запускает обучение; TrainingJobConflict, если уже идёт другая задача"""
+        if self._active_id is not None:
+            raise TrainingJobConflict(self._active_id)
+
+        job = {
+            "job_id": uuid.uuid4().hex[:12],
+            "status": "queued",
+            "stage": None,
+            "progress": 0.0,
+            "params": params,
+            "created_at": datetime.now().isoformat(),
+            "started_at": None,
+            "finished_at": None,
+            "metrics": None,
+            "metadata": None,
+            "error": None,
+        }
+        self._jobs[job["job_id"]] = job
+        while len(self._jobs) > settings.training_jobs_history:
+            self._jobs.popitem(last=False)
+
+        events = self._context.Queue()
+        self._cancel_event = self._context.Event()
+        self._process = self._context.Process(
+            target=_train_in_process,
+            args=(params, events, self._cancel_event),
+            name=f"training-{job['job_id']}",
+            daemon=True,
+        )
+        self._process.start()
+        self._active_id = job["job_id"]
+        self._task = asyncio.create_task(self._watch(job, self._process, events))
+        logger.info(f"Training job {job['job_id']} started (pid {self._process.pid})")
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        return self._jobs.get(job_id)
+
+    def list(self) -> List[Dict]:
+        return list(reversed(self._jobs.values()))
+
+    def cancel(self, job_id: str) -> Optional[Dict]:
+        """Просит процесс остановиться; завершённые задачи не меняются"""
+        job = self._jobs.get(job_id)
+        if job is None or job["status"] not in ACTIVE_STATUSES:
+            return job
+        if job["status"] != "cancelling":
+            job["status"] = "cancelling"
+            self._cancel_requested_at = time.monotonic()
+            self._cancel_event.set()
+        return job
+
+    async def stop(self):
+        """Остановка сервиса: активная задача отменяется, процесс завершается"""
+        if self._active_id is not None:
+            self.cancel(self._active_id)
+            process = self._process
+            await asyncio.to_thread(process.join, settings.training_job_cancel_timeout)
+            if process.is_alive():
+                process.terminate()
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(self._task, timeout=5.0)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                self._task.cancel()
+            self._task = None
+
+    async def _watch(self, job: Dict, process: multiprocessing.Process, events):
+        result: Optional[Dict] = None
+        try:
+            while True:
+                result = self._drain(job, events)
+                if result is not None or not process.is_alive():
+                    # Процесс мог успеть положить результат перед выходом
+                    result = result or self._drain(job, events)
+                    break
+                if (
+                    job["status"] == "cancelling"
+                    and time.monotonic() - self._cancel_requested_at > settings.training_job_cancel_timeout
+                ):
+                    logger.warning(f"Training job {job['job_id']} did not stop in time, terminating")
+                    process.terminate()
+                await asyncio.sleep(PROGRESS_INTERVAL)
+
+            await asyncio.to_thread(process.join, settings.training_job_cancel_timeout)
+            if result is None:
+                result = (
+                    {"type": "cancelled"} if job["status"] == "cancelling"
+                    else {"type": "failed", "error": f"Training process exited with code {process.exitcode}"}
+                )
+            if result["type"] == "succeeded":
+                # Модель уже на диске: грузим её кандидатом в shadow до смены статуса
+                # (без активной модели реестр сразу делает её активной)
+                registry = catboost_ranker.registry
+                await registry.load_candidate(result["metadata"]["version"])
+                if settings.model_auto_promote and registry.candidate is not None:
+                    await registry.promote()
+        except Exception as e:
+            logger.error(f"Training job {job['job_id']} watcher failed: {e}")
+            result = {"type": "failed", "error": str(e)}
+        finally:
+            # Итоговый статус и освобождение слота — одним шагом, без await между ними
+            result = result or {"type": "failed", "error": "Training job watcher stopped"}
+            job["status"] = result["type"]
+            job["error"] = result.get("error")
+            if result["type"] == "succeeded":
+                job["progress"] = 1.0
+                job["metadata"] = result["metadata"]
+                job["metrics"] = result["metadata"].get("metrics")
+            job["finished_at"] = datetime.now().isoformat()
+            events.close()
+            self._active_id = None
+            self._process = None
+            self._cancel_requested_at = None
+            logger.info(f"Training job {job['job_id']} finished: {job['status']}")
+
+    @staticmethod
+    def _drain(job: Dict, events) -> Optional[Dict]:
+        """Применяет прогресс из очереди процесса к задаче; возвращает итоговое сообщение, если оно пришло"""
+        while True:
+            try:
+                event = events.get_nowait()
+            except queue.Empty:
+                return None
+
+            if event["type"] != "progress":
+                return event
+            if job["status"] == "queued":
+                job["status"] = "running"
+                job["started_at"] = datetime.now().isoformat()
+            start, end = STAGE_RANGES.get(event["stage"], (job["progress"], job["progress"]))
+            job["stage"] = event["stage"]
+            job["progress"] = round(start + (end - start) * event["fraction"], 4)
+
+
+training_jobs = TrainingJobManager()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Квантование эмбеддингов в product_embeddings.embedding_q (float16 / int8)
+и отчёт: сколько памяти экономим и сколько recall теряем.
+Запуск: python -m app.quantize_embeddings --mode int8 [--report-only]
+"""
+
+import argparse
+import asyncio
+import faiss
+import numpy as np
+from sqlalchemy import text
+
+from .core.config import settings
+from .core.quantization import CompactIndex, encode_vector, quantize, stored_size
+from .db.database import async_session, init_db
+
+
+def recall_report(matrix: np.ndarray, mode: str, k: int, rescore_k: int, sample_size: int = 500) -> dict:
+    """Recall@k компактного поиска относительно точного, без и с rescoring"""
+    exact_index = faiss.IndexFlatIP(matrix.shape[1])
+    exact_index.add(matrix)
+
+    codes, scales = quantize(matrix, mode)
+    compact_index = CompactIndex(codes, scales)
+
+    rng = np.random.default_rng(42)
+    sample = rng.choice(len(matrix), size=min(sample_size, len(matrix)), replace=False)
+    queries = matrix[sample]
+
+    k = min(k, len(matrix))
+    rescore_k = max(min(rescore_k, len(matrix)), k)
+
+    _, exact_top = exact_index.search(queries, k)
+    _, compact_top = compact_index.search(queries, rescore_k)
+
+    recall_raw = 0.0
+    recall_rescored = 0.0
+    for q, exact_row, compact_row in zip(queries, exact_top, compact_top):
+        truth = set(exact_row.tolist())
+        recall_raw += len(truth & set(compact_row[:k].tolist())) / k
+
+        rescored = compact_row[np.argsort(-(matrix[compact_row] @ q))][:k]
+        recall_rescored += len(truth & set(rescored.tolist())) / k
+
+    return {
+        "recall_raw": recall_raw / len(queries),
+        "recall_rescored": recall_rescored / len(queries),
+        "k": k,
+        "rescore_k": rescore_k,
+        "queries": len(queries),
+    }
+
+
+async def quantize_embeddings(mode: str, report_only: bool = False, batch_size: int = 1000):
+    """Заполняет embedding_q и печатает отчёт по памяти и recall"""
+    await init_db()
+
+    async with async_session() as session:
+        result = await session.execute(
+            text("SELECT product_id, embedding FROM product_embeddings WHERE embedding IS NOT NULL ORDER BY product_id")
+        )
+        rows = result.fetchall()
+
+        if not rows:
+            print("No embeddings found")
+            return
+
+        product_ids = [row[0] for row in rows]
+        matrix = np.asarray([row[1] for row in rows], dtype=np.float32)
+        faiss.normalize_L2(matrix)
+        n, dim = matrix.shape
+
+        if not report_only:
+            for start in range(0, n, batch_size):
+                await session.execute(
+                    text("""
+                        UPDATE product_embeddings
+                        SET embedding_q = :packed, embedding_q_dtype = :mode
+                        WHERE product_id = :product_id
+                    """),
+                    [
+                        {"product_id": pid, "packed": encode_vector(vec, mode), "mode": mode}
+                        for pid, vec in zip(product_ids[start:start + batch_size], matrix[start:start + batch_size])
+                    ]
+                )
+                await session.commit()
+                print(f"Progress: {min(start + batch_size, n)}/{n}")
+
+    db_full = stored_size(dim, "float32") * n
+    db_compact = stored_size(dim, mode) * n
+    ram_full = 4 * dim * n
+    ram_compact = (1 if mode == "int8" else 2) * dim * n + (4 * n if mode == "int8" else 0)
+
+    report = recall_report(matrix, mode, k=20, rescore_k=settings.embedding_rescore_k)
+
+    print(f"\nEmbeddings: {n} x {dim}, mode: {mode}")
+    print(f"DB (vector payload):  {db_full / 1024 / 1024:.1f} MB -> {db_compact / 1024 / 1024:.1f} MB "
+          f"({db_full / db_compact:.1f}x)")
+    print(f"RAM (search matrix):  {ram_full / 1024 / 1024:.1f} MB -> {ram_compact / 1024 / 1024:.1f} MB "
+          f"({ram_full / ram_compact:.1f}x)")
+    print(f"Recall@{report['k']} без rescoring:  {report['recall_raw']:.4f}")
+    print(f"Recall@{report['k']} с rescoring top-{report['rescore_k']}: {report['recall_rescored']:.4f}")
+    print(f"(по {report['queries']} случайным запросам)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=["float16", "int8"], default="int8")
+    parser.add_argument("--report-only", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(quantize_embeddings(args.mode, args.report_only))
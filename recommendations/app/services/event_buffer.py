@@ -0,0 +1,130 @@
+import asyncio
+import logging
+from typing import Optional
+
+from ..core.config import settings
+from ..db import background_session, queries
+from ..db.database import is_row_error
+
+logger = logging.getLogger(__name__)
+
+
+class EventBufferFull(Exception):
+    """Буфер не освободился за event_buffer_put_timeout"""
+
+
+class EventBuffer:
+    """
+    Буфер событий рекомендаций (impression / click / add_to_cart).
+    Эндпоинты только кладут события в память; фоновая задача пишет их в
+    recommendation_events одним COPY при накоплении event_flush_size событий
+    или раз в event_flush_interval секунд.
+
+    Память ограничена event_buffer_max_size: при переполнении put() ждёт сброса.
+    created_at проставляется БД в момент сброса (отставание не больше интервала).
+    """
+
+    def __init__(self):
+        self._events: list[tuple] = []
+        self._flush_requested = asyncio.Event()
+        self._space_available = asyncio.Event()
+        self._space_available.set()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.flushed_total = 0
+        self.dropped_total = 0
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает фоновую задачу и сбрасывает остаток буфера"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Final event flush failed, {len(self._events)} events lost: {e}")
+
+    async def put(self, events: list[tuple]):
+        """Добавляет события (кортежи в порядке queries.RECOMMENDATION_EVENT_COLUMNS)"""
+        while len(self._events) + len(events) > settings.event_buffer_max_size and self._events:
+            self._space_available.clear()
+            self._flush_requested.set()
+            try:
+                await asyncio.wait_for(self._space_available.wait(), settings.event_buffer_put_timeout)
+            except asyncio.TimeoutError:
+                raise EventBufferFull() from None
+
+        self._events.extend(events)
+        if len(self._events) >= settings.event_flush_size:
+            self._flush_requested.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), settings.event_flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Event buffer flush failed: {e}")
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._events:
+                return
+            batch, self._events = self._events, []
+
+            try:
+                async with background_session() as session:
+                    await queries.bulk_insert_recommendation_events(session, batch)
+                self.flushed_total += len(batch)
+            except Exception as e:
+                if not is_row_error(e):
+                    # БД недоступна: возвращаем события в начало буфера, повторим на следующем тике
+                    self._events = batch + self._events
+                    raise
+                # Одна невалидная строка (например, несуществующий товар) валит весь COPY —
+                # пишем пачку построчно и отбрасываем только битые события
+                logger.warning(f"Bulk insert of {len(batch)} events failed ({e}), retrying row by row")
+                await self._insert_rows(batch)
+            finally:
+                self._space_available.set()
+
+    async def _insert_rows(self, batch: list[tuple]):
+        """
+        Построчная запись с отбрасыванием битых событий. Если БД отвалилась посередине,
+        ещё не обработанный остаток пачки возвращается в начало буфера.
+        """
+        done = 0
+        try:
+            async with background_session() as session:
+                for event in batch:
+                    try:
+                        await queries.insert_recommendation_event(session, event)
+                        self.flushed_total += 1
+                    except Exception as e:
+                        if not is_row_error(e):
+                            raise
+                        await session.rollback()
+                        self.dropped_total += 1
+                        logger.warning(f"Dropped recommendation event {event}: {e}")
+                    done += 1
+        except Exception:
+            self._events = batch[done:] + self._events
+            raise
+
+
+event_buffer = EventBuffer()
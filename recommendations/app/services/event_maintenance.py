@@ -0,0 +1,51 @@
+import asyncio
+import logging
+from typing import Optional
+
+from ..core.config import settings
+from ..db import background_session
+from ..db.active_promos import refresh_active_promos
+from ..db.event_partitions import run_maintenance
+
+logger = logging.getLogger(__name__)
+
+
+class EventMaintenance:
+    """Периодическое обслуживание внутри сервиса: партиции recommendation_events и снапшот active_promos на смене дня"""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None and settings.events_maintenance_interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                async with background_session() as session:
+                    report = await run_maintenance(session)
+                if report and (report["created"] or report["dropped"]):
+                    logger.info(f"Event partitions: created {report['created']}, dropped {report['dropped']}")
+            except Exception as e:
+                logger.error(f"Event maintenance failed: {e}")
+            try:
+                async with background_session() as session:
+                    total = await refresh_active_promos(session)
+                if total is not None:
+                    logger.info(f"Active promos snapshot rebuilt: {total} products")
+            except Exception as e:
+                logger.error(f"Active promos refresh failed: {e}")
+            await asyncio.sleep(settings.events_maintenance_interval)
+
+
+event_maintenance = EventMaintenance()
@@ -1,11 +1,17 @@
 import logging
+from pathlib import Path
 import numpy as np
 import faiss
 from typing import Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from ..core.config import settings
 from ..core.embeddings import cosine_similarity
+from ..core.projection import EmbeddingProjection, load_projection
+from ..core.quantization import STORAGE_MODES, CompactIndex, decode_vector, dequantize, quantize
+from ..core.tracing import span
 from ..db import queries
+from ..db.feedback_store import feedback_store
 from .scenarios import scenarios_service
 from ..ml.catboost_ranker import catboost_ranker
 
@@ -18,40 +24,193 @@ class ProductRecommender:
     """
 
     def __init__(self):
-        self.index: Optional[faiss.IndexFlatIP] = None
+        self.index = None  # faiss.IndexFlatIP или CompactIndex для float16/int8
         self.product_ids: list[int] = []
         self.product_id_to_idx: dict[int, int] = {}
         self.embeddings_matrix: Optional[np.ndarray] = None
+        self.embedding_scales: Optional[np.ndarray] = None
+        self.projection: Optional[EmbeddingProjection] = None
+        self.needs_rescore = False
+        self.full_matrix: Optional[np.ndarray] = None  # memmap точных векторов при загрузке из файла
 
     async def load_embeddings(self, session: AsyncSession):
-        """Загружает эмбеддинги в FAISS индекс"""
+        """
+        Загружает эмбеддинги в индекс.
+        При embedding_storage=float16/int8 матрица хранится в компактном виде,
+        при embedding_dim меньше исходной размерности поиск идёт в пониженной размерности.
+        В обоих случаях топ кандидатов пересчитывается по точным векторам (см. _rescore_exact).
+        При заданном embeddings_file векторы читаются из .npy без обращения к БД.
+        Из БД берутся только товары в продаже; снятые после загрузки индекса (delta-импорт)
+        отсеиваются при выборке кандидатов.
+        """
         from sqlalchemy import text
 
-        result = await session.execute(
-            text("SELECT product_id, embedding FROM product_embeddings WHERE embedding IS NOT NULL")
-        )
+        mode = settings.embedding_storage
+        if mode not in STORAGE_MODES:
+            logger.warning(f"Unknown embedding_storage={mode}, fallback to float32")
+            mode = "float32"
+
+        if settings.embeddings_file:
+            self.load_embeddings_file(settings.embeddings_file, mode)
+            return
+
+        if mode == "float32":
+            result = await session.execute(
+                text("""
+                    SELECT e.product_id, e.embedding
+                    FROM product_embeddings e
+                    JOIN products p ON p.id = e.product_id
+                    WHERE e.embedding IS NOT NULL AND p.available = true
+                """)
+            )
+        else:
+            # Берём готовый embedding_q, если он закодирован в нужном формате, иначе FLOAT[]
+            result = await session.execute(
+                text("""
+                    SELECT e.product_id,
+                           CASE WHEN e.embedding_q_dtype = :mode THEN e.embedding_q END,
+                           CASE WHEN e.embedding_q_dtype IS DISTINCT FROM :mode THEN e.embedding END
+                    FROM product_embeddings e
+                    JOIN products p ON p.id = e.product_id
+                    WHERE e.embedding IS NOT NULL AND p.available = true
+                """),
+                {"mode": mode}
+            )
         rows = result.fetchall()
 
         if not rows:
             logger.warning("No embeddings found in database")
             return
 
-        self.product_ids = []
-        self.product_id_to_idx = {}
-        embeddings = []
+        self.full_matrix = None
+        self._build_index(
+            [row[0] for row in rows],
+            lambda start, end: np.vstack([self._decode_row(row, mode) for row in rows[start:end]]),
+            mode,
+        )
+
+    def load_embeddings_file(self, path: str, mode: str = "float32"):
+        """
+        Загружает embeddings.npy + embeddings_ids.npy (формат data/export_embeddings.py).
+        Матрица открывается через memmap и служит источником точных векторов для rescoring.
+        """
+        path = Path(path)
+        matrix = np.load(path, mmap_mode="r")
+        product_ids = np.load(path.with_name(f"{path.stem}_ids.npy"))
+        if matrix.ndim != 2 or len(product_ids) != len(matrix):
+            raise ValueError(f"{path}: {matrix.shape} vectors for {len(product_ids)} ids")
+
+        def read_block(start: int, end: int) -> np.ndarray:
+            block = np.array(matrix[start:end], dtype=np.float32)
+            faiss.normalize_L2(block)
+            return block
+
+        self.full_matrix = matrix
+        self._build_index(product_ids.tolist(), read_block, mode)
+
+    def _build_index(self, product_ids: list[int], read_block, mode: str, block_size: int = 4096):
+        """
+        Собирает матрицу поиска блоками: decode -> проекция (PCA/усечение) -> квантование.
+        read_block(start, end) возвращает нормализованные float32 векторы полной размерности.
+        """
+        if not product_ids:
+            logger.warning("No embeddings to index")
+            return
+
+        raw_dim = read_block(0, 1).shape[1]
+        self.projection = load_projection(settings.embedding_reduction, raw_dim, settings.embedding_dim)
+        dim = self.projection.out_dim if self.projection else raw_dim
+
+        dtype = {"float32": np.float32, "float16": np.float16, "int8": np.int8}[mode]
+        matrix = np.empty((len(product_ids), dim), dtype=dtype)
+        scales = np.empty(len(product_ids), dtype=np.float32) if mode == "int8" else None
+
+        for start in range(0, len(product_ids), block_size):
+            end = min(start + block_size, len(product_ids))
+            block = read_block(start, end)
+            if self.projection:
+                block = self.projection.apply(block)
+            codes, block_scales = quantize(block, mode)
+            matrix[start:end] = codes
+            if scales is not None:
+                scales[start:end] = block_scales
+
+        self.product_ids = list(product_ids)
+        self.product_id_to_idx = {pid: i for i, pid in enumerate(self.product_ids)}
+        self.embeddings_matrix = matrix
+        self.embedding_scales = scales
+
+        if mode == "float32":
+            self.index = faiss.IndexFlatIP(dim)
+            self.index.add(matrix)
+        else:
+            self.index = CompactIndex(matrix, scales)
+
+        self.needs_rescore = (mode != "float32" or self.projection is not None) and settings.embedding_rescore_k > 0
+
+        reduction = f", {self.projection.method} {raw_dim}->{dim}" if self.projection else ""
+        logger.info(f"Loaded {len(self.product_ids)} embeddings into {mode} index{reduction}")
 
-        for i, row in enumerate(rows):
-            self.product_ids.append(row[0])
-            self.product_id_to_idx[row[0]] = i
-            embeddings.append(np.array(row[1], dtype=np.float32))
+    @staticmethod
+    def _decode_row(row, mode: str) -> np.ndarray:
+        """Нормализованный float32 вектор полной размерности"""
+        if mode != "float32" and row[1] is not None:
+            codes, scale = decode_vector(row[1], mode)
+            return dequantize(codes, scale)
+        vec = np.array(row[-1], dtype=np.float32)
+        return vec / (np.linalg.norm(vec) + 1e-8)
+
+    def _query_vector(self, product_id: int) -> np.ndarray:
+        """Нормализованный вектор товара в пространстве индекса"""
+        idx = self.product_id_to_idx[product_id]
+        if self.embeddings_matrix.dtype == np.float32:
+            return self.embeddings_matrix[idx:idx+1]
+        return dequantize(self.embeddings_matrix[idx:idx+1], None if self.embedding_scales is None else self.embedding_scales[idx:idx+1])
+
+    async def _rescore_exact(
+        self,
+        session: AsyncSession,
+        product_id: int,
+        candidate_ids: list[int],
+        semantic_scores: dict[int, float],
+    ) -> set[int]:
+        """
+        Пересчитывает точный косинус полной размерности: по memmap из embeddings_file —
+        для всех кандидатов (без обращения к БД), иначе для топ-K по FLOAT[] из БД.
+        Возвращает множество пересчитанных кандидатов. Пул не сужается: хвост с
+        приближёнными скорами (смещёнными относительно точных) ранжируется ниже пересчитанной
+        головы. Без точного вектора самого товара возвращается пустое множество.
+        """
+        # В пониженной размерности порядок кандидатов грубый: если точные векторы под рукой,
+        # пересчитываем весь пул
+        top_ids = candidate_ids if self.full_matrix is not None else candidate_ids[:settings.embedding_rescore_k]
+        if not top_ids:
+            return set()
+
+        if self.full_matrix is not None:
+            exact = {
+                pid: self.full_matrix[self.product_id_to_idx[pid]]
+                for pid in [product_id] + top_ids
+                if pid in self.product_id_to_idx
+            }
+        else:
+            exact = await queries.get_embeddings_map(session, [product_id] + top_ids)
+        main_embedding = exact.get(product_id)
+        if main_embedding is None:
+            return set()
 
-        self.embeddings_matrix = np.vstack(embeddings)
-        faiss.normalize_L2(self.embeddings_matrix)
+        ids = [cid for cid in top_ids if exact.get(cid) is not None]
+        if not ids:
+            return set()
 
-        self.index = faiss.IndexFlatIP(self.embeddings_matrix.shape[1])
-        self.index.add(self.embeddings_matrix)
+        main_vec = np.array(main_embedding, dtype=np.float32)
+        main_vec /= np.linalg.norm(main_vec) + 1e-8
+        matrix = np.asarray([exact[cid] for cid in ids], dtype=np.float32)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-8
 
-        logger.info(f"Loaded {len(self.product_ids)} embeddings into FAISS index")
+        for cid, score in zip(ids, matrix @ main_vec):
+            semantic_scores[cid] = float(score)
+        return set(ids)
 
     async def get_recommendations(
         self,
@@ -69,43 +228,46 @@ class ProductRecommender:
         4. Иначе: используем формульный скоринг (эмбеддинги + фидбек + скидки)
         5. Возвращаем топ-20
         """
-        product = await queries.get_product_by_id(session, product_id)
+        with span("product"):
+            product = await queries.get_product_by_id(session, product_id)
         if not product:
             return {"product_id": product_id, "recommendations": [], "error": "Product not found"}
 
         scenario = scenarios_service.detect_scenario_for_product(product["category_id"])
         detected_scenario = None
 
-        if scenario:
-            detected_scenario = {"id": scenario.id, "name": scenario.name}
-            candidate_limit = 100 if use_ml else limit
-            recommendations = await self._get_scenario_based_recommendations(
-                product, scenario, session, candidate_limit
-            )
-        else:
-            candidate_limit = 100 if use_ml else limit
-            recommendations = await self._get_semantic_recommendations(
-                product, session, candidate_limit
-            )
+        with span("candidates"):
+            if scenario:
+                detected_scenario = {"id": scenario.id, "name": scenario.name}
+                candidate_limit = 100 if use_ml else limit
+                recommendations = await self._get_scenario_based_recommendations(
+                    product, scenario, session, candidate_limit
+                )
+            else:
+                candidate_limit = 100 if use_ml else limit
+                recommendations = await self._get_semantic_recommendations(
+                    product, session, candidate_limit
+                )
 
         ranking_method = "formula"
         if use_ml and catboost_ranker.model and recommendations:
             try:
-                candidates = [rec["product"] for rec in recommendations]
-                ranked_candidates = await catboost_ranker.rank_candidates(
-                    main_product=product,
-                    candidates=candidates,
-                    session=session,
-                )
-
-                for i, rec in enumerate(recommendations):
-                    for ranked in ranked_candidates:
-                        if ranked["id"] == rec["product"]["id"]:
-                            rec["ml_score"] = ranked.get("ml_score", rec["score"])
-                            rec["score"] = ranked.get("ml_score", rec["score"])
-                            break
-
-                recommendations.sort(key=lambda x: x["score"], reverse=True)
+                with span("rank"):
+                    candidates = [rec["product"] for rec in recommendations]
+                    ranked_candidates = await catboost_ranker.rank_candidates(
+                        main_product=product,
+                        candidates=candidates,
+                        session=session,
+                    )
+
+                    for i, rec in enumerate(recommendations):
+                        for ranked in ranked_candidates:
+                            if ranked["id"] == rec["product"]["id"]:
+                                rec["ml_score"] = ranked.get("ml_score", rec["score"])
+                                rec["score"] = ranked.get("ml_score", rec["score"])
+                                break
+
+                    recommendations.sort(key=lambda x: x["score"], reverse=True)
                 ranking_method = "catboost"
 
             except Exception as e:
@@ -136,7 +298,8 @@ class ProductRecommender:
         product_id = product["id"]
         product_category = product["category_id"]
 
-        main_embedding = await queries.get_product_embedding(session, product_id)
+        with span("candidates.lookup"):
+            main_embedding = await queries.get_product_embedding(session, product_id)
 
         all_candidates = []
 
@@ -147,56 +310,58 @@ class ProductRecommender:
             if not group.category_ids:
                 continue
 
-            group_products = await queries.get_products_by_categories(
-                session,
-                group.category_ids,
-                exclude_ids=[product_id],
-                limit=50,
-            )
-
-            if not group_products:
-                continue
-
-            candidate_ids = [p["id"] for p in group_products]
-            embeddings_map = await queries.get_embeddings_map(session, candidate_ids)
+            with span("candidates.lookup"):
+                group_products = await queries.get_products_by_categories(
+                    session,
+                    group.category_ids,
+                    exclude_ids=[product_id],
+                    limit=50,
+                )
 
-            pair_stats = await queries.get_pair_feedback_stats(session, product_id, candidate_ids)
-            scenario_stats = await queries.get_scenario_feedback_stats(
-                session, scenario.id, group.name, candidate_ids
-            )
+                if not group_products:
+                    continue
 
-            for candidate in group_products:
-                cid = candidate["id"]
-                score = self._calculate_score(
-                    main_embedding=main_embedding,
-                    candidate_embedding=embeddings_map.get(cid),
-                    pair_stats=pair_stats.get(cid, {"positive": 0, "negative": 0}),
-                    scenario_stats=scenario_stats.get(cid, {"positive": 0, "negative": 0}),
-                    discount_price=candidate.get("discount_price"),
-                    price=candidate.get("price"),
-                )
+                candidate_ids = [p["id"] for p in group_products]
+                embeddings_map = await queries.get_embeddings_map(session, candidate_ids)
 
-                match_reasons = self._build_match_reasons(
-                    candidate=candidate,
-                    pair_stats=pair_stats.get(cid),
-                    scenario_stats=scenario_stats.get(cid),
-                    main_embedding=main_embedding,
-                    candidate_embedding=embeddings_map.get(cid),
+                pair_stats = await feedback_store.get_pair_stats(session, product_id, candidate_ids)
+                scenario_stats = await feedback_store.get_scenario_stats(
+                    session, scenario.id, group.name, candidate_ids
                 )
 
-                all_candidates.append({
-                    "product": {
-                        "id": candidate["id"],
-                        "name": candidate["name"],
-                        "price": candidate["price"],
-                        "picture": candidate["picture"],
-                        "category_name": candidate["category_name"],
-                        "discount_price": candidate.get("discount_price"),
-                    },
-                    "score": round(score, 3),
-                    "group_name": group.name,
-                    "match_reasons": match_reasons,
-                })
+            with span("candidates.scoring"):
+                for candidate in group_products:
+                    cid = candidate["id"]
+                    score = self._calculate_score(
+                        main_embedding=main_embedding,
+                        candidate_embedding=embeddings_map.get(cid),
+                        pair_stats=pair_stats.get(cid, {"positive": 0, "negative": 0}),
+                        scenario_stats=scenario_stats.get(cid, {"positive": 0, "negative": 0}),
+                        discount_price=candidate.get("discount_price"),
+                        price=candidate.get("price"),
+                    )
+
+                    match_reasons = self._build_match_reasons(
+                        candidate=candidate,
+                        pair_stats=pair_stats.get(cid),
+                        scenario_stats=scenario_stats.get(cid),
+                        main_embedding=main_embedding,
+                        candidate_embedding=embeddings_map.get(cid),
+                    )
+
+                    all_candidates.append({
+                        "product": {
+                            "id": candidate["id"],
+                            "name": candidate["name"],
+                            "price": candidate["price"],
+                            "picture": candidate["picture"],
+                            "category_name": candidate["category_name"],
+                            "discount_price": candidate.get("discount_price"),
+                        },
+                        "score": round(score, 3),
+                        "group_name": group.name,
+                        "match_reasons": match_reasons,
+                    })
 
         all_candidates.sort(key=lambda x: x["score"], reverse=True)
 
@@ -224,13 +389,13 @@ class ProductRecommender:
         if self.index is None or product_id not in self.product_id_to_idx:
             return []
 
-        main_root_category = await queries.get_root_category_id(session, product["category_id"])
-
-        idx = self.product_id_to_idx[product_id]
-        query_vec = self.embeddings_matrix[idx:idx+1]
+        with span("candidates.lookup"):
+            main_root_category = await queries.get_root_category_id(session, product["category_id"])
 
-        k = min(500, len(self.product_ids))
-        scores, indices = self.index.search(query_vec, k)
+        with span("candidates.faiss"):
+            query_vec = self._query_vector(product_id)
+            k = min(500, len(self.product_ids))
+            scores, indices = self.index.search(query_vec, k)
 
         candidate_ids = []
         semantic_scores = {}
@@ -240,83 +405,94 @@ class ProductRecommender:
                 candidate_ids.append(cid)
                 semantic_scores[cid] = float(score)
 
-        products_map = await queries.get_products_by_ids(session, candidate_ids)
+        rescored = None  # None — все скоры одного рода (точные или приближённые)
+        if self.needs_rescore:
+            with span("candidates.rescore"):
+                rescored = await self._rescore_exact(session, product_id, candidate_ids, semantic_scores) or None
 
-        candidate_category_ids = list(set(p["category_id"] for p in products_map.values()))
-        root_categories_map = await queries.get_root_categories_map(session, candidate_category_ids)
+        with span("candidates.lookup"):
+            products_map = await queries.get_products_by_ids(session, candidate_ids, available_only=True)
 
-        copurchase_stats = await queries.get_copurchase_stats(session, product_id, candidate_ids)
+            candidate_category_ids = list(set(p["category_id"] for p in products_map.values()))
+            root_categories_map = await queries.get_root_categories_map(session, candidate_category_ids)
 
-        scored_candidates = []
-        for cid, cproduct in products_map.items():
-            if cproduct["category_id"] == product["category_id"]:
-                continue
+            copurchase_stats = await queries.get_copurchase_stats(session, product_id, candidate_ids)
 
-            base_score = semantic_scores.get(cid, 0.5)
+        with span("candidates.scoring"):
+            scored_candidates = []
+            for cid, cproduct in products_map.items():
+                if cproduct["category_id"] == product["category_id"]:
+                    continue
 
-            copurchase_count = copurchase_stats.get(cid, 0)
-            copurchase_boost = min(copurchase_count * 0.15, 0.3)
+                base_score = semantic_scores.get(cid, 0.5)
 
-            candidate_root = root_categories_map.get(cproduct["category_id"])
-            category_penalty = 0
-            if main_root_category and candidate_root and candidate_root != main_root_category:
-                category_penalty = 0.15
+                copurchase_count = copurchase_stats.get(cid, 0)
+                copurchase_boost = min(copurchase_count * 0.15, 0.3)
 
-            final_score = base_score + copurchase_boost - category_penalty
+                candidate_root = root_categories_map.get(cproduct["category_id"])
+                category_penalty = 0
+                if main_root_category and candidate_root and candidate_root != main_root_category:
+                    category_penalty = 0.15
 
-            match_reasons = []
+                final_score = base_score + copurchase_boost - category_penalty
 
-            # Категория товара
-            if cproduct.get("category_name"):
-                match_reasons.append({
-                    "type": "category",
-                    "text": f"Категория: {cproduct['category_name']}",
-                })
+                match_reasons = []
 
-            # Совместные покупки
-            if copurchase_count > 0:
-                match_reasons.append({
-                    "type": "copurchase",
-                    "text": f"Покупают вместе: {copurchase_count}x",
-                })
+                # Категория товара
+                if cproduct.get("category_name"):
+                    match_reasons.append({
+                        "type": "category",
+                        "text": f"Категория: {cproduct['category_name']}",
+                    })
 
-            # Семантическая схожесть
-            match_reasons.append({
-                "type": "semantic",
-                "text": f"Семантика: {base_score:.0%}",
-            })
+                # Совместные покупки
+                if copurchase_count > 0:
+                    match_reasons.append({
+                        "type": "copurchase",
+                        "text": f"Покупают вместе: {copurchase_count}x",
+                    })
 
-            # Из другой корневой категории
-            if category_penalty > 0:
+                # Семантическая схожесть
                 match_reasons.append({
-                    "type": "category_cross",
-                    "text": "Из смежной категории",
+                    "type": "semantic",
+                    "text": f"Семантика: {base_score:.0%}",
                 })
 
-            # Скидка
-            if cproduct.get("discount_price") and cproduct.get("price"):
-                discount_pct = int((1 - cproduct["discount_price"] / cproduct["price"]) * 100)
-                if discount_pct > 0:
+                # Из другой корневой категории
+                if category_penalty > 0:
                     match_reasons.append({
-                        "type": "discount",
-                        "text": f"Скидка {discount_pct}%",
+                        "type": "category_cross",
+                        "text": "Из смежной категории",
                     })
 
-            scored_candidates.append({
-                "product": {
-                    "id": cproduct["id"],
-                    "name": cproduct["name"],
-                    "price": cproduct["price"],
-                    "picture": cproduct["picture"],
-                    "category_name": cproduct["category_name"],
-                    "discount_price": cproduct.get("discount_price"),
-                },
-                "score": round(final_score, 3),
-                "group_name": "Рекомендуем к покупке" if copurchase_count > 0 else "Похожие товары",
-                "match_reasons": match_reasons,
-            })
+                # Скидка
+                if cproduct.get("discount_price") and cproduct.get("price"):
+                    discount_pct = int((1 - cproduct["discount_price"] / cproduct["price"]) * 100)
+                    if discount_pct > 0:
+                        match_reasons.append({
+                            "type": "discount",
+                            "text": f"Скидка {discount_pct}%",
+                        })
 
-        scored_candidates.sort(key=lambda x: x["score"], reverse=True)
+                scored_candidates.append({
+                    "product": {
+                        "id": cproduct["id"],
+                        "name": cproduct["name"],
+                        "price": cproduct["price"],
+                        "picture": cproduct["picture"],
+                        "category_name": cproduct["category_name"],
+                        "discount_price": cproduct.get("discount_price"),
+                    },
+                    "score": round(final_score, 3),
+                    "group_name": "Рекомендуем к покупке" if copurchase_count > 0 else "Похожие товары",
+                    "match_reasons": match_reasons,
+                })
+
+            # Точные и приближённые косинусы несравнимы: сначала пересчитанные, затем хвост
+            scored_candidates.sort(
+                key=lambda x: (rescored is None or x["product"]["id"] in rescored, x["score"]),
+                reverse=True,
+            )
         for i, item in enumerate(scored_candidates[:limit]):
             item["rank"] = i + 1
 
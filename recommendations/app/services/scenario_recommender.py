@@ -3,7 +3,9 @@ from typing import Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from ..core.embeddings import cosine_similarity
+from ..core.tracing import span
 from ..db import queries
+from ..db.feedback_store import feedback_store
 from .scenarios import scenarios_service, Scenario
 
 
@@ -25,21 +27,23 @@ class ScenarioRecommender:
         if not scenario:
             return {"error": "Scenario not found"}
 
-        cart_products = await queries.get_products_by_ids(session, cart_product_ids)
+        with span("cart"):
+            cart_products = await queries.get_products_by_ids(session, cart_product_ids)
         cart_category_ids = [p["category_id"] for p in cart_products.values()]
 
         groups_status = self._analyze_groups(scenario, cart_products, cart_category_ids)
 
         recommendations = []
         for missing_group in groups_status["missing"]:
-            group_recs = await self._get_group_recommendations(
-                scenario=scenario,
-                group_name=missing_group["group_name"],
-                category_ids=missing_group["category_ids"],
-                cart_products=cart_products,
-                session=session,
-                limit=limit_per_group,
-            )
+            with span("groups"):
+                group_recs = await self._get_group_recommendations(
+                    scenario=scenario,
+                    group_name=missing_group["group_name"],
+                    category_ids=missing_group["category_ids"],
+                    cart_products=cart_products,
+                    session=session,
+                    limit=limit_per_group,
+                )
 
             if group_recs:
                 recommendations.append({
@@ -50,12 +54,13 @@ class ScenarioRecommender:
                 })
 
         if not recommendations and groups_status["completed"]:
-            alternatives = await self._get_alternatives(
-                scenario=scenario,
-                cart_products=cart_products,
-                session=session,
-                limit=5,
-            )
+            with span("alternatives"):
+                alternatives = await self._get_alternatives(
+                    scenario=scenario,
+                    cart_products=cart_products,
+                    session=session,
+                    limit=5,
+                )
             if alternatives:
                 recommendations.append({
                     "group_name": "Альтернативы",
@@ -139,60 +144,62 @@ class ScenarioRecommender:
 
         cart_ids = list(cart_products.keys())
 
-        candidates = await queries.get_products_by_categories(
-            session, category_ids, exclude_ids=cart_ids, limit=100
-        )
-
-        if not candidates:
-            return []
+        with span("groups.lookup"):
+            candidates = await queries.get_products_by_categories(
+                session, category_ids, exclude_ids=cart_ids, limit=100
+            )
 
-        candidate_ids = [p["id"] for p in candidates]
-        embeddings_map = await queries.get_embeddings_map(session, candidate_ids)
+            if not candidates:
+                return []
 
-        cart_embeddings_map = await queries.get_embeddings_map(session, cart_ids)
-        cart_embeddings = [
-            np.array(e, dtype=np.float32)
-            for e in cart_embeddings_map.values()
-            if e is not None
-        ]
+            candidate_ids = [p["id"] for p in candidates]
+            embeddings_map = await queries.get_embeddings_map(session, candidate_ids)
 
-        scenario_stats = await queries.get_scenario_feedback_stats(
-            session, scenario.id, group_name, candidate_ids
-        )
+            cart_embeddings_map = await queries.get_embeddings_map(session, cart_ids)
+            cart_embeddings = [
+                np.array(e, dtype=np.float32)
+                for e in cart_embeddings_map.values()
+                if e is not None
+            ]
 
-        scored = []
-        for product in candidates:
-            pid = product["id"]
-            score = self._calculate_group_score(
-                product=product,
-                embedding=embeddings_map.get(pid),
-                cart_embeddings=cart_embeddings,
-                stats=scenario_stats.get(pid, {"positive": 0, "negative": 0}),
+            scenario_stats = await feedback_store.get_scenario_stats(
+                session, scenario.id, group_name, candidate_ids
             )
 
-            stats = scenario_stats.get(pid, {"positive": 0, "negative": 0})
-            total = stats["positive"] + stats["negative"]
-            if total > 0:
-                approval = int((stats["positive"] / total) * 100)
-                reason = f"{approval}% пользователей одобрили"
-            elif product.get("discount_price"):
-                discount = int((1 - product["discount_price"] / product["price"]) * 100)
-                reason = f"Скидка {discount}%"
-            else:
-                reason = "Подходит для сценария"
-
-            scored.append({
-                "id": product["id"],
-                "name": product["name"],
-                "price": product["price"],
-                "picture": product["picture"],
-                "category_name": product["category_name"],
-                "discount_price": product.get("discount_price"),
-                "score": round(score, 3),
-                "reason": reason,
-            })
-
-        scored.sort(key=lambda x: x["score"], reverse=True)
+        with span("groups.scoring"):
+            scored = []
+            for product in candidates:
+                pid = product["id"]
+                score = self._calculate_group_score(
+                    product=product,
+                    embedding=embeddings_map.get(pid),
+                    cart_embeddings=cart_embeddings,
+                    stats=scenario_stats.get(pid, {"positive": 0, "negative": 0}),
+                )
+
+                stats = scenario_stats.get(pid, {"positive": 0, "negative": 0})
+                total = stats["positive"] + stats["negative"]
+                if total > 0:
+                    approval = int((stats["positive"] / total) * 100)
+                    reason = f"{approval}% пользователей одобрили"
+                elif product.get("discount_price"):
+                    discount = int((1 - product["discount_price"] / product["price"]) * 100)
+                    reason = f"Скидка {discount}%"
+                else:
+                    reason = "Подходит для сценария"
+
+                scored.append({
+                    "id": product["id"],
+                    "name": product["name"],
+                    "price": product["price"],
+                    "picture": product["picture"],
+                    "category_name": product["category_name"],
+                    "discount_price": product.get("discount_price"),
+                    "score": round(score, 3),
+                    "reason": reason,
+                })
+
+            scored.sort(key=lambda x: x["score"], reverse=True)
         return scored[:limit]
 
     def _calculate_group_score(
@@ -287,10 +294,11 @@ class ScenarioRecommender:
                 session=session,
             )
 
-        cart_products = await queries.get_products_by_ids(session, cart_product_ids)
-        cart_category_ids = [p["category_id"] for p in cart_products.values()]
+        with span("detect"):
+            cart_products = await queries.get_products_by_ids(session, cart_product_ids)
+            cart_category_ids = [p["category_id"] for p in cart_products.values()]
 
-        match = scenarios_service.detect_scenario_for_cart(cart_category_ids)
+            match = scenarios_service.detect_scenario_for_cart(cart_category_ids)
 
         if not match:
             first_scenario = list(scenarios_service.scenarios.values())[0]